@@ -0,0 +1,182 @@
+import asyncio
+import contextvars
+import json
+import logging
+from collections import defaultdict
+from typing import Callable
+
+from anyio import to_thread
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import crud
+import database
+import schemas
+
+from settings import get_settings
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+# Changes of these fields are pushed to watchers
+WATCHED_FIELDS = {'price', 'quantity', 'product'}
+
+# Part numbers per IN (...) query
+CHUNK_SIZE = 500
+
+
+class Subscription:
+    """
+    Watcher of a set of part numbers. Gets encoded events through its queue,
+    None once it has lagged too much and has to reconnect.
+    """
+
+    def __init__(self, part_numbers: frozenset[str], queue_size: int):
+        self.part_numbers = part_numbers
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+
+    def put(self, event: bytes) -> None:
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.queue.maxsize - 1:
+            self.closed = True
+            self.queue.put_nowait(None)
+        else:
+            self.queue.put_nowait(event)
+
+
+def encode_event(name: str, data: list[dict]) -> bytes:
+    return f'event: {name}\ndata: {json.dumps(jsonable_encoder(data))}\n\n'.encode()
+
+
+def read_stock(db: Session, part_numbers: list[str], version: int) -> list[dict]:
+    """
+    Current price and quantity of the part numbers. Missing ones come with None values.
+    """
+    found = {}
+    for start in range(0, len(part_numbers), CHUNK_SIZE):
+        for part_no, price, quantity in crud.get_stock(db, part_numbers[start:start + CHUNK_SIZE]):
+            found[part_no] = {'part_no': part_no, 'price': price, 'quantity': quantity, 'version': version}
+    return [
+        schemas.StockChange(**found.get(part_no, {'part_no': part_no, 'version': version})).dict()
+        for part_no in part_numbers
+    ]
+
+
+class ChangeBroadcaster:
+    """
+    Pushes price and stock changes of the catalogue to the watchers of the part numbers.
+    A single task per worker polls catalogue version while anyone is watching,
+    and reads the changes of watched part numbers only when the version is bumped.
+    Every change is encoded once, however many watchers it is sent to.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], poll_seconds: float, queue_size: int):
+        self.session_factory = session_factory
+        self.poll_seconds = poll_seconds
+        self.queue_size = queue_size
+        # part number -> its watchers
+        self.watchers: dict[str, set[Subscription]] = defaultdict(set)
+        self.version: int | None = None
+        self.task: asyncio.Task | None = None
+
+    def subscribe(self, part_numbers: frozenset[str]) -> Subscription:
+        subscription = Subscription(part_numbers, self.queue_size)
+        for part_no in part_numbers:
+            self.watchers[part_no].add(subscription)
+        if self.task is None:
+            # Polling outlives the request, so it doesn't take the request context along, e.g. its query deadline
+            self.task = contextvars.Context().run(asyncio.create_task, self.poll())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for part_no in subscription.part_numbers:
+            if (watchers := self.watchers.get(part_no)) is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self.watchers[part_no]
+        if not self.watchers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.version = None
+
+    async def snapshot(self, subscription: Subscription) -> bytes:
+        """
+        Current values of the watched part numbers as the first event of the stream.
+        """
+        def read() -> tuple[int, list[dict]]:
+            with self.session_factory() as db:
+                version = database.get_catalogue_version(db)
+                return version, read_stock(db, sorted(subscription.part_numbers), version)
+
+        version, stock = await to_thread.run_sync(read)
+        # Changes are polled from the version of the first snapshot, so none is missed in between
+        if self.version is None:
+            self.version = version
+        return encode_event('snapshot', stock)
+
+    async def poll(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(self.poll_seconds)
+                if self.version is None:
+                    continue
+                version, changes = await to_thread.run_sync(self.read_changes, self.version, list(self.watchers))
+                self.version = version
+                self.publish(changes)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Reading of catalogue changes failed')
+                await asyncio.sleep(self.poll_seconds)
+
+    def read_changes(self, since: int, part_numbers: list[str]) -> tuple[int, list[dict]]:
+        """
+        Price and stock of the part numbers changed after the catalogue version.
+        All of them are re-read if the changelog doesn't cover the versions.
+        """
+        with self.session_factory() as db:
+            version = database.get_catalogue_version(db)
+            if version == since or not part_numbers:
+                return version, []
+            try:
+                versions = crud.get_versions_since(db, since)
+            except OperationalError:
+                # Catalogue file without changelog
+                db.rollback()
+                return version, read_stock(db, part_numbers, version)
+            if [v.version for v in versions] != list(range(since + 1, version + 1)) or any(v.full for v in versions):
+                return version, read_stock(db, part_numbers, version)
+            changed = set()
+            for start in range(0, len(part_numbers), CHUNK_SIZE):
+                for part_no, change, fields in crud.get_part_changes(
+                        db, since, version, part_numbers[start:start + CHUNK_SIZE]):
+                    if change != 'update' or WATCHED_FIELDS & set(fields.split(',')):
+                        changed.add(part_no)
+            return version, read_stock(db, sorted(changed), version)
+
+    def publish(self, changes: list[dict]) -> None:
+        events: dict[Subscription, list[dict]] = defaultdict(list)
+        for change in changes:
+            for subscription in self.watchers.get(change['part_no'], ()):
+                events[subscription].append(change)
+        # Watchers of the same part numbers get the same encoded event
+        encoded = {}
+        for subscription, subscription_changes in events.items():
+            key = tuple(change['part_no'] for change in subscription_changes)
+            if key not in encoded:
+                encoded[key] = encode_event('change', subscription_changes)
+            subscription.put(encoded[key])
+
+
+# Catalogue name -> its broadcaster
+broadcasters = {
+    name: ChangeBroadcaster(
+        catalogue.SessionLocal,
+        poll_seconds=settings.WATCH_POLL_SECONDS,
+        queue_size=settings.WATCH_QUEUE_SIZE,
+    )
+    for name, catalogue in database.catalogues.items()
+}
@@ -1,15 +1,23 @@
-from sqlalchemy import select
-from sqlalchemy.orm import Session, joinedload, selectinload
+import json
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session, aliased, joinedload, load_only, raiseload, selectinload
 
 from models import (
     Group,
     Section,
     SubSection,
     PartNumber,
-    Product
+    Product,
+    MasterData,
+    CatalogueVersion,
+    CatalogueChange,
+    partnumber_junction,
 )
+from singleflight import coalesced
 
 
+@coalesced
 def get_all_groups(db: Session):
     # These run multiple queries:
     # return db.query(Section).all()
@@ -24,6 +32,40 @@ def get_all_groups(db: Session):
         select_from(Group).join(SubSection).join(Section).all()
 
 
+@coalesced
+def get_sections(db: Session):
+    return db.query(Section.id, Section.title).order_by(Section.id).all()
+
+
+@coalesced
+def get_subsections(db: Session):
+    return db.query(SubSection.id, SubSection.title, SubSection.sect_id).order_by(SubSection.id).all()
+
+
+@coalesced
+def get_group_counts(db: Session):
+    """
+    Groups with count of their products.
+    """
+    stmt = select(Group.id, Group.title, Group.subsect_id, func.count(Product.id)).\
+        join(Product, Product.subsub_id == Group.id, isouter=True).\
+        group_by(Group.id).order_by(Group.id)
+    return db.execute(stmt).all()
+
+
+def get_dimensions(db: Session):
+    """
+    Dimensions and gross weight of the products with masterdata, in units of the masterdata.
+    """
+    stmt = select(MasterData.id, PartNumber.part_no, Product.title_en,
+                  MasterData.length, MasterData.width, MasterData.height, MasterData.measure_unit,
+                  MasterData.gross, MasterData.weight_unit).\
+        join(MasterData, MasterData.partnum_id == PartNumber.id).\
+        join(Product, isouter=True).order_by(MasterData.id)
+    return db.execute(stmt).all()
+
+
+@coalesced
 def get_products_by_group(db: Session, group_id: int):
     return db.query(PartNumber.part_no, Product.title_en).\
         select_from(Product).\
@@ -31,6 +73,46 @@ def get_products_by_group(db: Session, group_id: int):
         filter(Product.subsub_id == group_id).all()
 
 
+# Columns added to listing rows by expand= parameter, in the order of EXPANSIONS
+EXPANSIONS = ('price', 'stock', 'masterdata')
+EXPANSION_COLUMNS = {
+    'price': (Product.price, ),
+    'stock': (Product.quantity, ),
+    'masterdata': (MasterData.ean, MasterData.gross, MasterData.net, MasterData.weight_unit, MasterData.length,
+                   MasterData.width, MasterData.height, MasterData.measure_unit, MasterData.volume,
+                   MasterData.volume_unit),
+}
+
+
+def expand_listing(stmt, expand: frozenset[str]):
+    """
+    Listing statement with the columns of the expansions added, in the same query.
+    """
+    stmt = stmt.add_columns(*(column for name in EXPANSIONS if name in expand for column in EXPANSION_COLUMNS[name]))
+    if 'masterdata' in expand:
+        stmt = stmt.join(MasterData, MasterData.partnum_id == PartNumber.id, isouter=True)
+    return stmt
+
+
+@coalesced
+def get_expanded_products_by_group(db: Session, group_id: int, expand: frozenset[str]):
+    """
+    Rows of part number, title and the columns of the expansions.
+    """
+    stmt = select(PartNumber.part_no, Product.title_en).\
+        select_from(Product).\
+        join(PartNumber)
+    return db.execute(expand_listing(stmt, expand).where(Product.subsub_id == group_id)).all()
+
+
+@coalesced
+def get_price_list(db: Session):
+    stmt = select(PartNumber.part_no, Product.title_en, Product.title_ua, Product.min_order,
+                  Product.quantity, Product.price).\
+        join(Product).order_by(PartNumber.part_no)
+    return db.execute(stmt).all()
+
+
 def get_partnum(db: Session, part_no: str):
     stmt = select(PartNumber)\
         .options(joinedload(PartNumber.product),
@@ -41,7 +123,155 @@ def get_partnum(db: Session, part_no: str):
     return db.execute(stmt).scalar()
 
 
+def partnum_fields_options(fields: dict[str, frozenset[str]]) -> list:
+    """
+    Loader options of PartNumber with only the requested columns and relationships loaded.
+    :param fields: PartNumber attribute -> its attributes to load, empty for all of them
+    """
+    options = [load_only(*(getattr(PartNumber, name) for name in ('part_no', 'discontinued', 'new_release')
+                           if name == 'part_no' or name in fields))]
+    for name, model in (('product', Product), ('masterdata', MasterData)):
+        if name not in fields:
+            continue
+        loader = joinedload(getattr(PartNumber, name))
+        if columns := {column for column in fields[name] if column in model.__table__.columns}:
+            loader = loader.load_only(*(getattr(model, column) for column in columns))
+        elif fields[name]:
+            loader = loader.load_only(model.id)
+        options.append(loader)
+        if model is Product and (not fields[name] or 'group' in fields[name]):
+            options.append(joinedload(PartNumber.product).joinedload(Product.group))
+    if 'refers' in fields:
+        options.append(selectinload(PartNumber.refers).load_only(PartNumber.part_no))
+    # Anything not requested is not loaded on access either
+    options.append(raiseload('*'))
+    return options
+
+
+def get_partnum_fields(db: Session, part_no: str, fields: dict[str, frozenset[str]]):
+    """
+    Part number with only the requested columns and relationships loaded.
+    :param fields: PartNumber attribute -> its attributes to load, empty for all of them
+    """
+    stmt = select(PartNumber).options(*partnum_fields_options(fields)).where(PartNumber.part_no == part_no)
+    return db.execute(stmt).scalar()
+
+
+def get_partnums(db: Session, part_numbers: list[str], fields: dict[str, frozenset[str]] | None = None):
+    """
+    Details of the part numbers in a single query, refers in one more.
+    Part numbers are passed as one JSON array, so their count isn't bound by SQLite variables limit.
+    :param fields: see get_partnum_fields, all of them if None
+    """
+    if fields is None:
+        options = [joinedload(PartNumber.product).joinedload(Product.group),
+                   joinedload(PartNumber.masterdata),
+                   selectinload(PartNumber.refers)]
+    else:
+        options = partnum_fields_options(fields)
+    listed = func.json_each(json.dumps(part_numbers)).table_valued('value')
+    stmt = select(PartNumber).options(*options).where(PartNumber.part_no.in_(select(listed.c.value)))
+    return db.execute(stmt).unique().scalars().all()
+
+
+@coalesced
+def get_part_numbers_by_ean(db: Session, eans: list[int]):
+    """
+    (ean, part_no) of the barcodes found, the least part number of a barcode if it's shared.
+    Barcodes are passed as one JSON array, so their count isn't bound by SQLite variables limit.
+    """
+    scanned = func.json_each(json.dumps(eans)).table_valued('value')
+    stmt = select(MasterData.ean, func.min(PartNumber.part_no)).\
+        join(PartNumber, PartNumber.id == MasterData.partnum_id).\
+        where(MasterData.ean.in_(select(scanned.c.value))).\
+        group_by(MasterData.ean)
+    return db.execute(stmt).all()
+
+
+@coalesced
 def search_products(db: Session, query):
     stmt = select(PartNumber.part_no, Product.title_en).\
         join(Product, isouter=True).where(PartNumber.part_no.like(query))
     return db.execute(stmt).all()
+
+
+@coalesced
+def search_expanded_products(db: Session, query: str, expand: frozenset[str]):
+    """
+    Rows of part number, title and the columns of the expansions.
+    Part numbers out of price have None in product columns.
+    """
+    stmt = select(PartNumber.part_no, Product.title_en).\
+        join(Product, isouter=True)
+    return db.execute(expand_listing(stmt, expand).where(PartNumber.part_no.like(query))).all()
+
+
+@coalesced
+def get_quote_rows(db: Session, part_numbers: list[str]):
+    """
+    Order terms of the part numbers in a single query: discontinued flag, min order, stock and price,
+    and for discontinued ones a row per successor with its discontinued flag and stock.
+    Part numbers are passed as one JSON array, so the size of the basket isn't bound by SQLite variables limit.
+    """
+    successor = aliased(PartNumber)
+    successor_product = aliased(Product)
+    basket = func.json_each(json.dumps(part_numbers)).table_valued('value')
+    stmt = select(PartNumber.part_no, PartNumber.discontinued,
+                  Product.min_order, Product.quantity, Product.price,
+                  successor.part_no, successor.discontinued, successor_product.quantity).\
+        select_from(PartNumber).\
+        join(Product, isouter=True).\
+        join(partnumber_junction,
+             and_(PartNumber.discontinued, partnumber_junction.c.predecessor == PartNumber.id), isouter=True).\
+        join(successor, successor.id == partnumber_junction.c.successor, isouter=True).\
+        join(successor_product, successor_product.partnum_id == successor.id, isouter=True).\
+        where(PartNumber.part_no.in_(select(basket.c.value)))
+    return db.execute(stmt).all()
+
+
+@coalesced
+def get_stock(db: Session, part_numbers: list[str]):
+    stmt = select(PartNumber.part_no, Product.price, Product.quantity).\
+        join(Product, isouter=True).where(PartNumber.part_no.in_(part_numbers))
+    return db.execute(stmt).all()
+
+
+def get_part_changes(db: Session, since: int, until: int, part_numbers: list[str]):
+    stmt = select(CatalogueChange.part_no, CatalogueChange.change, CatalogueChange.fields).\
+        where(CatalogueChange.version > since,
+              CatalogueChange.version <= until,
+              CatalogueChange.part_no.in_(part_numbers))
+    return db.execute(stmt).all()
+
+
+def get_versions_since(db: Session, since: int):
+    stmt = select(CatalogueVersion).where(CatalogueVersion.version > since).order_by(CatalogueVersion.version)
+    return db.execute(stmt).scalars().all()
+
+
+def get_changes_since(db: Session, since: int):
+    stmt = select(CatalogueChange.part_no, CatalogueChange.change, CatalogueChange.fields).\
+        where(CatalogueChange.version > since)
+    return db.execute(stmt).all()
+
+
+def get_last_full_version(db: Session) -> int | None:
+    stmt = select(func.max(CatalogueVersion.version)).where(CatalogueVersion.full)
+    return db.execute(stmt).scalar()
+
+
+def get_changes_page(db: Session, since: int, until: int, after: str, limit: int):
+    """
+    Changes of the part numbers going after the cursor, in part number order.
+    Every change of the part number within the versions range is returned.
+    """
+    in_range = (CatalogueChange.version > since) & (CatalogueChange.version <= until)
+    page = select(CatalogueChange.part_no).\
+        where(in_range, CatalogueChange.part_no > after).\
+        group_by(CatalogueChange.part_no).\
+        order_by(CatalogueChange.part_no).\
+        limit(limit).subquery()
+    stmt = select(CatalogueChange.part_no, CatalogueChange.version, CatalogueChange.change, CatalogueChange.fields).\
+        where(in_range, CatalogueChange.part_no.in_(select(page.c.part_no))).\
+        order_by(CatalogueChange.part_no, CatalogueChange.version)
+    return db.execute(stmt).all()
@@ -1,22 +1,79 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import os
+from typing import Literal
 
-from settings import ApiSettings
-settings = ApiSettings()
+from fastapi import Query
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.orm import Session, sessionmaker
 
+import deadlines
+from settings import get_settings
+settings = get_settings()
 
-DATABASE_URL = f"sqlite:///{settings.DATABASE_PATH}"
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={'check_same_thread': False},
-    echo=True,
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+class Catalogue:
+    """
+    Catalogue database served by the API, with its own engine and connection pool.
+    Sessions carry their catalogue in Session.info, so caches can be told apart.
+    A full import replaces the database file, pooled connections to the replaced file
+    are reconnected on checkout, so the new catalogue is served without a restart.
+    """
 
-def db_session():
-    db = SessionLocal()
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.engine = create_engine(
+            f"sqlite:///{path}",
+            connect_args={'check_same_thread': False},
+        )
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine, info={'catalogue': self})
+        # Queries of requests are interrupted past their deadline
+        event.listen(self.engine, 'connect', deadlines.set_progress_handler)
+        event.listen(self.engine, 'do_connect', self._record_file)
+        event.listen(self.engine, 'checkout', self._check_file)
+
+    def file_id(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _record_file(self, dialect, connection_record, cargs, cparams) -> None:
+        # Taken before the file is opened, so a replacement in between is caught on the next checkout
+        connection_record.info['file_id'] = self.file_id()
+
+    def _check_file(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        if connection_record.info.get('file_id') != self.file_id():
+            raise exc.DisconnectionError(f'Catalogue {self.name} file is replaced')
+
+
+catalogues: dict[str, Catalogue] = {
+    name: Catalogue(name, path)
+    for name, path in {settings.DEFAULT_CATALOGUE: settings.DATABASE_PATH, **settings.CATALOGUES}.items()
+}
+
+default_catalogue = catalogues[settings.DEFAULT_CATALOGUE]
+SessionLocal = default_catalogue.SessionLocal
+
+CatalogueName = Literal[tuple(catalogues)]
+
+
+def db_session(catalogue: CatalogueName = Query(default=settings.DEFAULT_CATALOGUE,
+                                                description='Catalogue to read')):
+    db = catalogues[catalogue].SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def get_catalogue(db: Session) -> Catalogue:
+    return db.info['catalogue']
+
+
+def get_catalogue_version(db: Session) -> int:
+    """
+    Version of the loaded catalogue. Stored in the database file header,
+    so it costs no table reads.
+    """
+    return db.execute(text('PRAGMA user_version')).scalar()
@@ -0,0 +1,136 @@
+import asyncio
+import sqlite3
+import time
+from contextvars import ContextVar
+
+from sqlalchemy.exc import OperationalError
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from settings import get_settings
+settings = get_settings()
+
+# SQLite VM instructions between the deadline checks
+PROGRESS_STEPS = 10000
+
+# Status of the requests whose client has gone, as nginx logs them
+CLIENT_CLOSED_REQUEST = 499
+
+
+class QueryGuard:
+    """
+    Deadline of the catalogue queries of a request, counted from the request start
+    and restarted by every part of the response sent, so streamed responses are bound
+    by the queries of a single part, not by how fast the client reads them.
+    Deadline of the route is looked up once the request is routed.
+    Queries are interrupted past the deadline or once the client has disconnected.
+    """
+
+    def __init__(self, scope: Scope):
+        self.scope = scope
+        self.started = time.monotonic()
+        self.deadline: float | None = None
+        self.cancelled = False
+        # 'timed_out' or 'cancelled' once a query is interrupted
+        self.interrupted: str | None = None
+
+    def restart(self) -> None:
+        self.started = time.monotonic()
+        self.deadline = None
+
+    def check(self) -> int:
+        """
+        Progress handler of SQLite. Non-zero result interrupts the query.
+        """
+        if self.cancelled:
+            self.interrupted = 'cancelled'
+            return 1
+        if self.deadline is None:
+            route = self.scope.get('route')
+            seconds = settings.QUERY_DEADLINES.get(getattr(route, 'name', None), settings.QUERY_DEADLINE_SECONDS)
+            self.deadline = self.started + seconds if seconds else float('inf')
+        if time.monotonic() > self.deadline:
+            self.interrupted = 'timed_out'
+            return 1
+        return 0
+
+
+# Guard of the current request. None out of requests, e.g. in warm-up or change polling.
+current_guard: ContextVar[QueryGuard | None] = ContextVar('current_guard', default=None)
+
+# Interrupted queries of the worker, by reason
+interrupted = {'timed_out': 0, 'cancelled': 0}
+
+
+def progress_handler() -> int:
+    # Worker threads of sync code run in a copy of the request context, so the guard is found there too
+    guard = current_guard.get()
+    return 0 if guard is None else guard.check()
+
+
+def set_progress_handler(dbapi_connection: sqlite3.Connection, connection_record) -> None:
+    """
+    Connect event listener of catalogue engines.
+    """
+    dbapi_connection.set_progress_handler(progress_handler, PROGRESS_STEPS)
+
+
+def stats() -> dict:
+    return dict(interrupted)
+
+
+class QueryDeadlineMiddleware:
+    """
+    Guards catalogue queries of HTTP requests with deadlines and cancels them once the client disconnects.
+    Request messages are pumped aside, so the disconnect is noticed while the endpoint is busy.
+    Interrupted requests are answered 504, or 499 if the client is gone.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        guard = QueryGuard(scope)
+        token = current_guard.set(guard)
+        messages: asyncio.Queue[Message] = asyncio.Queue()
+        response_started = False
+
+        async def pump() -> None:
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message['type'] == 'http.disconnect':
+                    guard.cancelled = True
+                    return
+
+        async def pumped_receive() -> Message:
+            if guard.cancelled and messages.empty():
+                return {'type': 'http.disconnect'}
+            return await messages.get()
+
+        async def tracked_send(message: Message) -> None:
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+            guard.restart()
+
+        pump_task = asyncio.create_task(pump())
+        try:
+            await self.app(scope, pumped_receive, tracked_send)
+        except (OperationalError, sqlite3.OperationalError):
+            if guard.interrupted is None or response_started:
+                raise
+            if guard.interrupted == 'cancelled':
+                response = JSONResponse({'detail': 'Client has disconnected'}, status_code=CLIENT_CLOSED_REQUEST)
+            else:
+                response = JSONResponse({'detail': 'Query deadline exceeded'}, status_code=504)
+            await response(scope, pumped_receive, send)
+        finally:
+            pump_task.cancel()
+            current_guard.reset(token)
+            if guard.interrupted is not None:
+                interrupted[guard.interrupted] += 1
@@ -1,3 +1,5 @@
+import time
+import uuid
 from typing import Annotated
 from datetime import datetime, timedelta
 from jose import JWTError, ExpiredSignatureError, jwt
@@ -9,11 +11,14 @@ from fastapi.security import OAuth2PasswordBearer, SecurityScopes
 from starlette.requests import Request
 
 import schemas
+from logs import annotate
+from revocation import denylist
+from server_timing import span
 from users import users
 from sqlite_um.user_manager import SQLiteUserManager
 
-from settings import ApiSettings
-settings = ApiSettings()
+from settings import get_settings
+settings = get_settings()
 
 
 class CookieOAuth2(OAuth2PasswordBearer):
@@ -87,16 +92,18 @@ def create_token(user_data: dict, expires_delta: timedelta = timedelta(hours=1))
     """
     data_to_encode = user_data.copy()
     expire = datetime.utcnow() + expires_delta
-    data_to_encode.update({'exp': expire})
+    # Fractional iat, so revocation of user tokens spares the ones issued right after it
+    data_to_encode.update({'exp': expire, 'iat': time.time(), 'jti': uuid.uuid4().hex})
     return jwt.encode(data_to_encode, settings.AUTH_KEY, algorithm=settings.AUTH_ALG)
 
 
-def get_current_user(security_scopes: SecurityScopes,
-                     token: Annotated[str, Depends(oauth2_scheme)]) -> schemas.User:
-    authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'\
-        if security_scopes.scopes\
-        else 'Bearer'
-
+def decode_token(token: str, authenticate_value: str = 'Bearer') -> dict:
+    """
+    Verified token claims.
+    :param token: encoded token
+    :param authenticate_value: WWW-Authenticate header of the 401 response
+    :return: token payload
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Invalid credentials',
@@ -104,9 +111,6 @@ def get_current_user(security_scopes: SecurityScopes,
     )
     try:
         payload = jwt.decode(token, settings.AUTH_KEY, algorithms=[settings.AUTH_ALG, ])
-        if (username := payload.get('sub')) is None:
-            raise credentials_exception
-        token_scopes = payload.get('scopes', [])
     except ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -115,13 +119,35 @@ def get_current_user(security_scopes: SecurityScopes,
         )
     except JWTError:
         raise credentials_exception
+    if payload.get('sub') is None:
+        raise credentials_exception
+    return payload
 
+
+def get_current_user(security_scopes: SecurityScopes,
+                     token: Annotated[str, Depends(oauth2_scheme)]) -> schemas.User:
+    with span('auth'):
+        return authorize_token(security_scopes, token)
+
+
+def authorize_token(security_scopes: SecurityScopes, token: str) -> schemas.User:
+    authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'\
+        if security_scopes.scopes\
+        else 'Bearer'
+
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail='Invalid credentials',
+        headers={'WWW-Authenticate': authenticate_value}
+    )
+    payload = decode_token(token, authenticate_value)
     token_data = schemas.TokenData(
-        username=username,
-        scopes=token_scopes,
+        username=payload['sub'],
+        scopes=payload.get('scopes', []),
     )
 
-    if (user := get_user(token_data.username)) is None:
+    # Deleted users are revoked too, so users database isn't queried per request
+    if denylist.is_revoked(token_data.username, payload.get('jti'), payload.get('iat')):
         raise credentials_exception
 
     for scope in security_scopes.scopes:
@@ -132,4 +158,5 @@ def get_current_user(security_scopes: SecurityScopes,
                 headers={'WWW-Authenticate': authenticate_value}
             )
 
-    return schemas.User(username=user.username)
+    annotate(user=token_data.username)
+    return schemas.User(username=token_data.username)
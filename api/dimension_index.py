@@ -0,0 +1,133 @@
+import logging
+import sqlite3
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy.orm import Session
+
+import crud
+import database
+
+logger = logging.getLogger(__name__)
+
+# Masterdata units -> millimetres and milligrams, the integer units of the index
+LENGTH_UNITS = {'MM': 1, 'CM': 10, 'DM': 100, 'M': 1000}
+WEIGHT_UNITS = {'MG': 1, 'G': 1000, 'KG': 1000000}
+MG_PER_KG = WEIGHT_UNITS['KG']
+
+# Side of a box or a weight too large for any product, stands for the missing limits
+UNLIMITED = 2 ** 31 - 1
+
+SCHEMA = '''
+CREATE VIRTUAL TABLE boxes USING rtree_i32(id, short_min, short_max, middle_min, middle_max,
+                                           long_min, long_max, gross_min, gross_max);
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY,
+    part_no TEXT NOT NULL,
+    title_en TEXT,
+    length INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    gross INTEGER NOT NULL
+);
+'''
+
+
+def normalize(value, unit: str, units: dict[str, int]) -> int | None:
+    """
+    Value in the integer unit of the index, None if the unit or value isn't known.
+    """
+    if (factor := units.get(unit.upper())) is None:
+        return None
+    try:
+        return int((Decimal(value) * factor).to_integral_value())
+    except (InvalidOperation, TypeError):
+        return None
+
+
+def milligrams(kg: Decimal | None) -> int | None:
+    return None if kg is None else int(kg * MG_PER_KG)
+
+
+def kilograms(mg: int) -> Decimal:
+    return Decimal(mg).scaleb(-6)
+
+
+class DimensionIndex:
+    """
+    Dimensions and gross weight of the products of a catalogue version in an in-memory R*Tree.
+    Sides of a product are indexed sorted, so a product fits a box if its sides fit the sorted sides
+    of the box, whatever the orientation.
+    Products whose masterdata has unknown units are left out.
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.products = 0
+        self.skipped = 0
+        # Connection is shared by the threads of the worker
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, db: Session) -> 'DimensionIndex':
+        started = time.perf_counter()
+        index = cls(database.get_catalogue_version(db))
+        index._load(db)
+        logger.info(f'Dimension index of version {index.version} is loaded in {time.perf_counter() - started:.3f} s, '
+                    f'{index.products} products, {index.skipped} skipped for unknown units')
+        return index
+
+    def _load(self, db: Session) -> None:
+        boxes, products = [], []
+        for row in crud.get_dimensions(db):
+            row_id, part_no, title_en, length, width, height, measure_unit, gross, weight_unit = row
+            sides = [normalize(side, measure_unit, LENGTH_UNITS) for side in (length, width, height)]
+            gross = normalize(gross, weight_unit, WEIGHT_UNITS)
+            if None in sides or gross is None:
+                self.skipped += 1
+                continue
+            short, middle, long = sorted(sides)
+            boxes.append((row_id, short, short, middle, middle, long, long, gross, gross))
+            products.append((row_id, part_no, title_en, *sides, gross))
+        with self.conn:
+            self.conn.executemany('INSERT INTO boxes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', boxes)
+            self.conn.executemany('INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?)', products)
+        self.products = len(products)
+
+    def search(self, sides: list[int | None], min_gross: int | None, max_gross: int | None, limit: int) -> list[tuple]:
+        """
+        Products fitting the box of the sides in millimetres, None for unlimited ones,
+        within the gross weight range in milligrams.
+        Rows of part number, title and length, width, height and gross weight of the product.
+        """
+        short, middle, long = sorted(UNLIMITED if side is None else side for side in sides)
+        with self.lock:
+            return self.conn.execute(
+                'SELECT p.part_no, p.title_en, p.length, p.width, p.height, p.gross '
+                'FROM boxes AS b JOIN products AS p ON p.id = b.id '
+                'WHERE b.short_max <= ? AND b.middle_max <= ? AND b.long_max <= ? '
+                'AND b.gross_min >= ? AND b.gross_max <= ? '
+                'ORDER BY b.id LIMIT ?',
+                (short, middle, long, min_gross or 0, UNLIMITED if max_gross is None else max_gross, limit),
+            ).fetchall()
+
+
+# Catalogue name -> its index
+_indexes: dict[str, DimensionIndex] = {}
+_index_lock = threading.Lock()
+
+
+def get_dimension_index(db: Session) -> DimensionIndex:
+    """
+    Index of the current version of session's catalogue. Rebuilt once the version changes.
+    """
+    name = database.get_catalogue(db).name
+    version = database.get_catalogue_version(db)
+    if (index := _indexes.get(name)) is None or index.version != version:
+        with _index_lock:
+            if (index := _indexes.get(name)) is None or index.version != version:
+                index = _indexes[name] = DimensionIndex.load(db)
+    return index
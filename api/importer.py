@@ -0,0 +1,429 @@
+"""
+Builds catalogue database from Bosch price workbook.
+
+    python importer.py price.xlsx bp.sqlite
+
+The workbook is streamed row by row, rows are inserted in large batches and
+indexes are created after the load. The database is built into a temporary file
+next to the target and renamed over it when complete, so the API never sees
+a half-built catalogue. Running workers reconnect to the new file on their next query.
+"""
+import argparse
+import logging
+import os
+import re
+import resource
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Iterator
+
+from openpyxl import load_workbook
+from sqlalchemy import create_engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import models
+
+logger = logging.getLogger(__name__)
+
+PRICE_SHEET = 'Price'
+NEW_RELEASE_SHEET = 'New release'
+DISCONTINUED_SHEET = 'Discontinued'
+REFERS_SHEET = 'Refers'
+
+# Field: column header in the price sheet
+PRICE_COLUMNS = {
+    'section': 'Section',
+    'subsection': 'Subsection',
+    'group': 'Group',
+    'part_no': 'Part number',
+    'title_ua': 'Description UA',
+    'title_en': 'Description EN',
+    'uktzed': 'UKTZED',
+    'min_order': 'Min order',
+    'quantity': 'Quantity',
+    'price': 'Price',
+    'truck': 'Truck',
+    'ean': 'EAN',
+    'gross': 'Gross weight',
+    'net': 'Net weight',
+    'weight_unit': 'Weight unit',
+    'length': 'Length',
+    'width': 'Width',
+    'height': 'Height',
+    'measure_unit': 'Measure unit',
+    'volume': 'Volume',
+    'volume_unit': 'Volume unit',
+}
+PART_NO_COLUMNS = {
+    'part_no': 'Part number',
+}
+REFERS_COLUMNS = {
+    'part_no': 'Part number',
+    'successor': 'Successor',
+}
+
+PRODUCT_FIELDS = ('title_ua', 'title_en', 'uktzed', 'min_order', 'quantity', 'price', 'truck', 'group')
+MASTERDATA_FIELDS = ('ean', 'gross', 'net', 'weight_unit', 'length', 'width', 'height',
+                     'measure_unit', 'volume', 'volume_unit')
+
+BATCH_SIZE = 50000
+
+
+class PriceFileError(Exception):
+    pass
+
+
+def normalize_part_no(value: Any) -> str | None:
+    """
+    Bosch part number without separators, in upper case.
+    Numeric cells lose leading zeros, so they are padded back to 10 digits.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return f'{int(value):010d}'
+    part_no = re.sub(r'[\s.\-/]', '', str(value)).upper()
+    return part_no or None
+
+
+def to_int(value: Any) -> int:
+    if value is None or value == '':
+        return 0
+    return int(Decimal(str(value).replace(',', '.')))
+
+
+def to_decimal_str(value: Any, places: int | None = None) -> str:
+    if value is None or value == '':
+        value = 0
+    try:
+        number = Decimal(str(value).replace(',', '.').replace(' ', ''))
+    except InvalidOperation:
+        raise PriceFileError(f'Not a number: {value!r}')
+    return f'{number:.{places}f}' if places is not None else str(number)
+
+
+def to_bool(value: Any) -> bool:
+    return str(value).strip().upper() in ('1', 'TRUE', 'Y', 'YES', 'X', '+')
+
+
+def read_sheet(workbook, sheet: str, columns: dict[str, str], required: bool = True) -> Iterator[dict]:
+    """
+    Stream sheet rows as dicts of fields. Header row is looked up by column titles,
+    so columns order and leading title rows don't matter.
+    """
+    if sheet not in workbook.sheetnames:
+        if required:
+            raise PriceFileError(f'Sheet {sheet!r} is missing')
+        return
+
+    positions = None
+    expected = {title.strip().lower(): field for field, title in columns.items()}
+    for row in workbook[sheet].iter_rows(values_only=True):
+        if positions is None:
+            titles = [str(cell).strip().lower() if cell is not None else None for cell in row]
+            if set(expected) <= set(titles):
+                positions = [(titles.index(title), field) for title, field in expected.items()]
+            continue
+        if all(cell is None for cell in row):
+            continue
+        yield {field: row[position] if position < len(row) else None for position, field in positions}
+
+    if positions is None:
+        raise PriceFileError(f'Header row is not found in sheet {sheet!r}')
+
+
+def read_part_numbers(workbook, sheet: str) -> set[str]:
+    return {
+        part_no for row in read_sheet(workbook, sheet, PART_NO_COLUMNS, required=False)
+        if (part_no := normalize_part_no(row['part_no']))
+    }
+
+
+def read_refers(workbook) -> list[tuple[str, str]]:
+    return [
+        (predecessor, successor) for row in read_sheet(workbook, REFERS_SHEET, REFERS_COLUMNS, required=False)
+        if (predecessor := normalize_part_no(row['part_no'])) and (successor := normalize_part_no(row['successor']))
+    ]
+
+
+def read_price_rows(workbook) -> Iterator[dict]:
+    """
+    Normalized price rows. Rows without part number are skipped.
+    """
+    for row in read_sheet(workbook, PRICE_SHEET, PRICE_COLUMNS):
+        if not (part_no := normalize_part_no(row['part_no'])):
+            continue
+        yield {
+            'section': str(row['section']).strip(),
+            'subsection': str(row['subsection']).strip(),
+            'group': str(row['group']).strip(),
+            'part_no': part_no,
+            'title_ua': str(row['title_ua'] or '').strip(),
+            'title_en': str(row['title_en'] or '').strip(),
+            'uktzed': to_int(row['uktzed']),
+            'min_order': to_int(row['min_order']) or 1,
+            'quantity': to_int(row['quantity']),
+            'price': models.fixed_point_price(to_decimal_str(row['price'])),
+            'truck': to_bool(row['truck']),
+            'masterdata': None if row['ean'] in (None, '') else {
+                'ean': to_int(row['ean']),
+                'gross': to_decimal_str(row['gross']),
+                'net': to_decimal_str(row['net']),
+                'weight_unit': str(row['weight_unit'] or '').strip().upper(),
+                'length': to_int(row['length']),
+                'width': to_int(row['width']),
+                'height': to_int(row['height']),
+                'measure_unit': str(row['measure_unit'] or '').strip().upper(),
+                'volume': to_decimal_str(row['volume']),
+                'volume_unit': str(row['volume_unit'] or '').strip().upper(),
+            },
+        }
+
+
+def product_values(row: dict, group_id) -> tuple:
+    """
+    Pricelist values of price row in PRODUCT_FIELDS order, group resolved to its id.
+    """
+    return (*(row[field] for field in PRODUCT_FIELDS[:-1]),
+            group_id(row['section'], row['subsection'], row['group']))
+
+
+def open_price_file(price_path: str | os.PathLike):
+    return load_workbook(price_path, read_only=True, data_only=True)
+
+
+def create_schema(database_path: str | os.PathLike, indexes: bool) -> None:
+    engine = create_engine(f'sqlite:///{database_path}')
+    with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            if indexes:
+                for index in table.indexes:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            else:
+                conn.execute(CreateTable(table, if_not_exists=True))
+    engine.dispose()
+
+
+def catalogue_version(database_path: str | os.PathLike) -> int:
+    if not os.path.exists(database_path):
+        return 0
+    conn = sqlite3.connect(database_path)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def record_version(conn: sqlite3.Connection, version: int, full: bool, source: str) -> None:
+    """
+    Register loaded catalogue version. Committed along with the caller's transaction.
+    """
+    conn.execute(
+        'INSERT INTO catalogue_version (version, loaded_at, "full", source) VALUES (?, ?, ?, ?)',
+        (version, datetime.utcnow().isoformat(sep=' '), full, source),
+    )
+    conn.execute(f'PRAGMA user_version = {int(version)}')
+
+
+class Loader:
+    """
+    Buffers rows of every table and flushes them with executemany.
+    Ids of partnums and catalogue hierarchy are assigned here, so no lookups
+    in the database are needed during the load.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, new_release: set[str], discontinued: set[str],
+                 batch_size: int = BATCH_SIZE):
+        self.conn = conn
+        self.new_release = new_release
+        self.discontinued = discontinued
+        self.batch_size = batch_size
+        self.partnums: dict[str, int] = {}
+        self.sections: dict[str, int] = {}
+        self.subsections: dict[tuple[int, str], int] = {}
+        self.groups: dict[tuple[int, str], int] = {}
+        self.last_ids: dict[str, int] = {'partnum': 0, 'sect': 0, 'subsect': 0, 'subsub': 0}
+        self.buffers: dict[str, list[tuple]] = {
+            'sect': [], 'subsect': [], 'subsub': [], 'partnum': [], 'pricelist': [], 'masterdata': [], 'refers': [],
+        }
+        self.duplicates = 0
+
+    STATEMENTS = {
+        'sect': 'INSERT INTO sect (id, title) VALUES (?, ?)',
+        'subsect': 'INSERT INTO subsect (id, title, sect_id) VALUES (?, ?, ?)',
+        'subsub': 'INSERT INTO subsub (rowid, title, subsect_id) VALUES (?, ?, ?)',
+        'partnum': 'INSERT INTO partnum (rowid, part_no, discontinued, new_release) VALUES (?, ?, ?, ?)',
+        'pricelist': 'INSERT INTO pricelist (title_ua, title_en, uktzed, min_order, quantity, price, truck, '
+                     'subsub_id, partnum_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        'masterdata': 'INSERT INTO masterdata (ean, gross, net, weight_unit, length, width, height, measure_unit, '
+                      'volume, volume_unit, partnum_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        'refers': 'INSERT OR IGNORE INTO refers (predecessor, successor) VALUES (?, ?)',
+    }
+
+    def add(self, table: str, values: tuple) -> None:
+        buffer = self.buffers[table]
+        buffer.append(values)
+        if len(buffer) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table: str | None = None) -> None:
+        for name in [table] if table else self.buffers:
+            if self.buffers[name]:
+                self.conn.executemany(self.STATEMENTS[name], self.buffers[name])
+                self.buffers[name].clear()
+
+    def load_existing(self) -> None:
+        """
+        Continue ids of the catalogue already in the database.
+        """
+        self.partnums = {part_no: rowid for rowid, part_no in self.conn.execute('SELECT rowid, part_no FROM partnum')}
+        self.sections = {title: pk for pk, title in self.conn.execute('SELECT id, title FROM sect')}
+        self.subsections = {
+            (sect_id, title): pk for pk, title, sect_id in self.conn.execute('SELECT id, title, sect_id FROM subsect')
+        }
+        self.groups = {
+            (subsect_id, title): pk
+            for pk, title, subsect_id in self.conn.execute('SELECT rowid, title, subsect_id FROM subsub')
+        }
+        for table, ids in (('partnum', self.partnums), ('sect', self.sections),
+                           ('subsect', self.subsections), ('subsub', self.groups)):
+            self.last_ids[table] = max(ids.values(), default=0)
+
+    def next_id(self, table: str) -> int:
+        self.last_ids[table] += 1
+        return self.last_ids[table]
+
+    def partnum_id(self, part_no: str) -> int:
+        if (partnum_id := self.partnums.get(part_no)) is None:
+            partnum_id = self.partnums[part_no] = self.next_id('partnum')
+            self.add('partnum', (partnum_id, part_no, part_no in self.discontinued, part_no in self.new_release))
+        return partnum_id
+
+    def group_id(self, section: str, subsection: str, group: str) -> int:
+        if (sect_id := self.sections.get(section)) is None:
+            sect_id = self.sections[section] = self.next_id('sect')
+            self.add('sect', (sect_id, section))
+        if (subsect_id := self.subsections.get((sect_id, subsection))) is None:
+            subsect_id = self.subsections[(sect_id, subsection)] = self.next_id('subsect')
+            self.add('subsect', (subsect_id, subsection, sect_id))
+        if (group_id := self.groups.get((subsect_id, group))) is None:
+            group_id = self.groups[(subsect_id, group)] = self.next_id('subsub')
+            self.add('subsub', (group_id, group, subsect_id))
+        return group_id
+
+    def add_price_row(self, row: dict) -> None:
+        if row['part_no'] in self.partnums:
+            self.duplicates += 1
+            return
+        self.add_product(self.partnum_id(row['part_no']), row)
+
+    def add_product(self, partnum_id: int, row: dict) -> None:
+        self.add('pricelist', (*product_values(row, self.group_id), partnum_id))
+        if row['masterdata'] is not None:
+            self.add_masterdata(partnum_id, row['masterdata'])
+
+    def add_masterdata(self, partnum_id: int, masterdata: dict) -> None:
+        self.add('masterdata', (*(masterdata[field] for field in MASTERDATA_FIELDS), partnum_id))
+
+    def add_refer(self, predecessor: str, successor: str) -> None:
+        if predecessor != successor:
+            self.add('refers', (self.partnum_id(predecessor), self.partnum_id(successor)))
+
+
+def build_catalogue(price_path: str | os.PathLike,
+                    database_path: str | os.PathLike,
+                    version: int | None = None,
+                    batch_size: int = BATCH_SIZE) -> dict[str, Any]:
+    """
+    Build catalogue database from price workbook and replace the target file with it.
+    :param price_path: Bosch price workbook
+    :param database_path: catalogue database to create or replace
+    :param version: catalogue version. Next to the replaced one's by default.
+    :param batch_size: rows per executemany
+    :return: import report
+    """
+    started = time.perf_counter()
+    if version is None:
+        version = catalogue_version(database_path) + 1
+
+    directory = os.path.dirname(os.path.abspath(database_path))
+    fd, temp_path = tempfile.mkstemp(prefix='.bp-', suffix='.sqlite.tmp', dir=directory)
+    os.close(fd)
+    try:
+        create_schema(temp_path, indexes=False)
+        workbook = open_price_file(price_path)
+        conn = sqlite3.connect(temp_path, isolation_level=None)
+        try:
+            # Nothing to recover if building is interrupted, the temp file is just dropped
+            conn.execute('PRAGMA journal_mode = OFF')
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('PRAGMA cache_size = -65536')
+
+            loader = Loader(
+                conn,
+                new_release=read_part_numbers(workbook, NEW_RELEASE_SHEET),
+                discontinued=read_part_numbers(workbook, DISCONTINUED_SHEET),
+                batch_size=batch_size,
+            )
+            conn.execute('BEGIN')
+            for row in read_price_rows(workbook):
+                loader.add_price_row(row)
+            for part_no in sorted(loader.new_release | loader.discontinued):
+                loader.partnum_id(part_no)
+            for predecessor, successor in read_refers(workbook):
+                loader.add_refer(predecessor, successor)
+            loader.flush()
+            conn.execute('COMMIT')
+            workbook.close()
+
+            record_version(conn, version, full=True, source=os.path.basename(price_path))
+            create_schema(temp_path, indexes=True)
+            conn.execute('ANALYZE')
+            counts = {
+                table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in Loader.STATEMENTS
+            }
+        finally:
+            conn.close()
+        os.replace(temp_path, database_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return {
+        'version': version,
+        'rows': counts,
+        'duplicates': loader.duplicates,
+        'seconds': round(time.perf_counter() - started, 3),
+        'peak_memory_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Build catalogue database from Bosch price workbook.')
+    parser.add_argument('price', help='price workbook, .xlsx')
+    parser.add_argument('database', nargs='?', default='bp.sqlite', help='catalogue database to create or replace')
+    parser.add_argument('--version', type=int, default=None, help='catalogue version, next one by default')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per insert batch')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%Y/%m/%d %H:%M:%S',
+        format='%(asctime)s %(levelname)s: %(message)s',
+    )
+    report = build_catalogue(args.price, args.database, version=args.version, batch_size=args.batch_size)
+    logger.info(f'Catalogue version {report["version"]} is built into {args.database} '
+                f'in {report["seconds"]} s, peak memory {report["peak_memory_mb"]} MB')
+    for table, count in report['rows'].items():
+        logger.info(f'{table}: {count} rows')
+    if report['duplicates']:
+        logger.warning(f'{report["duplicates"]} duplicated part numbers are skipped')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""
+Load test of the API with a realistic mix of catalogue traffic.
+
+    python loadtest.py --concurrency 16 --duration 30 --output report.json
+
+A catalogue and users are generated in a temporary directory, the app is started
+in-process (or as uvicorn server with --server uvicorn) on top of them and driven
+by concurrent clients for the duration. Throughput and latency percentiles are
+reported per route. Report written with --output is stable JSON, so runs can be
+diffed or compared with --compare previous.json.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any
+
+import httpx
+
+import importer
+from sqlite_um.user_manager import SQLiteUserManager
+
+logger = logging.getLogger(__name__)
+
+ROUTE_PREFIX = '/api/v1'
+
+# Route -> share of requests
+ROUTE_MIX = {
+    'POST /login/': 1,
+    'GET /sections/': 5,
+    'GET /sections/{group_id}/': 20,
+    'GET /products/{part_number}/': 60,
+    'POST /products/search/': 14,
+}
+
+# Share of product requests for part numbers missing in the catalogue
+MISSING_PART_NUMBERS = 0.05
+
+PASSWORD = 'loadtest-password'
+
+
+def generate_catalogue(path: str | os.PathLike,
+                       products: int,
+                       groups: int,
+                       seed: int = 0) -> tuple[list[str], list[int]]:
+    """
+    Catalogue database shaped like the one built from Bosch price.
+    :return: part numbers and group ids of the catalogue
+    """
+    rnd = random.Random(seed)
+    importer.create_schema(path, indexes=False)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute('BEGIN')
+        sections = max(1, groups // 40)
+        subsections = max(1, groups // 8)
+        conn.executemany('INSERT INTO sect (id, title) VALUES (?, ?)',
+                         [(i, f'Section {i}') for i in range(1, sections + 1)])
+        conn.executemany('INSERT INTO subsect (id, title, sect_id) VALUES (?, ?, ?)',
+                         [(i, f'Subsection {i}', i % sections + 1) for i in range(1, subsections + 1)])
+        conn.executemany('INSERT INTO subsub (rowid, title, subsect_id) VALUES (?, ?, ?)',
+                         [(i, f'Group {i}', i % subsections + 1) for i in range(1, groups + 1)])
+
+        part_numbers = set()
+        while len(part_numbers) < products:
+            part_numbers.add(rnd.choice(['0', '1', 'F']) + ''.join(rnd.choices('0123456789', k=5))
+                             + ''.join(rnd.choices('0123456789ABCDEFGHJKLMNPRSTUVWXYZ', k=4)))
+        part_numbers = sorted(part_numbers)
+        conn.executemany('INSERT INTO partnum (rowid, part_no, discontinued, new_release) VALUES (?, ?, ?, ?)',
+                         [(i, part_no, rnd.random() < 0.05, rnd.random() < 0.03)
+                          for i, part_no in enumerate(part_numbers, 1)])
+        conn.executemany(
+            'INSERT INTO pricelist (title_ua, title_en, uktzed, min_order, quantity, price, truck, '
+            'partnum_id, subsub_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(f'Опис {i % 500}', f'Description {i % 500}', 8409910000, rnd.choice([1, 1, 2, 5, 10]),
+              rnd.randint(0, 200), rnd.randint(1, 20000) * 100 + rnd.randint(0, 99), rnd.random() < 0.2,
+              i, rnd.randint(1, groups))
+             for i in range(1, len(part_numbers) + 1)]
+        )
+        conn.executemany(
+            'INSERT INTO masterdata (ean, gross, net, weight_unit, length, width, height, measure_unit, '
+            'volume, volume_unit, partnum_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(4047020000000 + i, f'{rnd.randint(1, 5000) / 1000}', f'{rnd.randint(1, 4000) / 1000}', 'KG',
+              rnd.randint(1, 500), rnd.randint(1, 500), rnd.randint(1, 500), 'MM', '0.125', 'DM3', i)
+             for i in range(1, len(part_numbers) + 1) if rnd.random() < 0.7]
+        )
+        conn.executemany('INSERT OR IGNORE INTO refers (predecessor, successor) VALUES (?, ?)',
+                         [(rnd.randint(1, len(part_numbers)), rnd.randint(1, len(part_numbers)))
+                          for _ in range(len(part_numbers) // 10)])
+        importer.record_version(conn, 1, full=True, source='loadtest')
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    importer.create_schema(path, indexes=True)
+    return part_numbers, list(range(1, groups + 1))
+
+
+def seed_users(path: str | os.PathLike, count: int) -> list[str]:
+    """
+    Users with catalogue scope sharing the same password.
+    """
+    from passlib.context import CryptContext
+    um = SQLiteUserManager(database_path=path)
+    um._initial_setup()
+    # bcrypt takes a while, a single hash does for all the users
+    password = CryptContext(schemes=['bcrypt']).hash(PASSWORD)
+    usernames = [f'loadtest_user{i}' for i in range(count)]
+    um.add_users([{'username': username, 'password': password, 'scopes': ['catalogue']} for username in usernames])
+    return usernames
+
+
+class Workload:
+    """
+    Random requests of ROUTE_MIX over the generated catalogue.
+    """
+
+    def __init__(self, part_numbers: list[str], group_ids: list[int], usernames: list[str], seed: int):
+        self.part_numbers = part_numbers
+        self.group_ids = group_ids
+        self.usernames = usernames
+        self.random = random.Random(seed)
+        self.routes = list(ROUTE_MIX)
+        self.weights = list(ROUTE_MIX.values())
+
+    def login(self) -> dict[str, Any]:
+        return {
+            'method': 'POST',
+            'url': f'{ROUTE_PREFIX}/login/',
+            'data': {'username': self.random.choice(self.usernames), 'password': PASSWORD},
+        }
+
+    def next_request(self) -> tuple[str, dict[str, Any]]:
+        route = self.random.choices(self.routes, self.weights)[0]
+        if route == 'POST /login/':
+            return route, self.login()
+        if route == 'GET /sections/':
+            return route, {'method': 'GET', 'url': f'{ROUTE_PREFIX}/sections/'}
+        if route == 'GET /sections/{group_id}/':
+            return route, {'method': 'GET', 'url': f'{ROUTE_PREFIX}/sections/{self.random.choice(self.group_ids)}/'}
+        if route == 'GET /products/{part_number}/':
+            part_no = self.random.choice(self.part_numbers)
+            if self.random.random() < MISSING_PART_NUMBERS:
+                part_no = part_no[:-1] + ('Q' if part_no[-1] != 'Q' else 'O')
+            return route, {'method': 'GET', 'url': f'{ROUTE_PREFIX}/products/{part_no}/'}
+        # Search with 1 to 4 wildcards
+        query = list(self.random.choice(self.part_numbers))
+        for position in self.random.sample(range(10), self.random.randint(1, 4)):
+            query[position] = '?'
+        return route, {'method': 'POST', 'url': f'{ROUTE_PREFIX}/products/search/',
+                       'json': {'search_query': ''.join(query)}}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, route: str, seconds: float, status: int | str) -> None:
+        self.latencies[route].append(seconds)
+        self.statuses[route][str(status)] += 1
+
+
+async def run_client(client: httpx.AsyncClient, workload: Workload, stats: Stats, deadline: float) -> None:
+    token = None
+    while time.perf_counter() < deadline:
+        route, request = ('POST /login/', workload.login()) if token is None else workload.next_request()
+        if token is not None:
+            request.setdefault('headers', {})['Authorization'] = f'Bearer {token}'
+        started = time.perf_counter()
+        try:
+            response = await client.request(**request)
+        except httpx.HTTPError as exc:
+            stats.add(route, time.perf_counter() - started, type(exc).__name__)
+            continue
+        stats.add(route, time.perf_counter() - started, response.status_code)
+        if route == 'POST /login/' and response.status_code == 200:
+            token = response.json()['access_token']
+
+
+async def drive(client: httpx.AsyncClient, workload: Workload, concurrency: int, duration: float) -> Stats:
+    stats = Stats()
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(run_client(client, workload, stats, deadline) for _ in range(concurrency)))
+    return stats
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def route_report(latencies: list[float], statuses: Counter, seconds: float) -> dict[str, Any]:
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1),
+        'statuses': dict(sorted(statuses.items())),
+    }
+
+
+def summarize(stats: Stats, seconds: float, config: dict[str, Any]) -> dict[str, Any]:
+    return {
+        'config': config,
+        'routes': {route: route_report(stats.latencies[route], stats.statuses[route], seconds)
+                   for route in ROUTE_MIX if stats.latencies[route]},
+        'total': route_report([latency for latencies in stats.latencies.values() for latency in latencies],
+                              sum(stats.statuses.values(), Counter()), seconds),
+    }
+
+
+def format_table(report: dict[str, Any], previous: dict[str, Any] | None = None) -> str:
+    columns = ('requests', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    lines = [f'{"route":<32}' + ''.join(f'{column:>18}' for column in columns) + '  statuses']
+    rows = [*report['routes'].items(), ('total', report['total'])]
+    for route, values in rows:
+        before = (previous or {}).get('routes', {}).get(route) if route != 'total' else (previous or {}).get('total')
+        cells = []
+        for column in columns:
+            cell = f'{values[column]}'
+            if before is not None and before.get(column):
+                cell += f' ({(values[column] - before[column]) / before[column]:+.0%})'
+            cells.append(f'{cell:>18}')
+        statuses = ' '.join(f'{status}:{count}' for status, count in values['statuses'].items())
+        lines.append(f'{route:<32}' + ''.join(cells) + f'  {statuses}')
+    return '\n'.join(lines)
+
+
+def app_environment(directory: str) -> dict[str, str]:
+    """
+    Settings pointing the app at the generated databases.
+    """
+    return {
+        'DATABASE_PATH': os.path.join(directory, 'bp.sqlite'),
+        'USERS_DB_PATH': os.path.join(directory, 'users.sqlite'),
+        'SHARED_CACHE_PATH': os.path.join(directory, 'catalogue_cache.mmap'),
+    }
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 120) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get(f'{ROUTE_PREFIX}/health/ready')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError('App has not got ready')
+
+
+async def run_in_process(workload: Workload, args: argparse.Namespace) -> Stats:
+    # Settings are read on the first import of the app, which has to follow app_environment
+    import logs
+    import main
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO if args.echo else logging.WARNING)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(app=main.app, base_url='http://loadtest') as client:
+            await wait_ready(client)
+            stats = await drive(client, workload, args.concurrency, args.duration)
+    logger.info(f'Logging of the app: {logs.log_stats.report()}')
+    return stats
+
+
+async def run_uvicorn(workload: Workload, args: argparse.Namespace, environment: dict[str, str]) -> Stats:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(args.workers), '--log-level', 'warning'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, **environment},
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits, timeout=30) as client:
+            await wait_ready(client)
+            return await drive(client, workload, args.concurrency, args.duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Load test of the API with latency percentiles per route.')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to run')
+    parser.add_argument('--products', type=int, default=20000, help='products in generated catalogue')
+    parser.add_argument('--groups', type=int, default=400, help='groups in generated catalogue')
+    parser.add_argument('--users', type=int, default=20, help='seeded users')
+    parser.add_argument('--seed', type=int, default=0, help='seed of catalogue and requests')
+    parser.add_argument('--server', choices=['in-process', 'uvicorn'], default='in-process',
+                        help='drive the app in-process or through local uvicorn server')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers')
+    parser.add_argument('--echo', action='store_true', help='keep SQL echo of in-process app')
+    parser.add_argument('--output', help='write JSON report to the file')
+    parser.add_argument('--compare', help='JSON report of previous run to compare with')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%Y/%m/%d %H:%M:%S',
+        format='%(asctime)s %(levelname)s: %(message)s',
+    )
+    with tempfile.TemporaryDirectory(prefix='bp-loadtest-') as directory:
+        environment = app_environment(directory)
+        part_numbers, group_ids = generate_catalogue(environment['DATABASE_PATH'], args.products, args.groups,
+                                                     args.seed)
+        usernames = seed_users(environment['USERS_DB_PATH'], args.users)
+        logger.info(f'Generated {len(part_numbers)} products in {len(group_ids)} groups, {len(usernames)} users')
+        workload = Workload(part_numbers, group_ids, usernames, args.seed)
+
+        if args.server == 'uvicorn':
+            stats = asyncio.run(run_uvicorn(workload, args, environment))
+        else:
+            os.environ.update(environment)
+            stats = asyncio.run(run_in_process(workload, args))
+
+    report = summarize(stats, args.duration, config={
+        key: getattr(args, key) for key in ('concurrency', 'duration', 'products', 'groups', 'users', 'seed',
+                                            'server', 'workers')
+    })
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+    print(format_table(report, previous))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+            file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from settings import get_settings
+settings = get_settings()
+
+ACCESS_LOGGER = 'access'
+REQUEST_ID_HEADER = b'x-request-id'
+
+# Id and access log fields of the current request, e.g. the user set by authentication
+request_id: ContextVar[str | None] = ContextVar('request_id', default=None)
+request_fields: ContextVar[dict | None] = ContextVar('request_fields', default=None)
+
+# Attributes every LogRecord has, the others are extra fields of the record.
+# Uvicorn adds the message with terminal colours as an extra field.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id', 'color_message'}
+
+
+def annotate(**fields) -> None:
+    """
+    Add the fields to the access log line of the current request.
+    """
+    if (current := request_fields.get()) is not None:
+        current.update(fields)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    A record per line as a JSON object. Extra fields of the record are kept as they are.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None) is not None:
+            entry['request_id'] = record.request_id
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str | None = None) -> str:
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}'
+
+
+class ThrottleFilter(logging.Filter):
+    """
+    Passes up to burst records of the same message in interval seconds, the repeats are dropped.
+    The count of dropped repeats comes with the first record passed after the interval.
+    Access log lines are never throttled.
+    """
+
+    def __init__(self, interval: float, burst: int):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        # (logger, level, message template) -> (interval start, records seen)
+        self.windows: dict[tuple, tuple[float, int]] = {}
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.name == ACCESS_LOGGER or not self.burst:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = record.created
+        with self.lock:
+            started, seen = self.windows.get(key, (now, 0))
+            if now - started >= self.interval:
+                if seen > self.burst:
+                    record.repeats_dropped = seen - self.burst
+                started, seen = now, 0
+            self.windows[key] = (started, seen + 1)
+            if len(self.windows) > 10000:
+                # Messages of every user or part number shouldn't pile up
+                self.windows = {k: w for k, w in self.windows.items() if now - w[0] < self.interval}
+        if seen < self.burst:
+            return True
+        self.throttled += 1
+        return False
+
+
+class RequestQueueHandler(QueueHandler):
+    """
+    Puts records into the queue of the listener thread, with the id of the current request.
+    Records are dropped rather than waited for, once the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the message with its arguments, which may change before the listener gets to the record.
+        The record is handled by this handler only, so unlike QueueHandler.prepare it isn't copied
+        and formatting is left to the listener.
+        """
+        record.request_id = request_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogStats:
+    """
+    Records logged by requests and time the requests spent logging.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.handler: RequestQueueHandler | None = None
+        self.throttle: ThrottleFilter | None = None
+
+    def report(self) -> dict:
+        return {
+            'queued': self.handler.queue.qsize() if self.handler else 0,
+            'dropped': self.handler.dropped if self.handler else 0,
+            'throttled': self.throttle.throttled if self.throttle else 0,
+            'requests': self.requests,
+            'overhead_us': round(self.seconds / self.requests * 1e6, 1) if self.requests else None,
+        }
+
+
+log_stats = LogStats()
+_listener: QueueListener | None = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging() -> None:
+    """
+    Route the records of the process through a queue to the listener thread writing JSON lines to stderr,
+    so slow output doesn't block requests. SQL echo is routed the same way if SQL_ECHO is set.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(JsonFormatter())
+        log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        handler = RequestQueueHandler(log_queue)
+        throttle = ThrottleFilter(settings.LOG_THROTTLE_SECONDS, settings.LOG_THROTTLE_BURST)
+        handler.addFilter(throttle)
+
+        root = logging.getLogger()
+        for previous in root.handlers[:]:
+            root.removeHandler(previous)
+        root.addHandler(handler)
+        root.setLevel(settings.LOG_LEVEL)
+        logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO if settings.SQL_ECHO else logging.WARNING)
+        route_server_loggers()
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        log_stats.handler, log_stats.throttle = handler, throttle
+        atexit.register(stop_logging)
+
+
+def route_server_loggers() -> None:
+    """
+    Uvicorn configures its loggers with their own stderr handlers before the app is loaded.
+    Server messages and tracebacks of the app are routed through the queue like the other records.
+    """
+    for name in ('uvicorn', 'uvicorn.error'):
+        server_logger = logging.getLogger(name)
+        for previous in server_logger.handlers[:]:
+            server_logger.removeHandler(previous)
+        server_logger.propagate = True
+    # Access lines are written by AccessLogMiddleware
+    logging.getLogger('uvicorn.access').disabled = True
+
+
+def stop_logging() -> None:
+    """
+    Write out the queued records and stop the listener thread.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+access_logger = logging.getLogger(ACCESS_LOGGER)
+
+
+class AccessLogMiddleware:
+    """
+    Gives every HTTP request an id, taken from X-Request-ID header if the client sent one,
+    and logs an access line with its status and latency once the response is sent.
+    The id is sent back in X-Request-ID header and comes with every record logged by the request.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        rid = next((value.decode('latin-1')[:64] for name, value in scope['headers'] if name == REQUEST_ID_HEADER),
+                   None) or uuid.uuid4().hex
+        id_token = request_id.set(rid)
+        fields = {}
+        fields_token = request_fields.set(fields)
+        status = 500
+        size = 0
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = [*message.get('headers', []), (REQUEST_ID_HEADER, rid.encode('latin-1'))]
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            logging_started = time.perf_counter()
+            route = scope.get('route')
+            access_logger.info(
+                f'{scope["method"]} {scope["path"]} {status}',
+                extra={
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'route': getattr(route, 'name', None),
+                    'status': status,
+                    'bytes': size,
+                    'duration_ms': round((logging_started - started) * 1000, 2),
+                    **fields,
+                },
+            )
+            log_stats.requests += 1
+            log_stats.seconds += time.perf_counter() - logging_started
+            request_fields.reset(fields_token)
+            request_id.reset(id_token)
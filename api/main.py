@@ -1,16 +1,42 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
+from anyio import to_thread
 from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 
+import logs
 import schemas
-from routers import products, login, users_manager
+import warmup
+from deadlines import QueryDeadlineMiddleware
+from profiling import ProfilingMiddleware
+from server_timing import ServerTimingMiddleware
+from usage import UsageMiddleware, usage_meter
+from routers import products, login, users_manager, health, changes, profiles, catalogues, pricing, usage
+
+from settings import get_settings
+settings = get_settings()
+
+logs.setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up runs aside, so the readiness probe is answered meanwhile
+    warmup_task = asyncio.create_task(to_thread.run_sync(warmup.warm_up, app))
+    usage_task = asyncio.create_task(usage_meter.run())
+    yield
+    warmup_task.cancel()
+    # Usage counted since the last flush is written before the worker exits
+    usage_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await usage_task
 
-from settings import ApiSettings
-settings = ApiSettings()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,10 +45,23 @@ app.add_middleware(
     allow_methods=settings.CORS_ALLOWED_METHODS,
     allow_headers=settings.CORS_ALLOWED_HEADERS,
 )
+app.add_middleware(QueryDeadlineMiddleware)
+app.add_middleware(ProfilingMiddleware)
+if settings.SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(UsageMiddleware)
+# Outermost, so the latency of the access line covers the other middleware
+app.add_middleware(logs.AccessLogMiddleware)
 
 app.include_router(products.router)
 app.include_router(login.router)
 app.include_router(users_manager.router)
+app.include_router(health.router)
+app.include_router(changes.router)
+app.include_router(profiles.router)
+app.include_router(catalogues.router)
+app.include_router(pricing.router)
+app.include_router(usage.router)
 
 
 @app.exception_handler(RequestValidationError)
@@ -40,5 +79,4 @@ async def validation_exception(request, exc: RequestValidationError) -> JSONResp
 #  user_manager tests review
 #  login tests
 #  search request tests
-#  logging
 #  frontend
@@ -1,10 +1,14 @@
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 from typing_extensions import Annotated
 from sqlalchemy import (
     ForeignKey,
+    Index,
     Integer,
     Table,
     Column,
 )
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import (
     relationship,
     DeclarativeBase,
@@ -18,6 +22,29 @@ class Base(DeclarativeBase):
     pass
 
 
+# Prices are stored as fixed-point integers, in hundredths of the currency unit
+PRICE_PLACES = 2
+PRICE_SCALE = 10 ** PRICE_PLACES
+
+
+def fixed_point_price(value: int | str | Decimal) -> int:
+    """
+    Fixed-point price out of the stored value. Catalogues built before prices were
+    stored as integers keep them as decimal strings.
+    """
+    if isinstance(value, int):
+        return value
+    return int((Decimal(value) * PRICE_SCALE).to_integral_value(ROUND_HALF_UP))
+
+
+class FixedPointPrice(TypeDecorator):
+    impl = Integer
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else fixed_point_price(value)
+
+
 id_pk = Annotated[int, mapped_column('id', Integer, primary_key=True)]
 rowid_pk = Annotated[int, mapped_column('rowid', Integer, primary_key=True)]
 partnum_fk = Annotated[int, mapped_column(ForeignKey('partnum.rowid'))]
@@ -75,6 +102,9 @@ class PartNumber(Base):
     to bound similar products.
     """
     __tablename__ = 'partnum'
+    __table_args__ = (
+        Index('ix_partnum_part_no', 'part_no'),
+    )
 
     id: Mapped[rowid_pk]
     part_no: Mapped[str]
@@ -93,13 +123,17 @@ class Product(Base):
     and some product related parameters. References on particular partnum entry.
     """
     __tablename__ = 'pricelist'
+    __table_args__ = (
+        Index('ix_pricelist_partnum_id', 'partnum_id'),
+        Index('ix_pricelist_subsub_id', 'subsub_id'),
+    )
 
     title_ua: Mapped[str]
     title_en: Mapped[str]
     uktzed: Mapped[int]
     min_order: Mapped[int]
     quantity: Mapped[int]
-    price: Mapped[str]
+    price: Mapped[int] = mapped_column(FixedPointPrice)
     truck: Mapped[bool]
     id: Mapped[rowid_pk]
     partnum_id: Mapped[partnum_fk]
@@ -113,6 +147,10 @@ class MasterData(Base):
     Physical pararmeters of product. Weigth, dimensions, etc.
     """
     __tablename__ = 'masterdata'
+    __table_args__ = (
+        Index('ix_masterdata_partnum_id', 'partnum_id'),
+        Index('ix_masterdata_ean', 'ean'),
+    )
 
     ean: Mapped[int]
     gross: Mapped[str]
@@ -127,3 +165,32 @@ class MasterData(Base):
     id: Mapped[rowid_pk]
     partnum_id: Mapped[partnum_fk]
     # partnum: Mapped['PartNumber'] = relationship(back_populates='masterdata')
+
+
+class CatalogueVersion(Base):
+    """
+    Catalogue version loaded either by full import of Bosch price or by incremental update.
+    Current version number is also kept in database header, PRAGMA user_version.
+    """
+    __tablename__ = 'catalogue_version'
+
+    version: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    loaded_at: Mapped[datetime]
+    full: Mapped[bool]
+    source: Mapped[str]
+
+
+class CatalogueChange(Base):
+    """
+    Part number changed by incremental update to the version.
+    Change is 'insert' or 'delete' of partnum entry, or 'update' of the listed fields.
+    """
+    __tablename__ = 'catalogue_change'
+    __table_args__ = (
+        Index('ix_catalogue_change_part_no', 'part_no', 'version'),
+    )
+
+    version: Mapped[int] = mapped_column(ForeignKey('catalogue_version.version'), primary_key=True)
+    part_no: Mapped[str] = mapped_column(primary_key=True)
+    change: Mapped[str]
+    fields: Mapped[str]
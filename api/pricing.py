@@ -0,0 +1,161 @@
+import math
+import threading
+import time
+from decimal import Decimal
+from typing import Iterable, NamedTuple
+
+import numpy as np
+from fastapi import Query, Security
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import HTTPException
+
+import dependencies
+import schemas
+from models import PRICE_PLACES, PRICE_SCALE
+from sqlite_um.user_manager import SQLiteUserManager
+from users import users
+
+from settings import get_settings
+settings = get_settings()
+
+# Exchange rates are stored as fixed-point integers, in ten-thousandths
+RATE_SCALE = 10 ** 4
+# Markups are stored in basis points
+MARKUP_SCALE = 10 ** 4
+
+
+class Conversion(NamedTuple):
+    """
+    Conversion of fixed-point base currency prices to the currency, customer group markup included.
+    Price is multiplied by numerator and divided by denominator.
+    """
+    currency: str
+    numerator: int
+    denominator: int
+
+    def apply(self, prices: np.ndarray) -> np.ndarray:
+        """
+        Converted fixed-point prices, rounded half up. Integer arithmetic, so the whole array
+        is converted at once and exactly.
+        """
+        return (prices * (2 * self.numerator) + self.denominator) // (2 * self.denominator)
+
+    def apply_decimal(self, price: Decimal) -> Decimal:
+        return self.apply_decimals([price])[0]
+
+    def apply_decimals(self, prices: list[Decimal]) -> list[Decimal]:
+        converted = self.apply(price_array((int(price * PRICE_SCALE) for price in prices), len(prices)))
+        return [Decimal(price).scaleb(-PRICE_PLACES) for price in converted.tolist()]
+
+
+def price_array(prices: Iterable[int], count: int) -> np.ndarray:
+    return np.fromiter(prices, dtype=np.int64, count=count)
+
+
+class PriceBook:
+    """
+    Exchange rates, markups of customer groups and users of the groups, mirrored from
+    users database into memory.
+    Changes made by the worker apply at once, the ones made by other workers
+    are picked up by the refresh every refresh_seconds.
+    """
+
+    def __init__(self, user_manager: SQLiteUserManager, refresh_seconds: float):
+        self.user_manager = user_manager
+        self.refresh_seconds = refresh_seconds
+        # currency -> fixed-point rate
+        self.rates: dict[str, int] = {}
+        # customer group -> markup in basis points
+        self.markups: dict[str, int] = {}
+        # username -> customer group
+        self.customer_groups: dict[str, str] = {}
+        self.refreshed: float = -math.inf
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        now = time.time()
+        if self.refreshed == -math.inf:
+            # Pricing tables may be missing if the worker took requests before warm-up
+            self.user_manager.migrate()
+        self.rates, self.markups, self.customer_groups = self.user_manager.get_price_rules()
+        self.refreshed = now
+
+    def refresh_if_due(self) -> None:
+        if time.time() - self.refreshed < self.refresh_seconds:
+            return
+        # Single refresh at a time, other requests go on with current rules
+        if self.lock.acquire(blocking=False):
+            try:
+                self.refresh()
+            finally:
+                self.lock.release()
+
+    def conversion(self, currency: str, username: str) -> Conversion | None:
+        """
+        Conversion to the currency for the user. None if the currency has no exchange rate.
+        """
+        self.refresh_if_due()
+        rate = RATE_SCALE if currency == settings.BASE_CURRENCY else self.rates.get(currency)
+        if rate is None:
+            return None
+        markup = self.markups.get(self.customer_groups.get(username, settings.DEFAULT_CUSTOMER_GROUP), 0)
+        numerator, denominator = (MARKUP_SCALE + markup) * RATE_SCALE, rate * MARKUP_SCALE
+        # Reduced, so that prices multiplied by numerator stay far within int64
+        divisor = math.gcd(numerator, denominator)
+        return Conversion(currency, numerator // divisor, denominator // divisor)
+
+    def set_exchange_rates(self, rates: dict[str, Decimal]) -> None:
+        fixed = {currency: int(rate * RATE_SCALE) for currency, rate in rates.items()}
+        self.user_manager.set_exchange_rates(fixed)
+        self.rates.update(fixed)
+
+    def set_markups(self, markups: dict[str, Decimal]) -> None:
+        """
+        :param markups: customer group -> markup in percents
+        """
+        fixed = {group: int(markup * MARKUP_SCALE / 100) for group, markup in markups.items()}
+        self.user_manager.set_markups(fixed)
+        self.markups.update(fixed)
+
+    def set_customer_groups(self, customer_groups: dict[str, str | None]) -> None:
+        self.user_manager.set_customer_groups(customer_groups)
+        for username, group in customer_groups.items():
+            if group is None:
+                self.customer_groups.pop(username, None)
+            else:
+                self.customer_groups[username] = group
+
+    def report(self) -> dict:
+        self.refresh_if_due()
+        return {
+            'base_currency': settings.BASE_CURRENCY,
+            'default_customer_group': settings.DEFAULT_CUSTOMER_GROUP,
+            'rates': {currency: Decimal(rate) / RATE_SCALE for currency, rate in self.rates.items()},
+            'markups': {group: Decimal(markup) * 100 / MARKUP_SCALE for group, markup in self.markups.items()},
+            'customer_groups': self.customer_groups,
+        }
+
+
+price_book = PriceBook(users, refresh_seconds=settings.PRICING_REFRESH_SECONDS)
+
+
+def get_conversion(currency: schemas.Currency | None = Query(
+                       default=None,
+                       description='Currency to quote prices in, markup of the customer group included',
+                   ),
+                   user: schemas.User = Security(dependencies.get_current_user, scopes=['catalogue'])
+                   ) -> Conversion | None:
+    """
+    Price conversion requested by currency parameter, None if prices are served as stored.
+    """
+    if currency is None:
+        return None
+    if (conversion := price_book.conversion(currency, user.username)) is None:
+        raise HTTPException(
+            status_code=422,
+            detail=[jsonable_encoder(schemas.ValidationErrorSchema(
+                loc='currency',
+                msg=f'No exchange rate of {currency}'
+            )), ]
+        )
+    return conversion
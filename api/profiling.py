@@ -0,0 +1,184 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine, Generator, TypeVar
+
+from anyio import to_thread
+from fastapi.exceptions import HTTPException
+from fastapi.security import SecurityScopes
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import dependencies
+
+from settings import get_settings
+settings = get_settings()
+
+PROFILE_HEADER = b'x-profile'
+PROFILE_ID_HEADER = b'x-profile-id'
+
+profile_id_pattern = re.compile(r'\d+-[0-9a-f]{8}')
+
+T = TypeVar('T')
+
+
+def profile_path(profile_id: str) -> str:
+    return os.path.join(settings.PROFILES_PATH, f'{profile_id}.prof')
+
+
+def list_profiles() -> list[str]:
+    """
+    Ids of stored profiles, the oldest first.
+    """
+    if not os.path.isdir(settings.PROFILES_PATH):
+        return []
+    return sorted(name.removesuffix('.prof') for name in os.listdir(settings.PROFILES_PATH)
+                  if profile_id_pattern.fullmatch(name.removesuffix('.prof')))
+
+
+class RequestProfile:
+    """
+    Profile of a single request: its steps on the event loop and its calls offloaded with run_sync,
+    each profiled in the worker thread running it.
+    """
+
+    def __init__(self):
+        self.loop = cProfile.Profile()
+        self.threads: list[cProfile.Profile] = []
+        self.lock = threading.Lock()
+
+    def run(self, func: Callable[..., T], *args) -> T:
+        profile = cProfile.Profile()
+        with self.lock:
+            self.threads.append(profile)
+        return profile.runcall(func, *args)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.loop)
+        with self.lock:
+            for profile in self.threads:
+                stats.add(profile)
+        return stats
+
+
+# Profile of the request being handled, None if it isn't profiled
+request_profile: ContextVar[RequestProfile | None] = ContextVar('request_profile', default=None)
+
+
+async def run_sync(func: Callable[..., T], *args) -> T:
+    """
+    to_thread.run_sync, profiling the call in the worker thread if the request is profiled.
+    """
+    if (profile := request_profile.get()) is None:
+        return await to_thread.run_sync(func, *args)
+    return await to_thread.run_sync(profile.run, func, *args)
+
+
+class ProfiledSteps:
+    """
+    Awaitable running the coroutine with the profiler enabled only while the coroutine itself runs.
+    The profiler is disabled whenever the coroutine awaits, so other requests run by the event loop
+    meanwhile aren't profiled.
+    """
+
+    def __init__(self, coroutine: Coroutine[Any, Any, T], profile: cProfile.Profile):
+        self.coroutine = coroutine
+        self.profile = profile
+
+    def __await__(self) -> Generator[Any, Any, T]:
+        steps = self.coroutine.__await__()
+        value, error = None, None
+        while True:
+            self.profile.enable()
+            try:
+                yielded = steps.send(value) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profile.disable()
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                steps.close()
+                raise
+            except BaseException as exc:
+                value, error = None, exc
+
+
+def save_profile(profile: RequestProfile, profile_id: str) -> None:
+    """
+    Dump the profile, dropping the oldest ones over PROFILES_KEEP.
+    """
+    os.makedirs(settings.PROFILES_PATH, exist_ok=True)
+    profile.stats().dump_stats(profile_path(profile_id))
+    for old_id in list_profiles()[:-settings.PROFILES_KEEP]:
+        os.remove(profile_path(old_id))
+
+
+def format_profile(profile_id: str, sort: str, limit: int) -> str:
+    """
+    Functions by time spent, each followed by the functions it called.
+    """
+    output = io.StringIO()
+    stats = pstats.Stats(profile_path(profile_id), stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    stats.print_callees(limit)
+    return output.getvalue()
+
+
+class ProfilingMiddleware:
+    """
+    Runs requests carrying X-Profile header under cProfile, for user managers only.
+    Id of the stored profile is returned in X-Profile-Id header.
+    Other requests are passed through as they are.
+
+    Only the request's own work is profiled: the steps of its task on the event loop
+    and the calls it offloads with run_sync. Tasks it spawns aren't profiled, sync dependencies
+    and endpoints run by FastAPI in the thread pool show up as awaits of it.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or not any(name == PROFILE_HEADER for name, _ in scope['headers']):
+            return await self.app(scope, receive, send)
+
+        if not self.authorized(HTTPConnection(scope)):
+            response = JSONResponse({'detail': 'Profiling is allowed to user managers only'}, status_code=403)
+            return await response(scope, receive, send)
+
+        profile_id = f'{time.time_ns() // 1000000}-{uuid.uuid4().hex[:8]}'
+
+        async def send_with_id(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', []), (PROFILE_ID_HEADER, profile_id.encode())]
+            await send(message)
+
+        profile = RequestProfile()
+        token = request_profile.set(profile)
+        try:
+            await ProfiledSteps(self.app(scope, receive, send_with_id), profile.loop)
+        finally:
+            request_profile.reset(token)
+            save_profile(profile, profile_id)
+
+    @staticmethod
+    def authorized(connection: HTTPConnection) -> bool:
+        scheme, _, token = connection.headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer':
+            token = connection.cookies.get('access_token')
+        if not token:
+            return False
+        try:
+            dependencies.get_current_user(SecurityScopes(['user_manager']), token)
+        except HTTPException:
+            return False
+        return True
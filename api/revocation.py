@@ -0,0 +1,91 @@
+import math
+import threading
+import time
+
+from sqlite_um.user_manager import SQLiteUserManager
+from users import users
+
+from settings import get_settings
+settings = get_settings()
+
+
+class TokenDenylist:
+    """
+    Revoked tokens mirrored from users database into memory, so the check of a request
+    is a couple of dict lookups.
+    Revocations made by the worker apply at once, the ones made by other workers
+    are picked up by the refresh every refresh_seconds.
+    Entries are pruned as soon as the tokens they revoke would have expired anyway.
+    """
+
+    def __init__(self, user_manager: SQLiteUserManager, refresh_seconds: float):
+        self.user_manager = user_manager
+        self.refresh_seconds = refresh_seconds
+        # jti -> expires
+        self.tokens: dict[str, int] = {}
+        # username -> (issued_before, expires)
+        self.users: dict[str, tuple[float, int]] = {}
+        self.usernames: set[str] = set()
+        self.refreshed: float = -math.inf
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        now = time.time()
+        if self.refreshed == -math.inf:
+            # Revocation tables may be missing if the worker took requests before warm-up
+            self.user_manager.migrate()
+        tokens, users = self.user_manager.get_revocations(int(now))
+        usernames = self.user_manager.get_usernames()
+        self.tokens, self.users, self.usernames = tokens, users, usernames
+        self.refreshed = now
+
+    def refresh_if_due(self) -> None:
+        if time.time() - self.refreshed < self.refresh_seconds:
+            return
+        # Single refresh at a time, other requests go on with current entries
+        if self.lock.acquire(blocking=False):
+            try:
+                self.refresh()
+            finally:
+                self.lock.release()
+
+    def is_revoked(self, username: str, jti: str | None, issued_at: float | None) -> bool:
+        """
+        Token is revoked if it was revoked itself, all the tokens of its user were revoked after
+        it had been issued, or its user doesn't exist.
+        Tokens issued before jti and iat claims were added are revoked along with their users only.
+        """
+        self.refresh_if_due()
+        if jti is not None and jti in self.tokens:
+            return True
+        if (revoked := self.users.get(username)) is not None and (issued_at or 0) <= revoked[0]:
+            return True
+        if username not in self.usernames:
+            # User added after the refresh
+            if username not in self.user_manager:
+                return True
+            self.usernames.add(username)
+        return False
+
+    def revoke_token(self, jti: str, expires: int) -> None:
+        self.user_manager.revoke_token(jti, expires)
+        self.tokens[jti] = expires
+
+    def revoke_user(self, username: str) -> None:
+        """
+        Revoke all the tokens issued to the user so far.
+        """
+        now = time.time()
+        expires = int(now) + settings.TOKEN_EXPIRE_HOURS * 3600 + 1
+        self.user_manager.revoke_user_tokens(username, issued_before=now, expires=expires)
+        self.users[username] = (now, expires)
+
+    def forget_user(self, username: str) -> None:
+        """
+        Revoke tokens of the deleted user.
+        """
+        self.revoke_user(username)
+        self.usernames.discard(username)
+
+
+denylist = TokenDenylist(users, refresh_seconds=settings.TOKEN_REVOCATION_REFRESH_SECONDS)
@@ -0,0 +1,62 @@
+import asyncio
+
+from fastapi import APIRouter, Security
+
+import crud
+import database
+import dependencies
+import profiling
+import schemas
+import snapshot
+from server_timing import span
+
+from settings import get_settings
+settings = get_settings()
+
+router = APIRouter(
+    tags=['Catalogue'],
+    dependencies=[
+        Security(dependencies.get_current_user, scopes=['catalogue'])
+    ],
+    prefix=settings.ROUTE_PREFIX + '/catalogues',
+)
+
+
+@router.get('/', response_model=list[schemas.CatalogueInfo])
+def catalogue_list():
+    """
+    Catalogues served, to be selected by catalogue parameter of the catalogue endpoints.
+    """
+    versions = []
+    for name, catalogue in database.catalogues.items():
+        with catalogue.SessionLocal() as db:
+            versions.append({'name': name, 'version': database.get_catalogue_version(db)})
+    return versions
+
+
+def search_catalogue(catalogue: database.Catalogue, query: str) -> list[dict]:
+    with catalogue.SessionLocal() as db:
+        if settings.CATALOGUE_SNAPSHOT:
+            results = snapshot.get_snapshot(db).search_products(query)
+        else:
+            results = [row._asdict() for row in crud.search_products(db, query)]
+    return [{**result, 'catalogue': catalogue.name} for result in results]
+
+
+router.responses = {422: {'model': list[schemas.ValidationErrorSchema]}}
+
+
+@router.post('/search/', response_model=list[schemas.CatalogueListedPartnums])
+async def search_all(search_request: schemas.SearchRequest):
+    """
+    Search for part number in all the catalogues at once.
+    Results are ordered by part number, then by catalogue.
+    """
+    # Catalogues are queried in threads, SQLite releases GIL while it scans
+    with span('db'):
+        results = await asyncio.gather(*(
+            profiling.run_sync(search_catalogue, catalogue, search_request.search_query)
+            for catalogue in database.catalogues.values()
+        ))
+    return sorted((result for catalogue_results in results for result in catalogue_results),
+                  key=lambda result: (result['part_no'], result['catalogue']))
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import re
+from itertools import groupby
+from typing import AsyncIterator, Iterator
+
+from fastapi import APIRouter, Depends, Query, Security
+from fastapi.exceptions import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+import crud
+import database
+from broadcast import ChangeBroadcaster, Subscription, broadcasters
+import dependencies
+import schemas
+
+from settings import get_settings
+settings = get_settings()
+
+router = APIRouter(
+    tags=['Sync'],
+    dependencies=[
+        Security(dependencies.get_current_user, scopes=['catalogue'])
+    ],
+    prefix=settings.ROUTE_PREFIX,
+)
+
+router.responses = {422: {'model': list[schemas.ValidationErrorSchema]}}
+
+
+def fold_changes(rows) -> Iterator[dict]:
+    """
+    Single change per part number out of its changes in successive versions.
+    """
+    for part_no, part_rows in groupby(rows, key=lambda row: row.part_no):
+        part_rows = list(part_rows)
+        first, last = part_rows[0], part_rows[-1]
+        if last.change == 'delete':
+            change, fields = 'delete', []
+        elif first.change == 'insert' or any(row.change == 'delete' for row in part_rows):
+            # Deleted and inserted again, the client has to fetch it as a new one
+            change, fields = 'insert', []
+        else:
+            change = 'update'
+            fields = sorted({field for row in part_rows if row.fields for field in row.fields.split(',')})
+        yield {'part_no': part_no, 'change': change, 'fields': fields, 'version': last.version}
+
+
+def parse_cursor(cursor: str | None, version: int) -> tuple[int, str]:
+    if cursor is None:
+        return version, ''
+    until, _, after = cursor.partition(':')
+    if not until.isdigit() or int(until) > version:
+        raise HTTPException(
+            status_code=422,
+            detail=[jsonable_encoder(schemas.ValidationErrorSchema(
+                loc='cursor',
+                msg='Invalid cursor'
+            )), ]
+        )
+    return int(until), after
+
+
+@router.get('/changes', response_model=schemas.CatalogueChanges)
+def changes(since: int = Query(ge=0, description='Catalogue version the client has'),
+            cursor: str | None = Query(default=None, description='"next" value of the previous page'),
+            limit: int = Query(default=1000, ge=1, le=10000),
+            stream: bool = Query(default=False, description='All pages as NDJSON stream'),
+            db: Session = Depends(database.db_session)):
+    """
+    Part numbers changed since the catalogue version.
+    Pages stick to the catalogue version of the first one, so an update applied
+    meanwhile is picked up by the next sync.
+    """
+    version = database.get_catalogue_version(db)
+    until, after = parse_cursor(cursor, version)
+    last_full = crud.get_last_full_version(db)
+    full_resync = since < version and (last_full is None or since < last_full)
+
+    if stream:
+        return StreamingResponse(
+            stream_changes(db, since, until, full_resync, limit),
+            media_type='application/x-ndjson',
+        )
+
+    page = [] if full_resync or since >= until else \
+        list(fold_changes(crud.get_changes_page(db, since, until, after, limit)))
+    return {
+        'version': until,
+        'full_resync': full_resync,
+        'changes': page,
+        'next': f'{until}:{page[-1]["part_no"]}' if len(page) == limit else None,
+    }
+
+
+def stream_changes(db: Session, since: int, until: int, full_resync: bool, limit: int) -> Iterator[bytes]:
+    """
+    Header line with version, then a line per changed part number.
+    """
+    yield json.dumps({'version': until, 'full_resync': full_resync}).encode() + b'\n'
+    if full_resync:
+        return
+    after = ''
+    while since < until:
+        if not (page := list(fold_changes(crud.get_changes_page(db, since, until, after, limit)))):
+            return
+        yield b''.join(json.dumps(change).encode() + b'\n' for change in page)
+        if len(page) < limit:
+            return
+        after = page[-1]['part_no']
+
+
+@router.get('/changes/watch', response_class=StreamingResponse, responses={200: {
+    'content': {'text/event-stream': {}},
+    'description': 'Server-sent events: "snapshot" with current values, then "change" on catalogue updates. '
+                   'Data of the events is a list of ' + schemas.StockChange.__name__ + '.',
+}})
+async def watch(part_number: list[str] = Query(description='Part numbers to watch'),
+                catalogue: database.CatalogueName = Query(default=settings.DEFAULT_CATALOGUE,
+                                                          description='Catalogue to watch')):
+    """
+    Price and stock of the part numbers, pushed as catalogue updates are applied.
+    """
+    part_numbers = frozenset(p.upper() for p in part_number)
+    if not 0 < len(part_numbers) <= settings.WATCH_MAX_PART_NUMBERS \
+            or not all(re.fullmatch(r'[A-Z0-9]{10}', p) for p in part_numbers):
+        raise HTTPException(
+            status_code=422,
+            detail=[jsonable_encoder(schemas.ValidationErrorSchema(
+                loc='part_number',
+                msg=f'Enter 1 to {settings.WATCH_MAX_PART_NUMBERS} valid Bosch part numbers'
+            )), ]
+        )
+    broadcaster = broadcasters[catalogue]
+    subscription = broadcaster.subscribe(part_numbers)
+    try:
+        snapshot = await broadcaster.snapshot(subscription)
+    except BaseException:
+        broadcaster.unsubscribe(subscription)
+        raise
+    return StreamingResponse(
+        stream_events(broadcaster, subscription, snapshot),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def stream_events(broadcaster: ChangeBroadcaster,
+                        subscription: Subscription,
+                        snapshot: bytes) -> AsyncIterator[bytes]:
+    """
+    Snapshot, then changes, with comments in between to keep the connection alive.
+    Ends if the client lags behind, so it reconnects and gets a fresh snapshot.
+    """
+    try:
+        yield snapshot
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.WATCH_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b': keep-alive\n\n'
+                continue
+            if event is None:
+                return
+            yield event
+    finally:
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Response, status
+
+import deadlines
+from logs import log_stats
+from schemas import Metrics, Readiness
+from search_cache import search_caches
+from singleflight import flights
+from warmup import readiness
+
+from settings import get_settings
+settings = get_settings()
+
+router = APIRouter(
+    tags=['Health'],
+    prefix=settings.ROUTE_PREFIX + '/health',
+)
+
+
+@router.get('/ready', response_model=Readiness)
+def ready(response: Response):
+    """
+    Readiness probe. 503 until the worker has finished warming up.
+    """
+    if not readiness.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return readiness.report()
+
+
+@router.get('/metrics', response_model=Metrics)
+def metrics():
+    """
+    Counters of the worker answering the request.
+    """
+    return {
+        'search_cache': {catalogue: cache.stats() for catalogue, cache in search_caches.items()},
+        'queries': deadlines.stats(),
+        'logging': log_stats.report(),
+        'coalescing': flights.stats(),
+    }
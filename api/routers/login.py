@@ -1,14 +1,15 @@
 from typing import Annotated
 from datetime import timedelta
 
-from fastapi import Depends, APIRouter, Security
+from fastapi import Depends, APIRouter, Response, Security, status
 from fastapi.security import OAuth2PasswordRequestForm
 
 from schemas import Token, User
-from dependencies import authenticate_user, create_token, get_current_user
+from dependencies import authenticate_user, create_token, decode_token, get_current_user, oauth2_scheme
+from revocation import denylist
 
-from settings import ApiSettings
-settings = ApiSettings()
+from settings import get_settings
+settings = get_settings()
 
 router = APIRouter(
     tags=['Auth'],
@@ -37,3 +38,25 @@ def get_logged_user(user: Annotated[
     Security(get_current_user, scopes=['catalogue'])
 ]):
     return user
+
+
+@router.post(
+    '/logout',
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_class=Response,
+    dependencies=[Security(get_current_user, scopes=['catalogue'])],
+)
+def logout(token: Annotated[str, Depends(oauth2_scheme)]):
+    """
+    Revoke the token the request is made with.
+    Tokens issued before token ids were introduced can't be revoked one by one,
+    so all the tokens of the user are revoked along with them.
+    """
+    payload = decode_token(token)
+    if (jti := payload.get('jti')) is None:
+        denylist.revoke_user(payload['sub'])
+    else:
+        denylist.revoke_token(jti, payload['exp'])
+    response = Response(status_code=status.HTTP_204_NO_CONTENT)
+    response.delete_cookie('access_token')
+    return response
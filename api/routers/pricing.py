@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Body, Security
+
+import dependencies
+from pricing import price_book
+from schemas import CustomerGroup, ExchangeRate, Markup, PriceRules, ValidationErrorSchema
+
+from settings import get_settings
+settings = get_settings()
+
+router = APIRouter(
+    tags=['UM'],
+    dependencies=[
+        Security(dependencies.get_current_user, scopes=['user_manager']),
+    ],
+    prefix=settings.ROUTE_PREFIX + '/pricing',
+)
+
+
+@router.get('/', response_model=PriceRules)
+def get_price_rules():
+    """
+    Exchange rates, markups of customer groups and users assigned to the groups.
+    Prices requested in a currency are converted by its rate, markup of the user's group included.
+    """
+    return price_book.report()
+
+
+router.responses = {422: {'model': list[ValidationErrorSchema]}}
+
+
+@router.post('/rates', response_model=PriceRules)
+def set_exchange_rates(rates: list[ExchangeRate] = Body(max_items=100)):
+    """
+    Add or replace exchange rates.
+    """
+    price_book.set_exchange_rates({rate.currency: rate.rate for rate in rates})
+    return price_book.report()
+
+
+@router.post('/markups', response_model=PriceRules)
+def set_markups(markups: list[Markup] = Body(max_items=100)):
+    """
+    Add or replace markups of customer groups. Groups without markup are quoted bare prices.
+    """
+    price_book.set_markups({markup.customer_group: markup.markup for markup in markups})
+    return price_book.report()
+
+
+@router.post('/customers', response_model=PriceRules)
+def set_customer_groups(customer_groups: list[CustomerGroup] = Body(max_items=1000)):
+    """
+    Assign users to customer groups.
+    """
+    price_book.set_customer_groups({user.username: user.customer_group for user in customer_groups})
+    return price_book.report()
@@ -1,18 +1,36 @@
+import csv
+import io
 import re
 from collections import defaultdict
 
-from fastapi import Depends, APIRouter, Path, Security
+from typing import Any, Callable
+
+import numpy as np
+from fastapi import Body, Depends, APIRouter, Path, Query, Security
 from fastapi.exceptions import HTTPException
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, conint, parse_obj_as
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
 import schemas
 import crud
 import database
 import dependencies
+import dimension_index
+import models
+import pricing
+import profiling
+import section_tree
+import snapshot
+from search_cache import get_search_cache
+from server_timing import span
+from shared_cache import get_shared_cache
+from singleflight import flights
 
-from settings import ApiSettings
-settings = ApiSettings()
+from settings import get_settings
+settings = get_settings()
 
 router = APIRouter(
     tags=['Catalogue'],
@@ -23,14 +41,83 @@ router = APIRouter(
 )
 
 
+def serialize(response_model: Any, content: Any) -> bytes:
+    """
+    Validate content against response model and render it the same way FastAPI does.
+    """
+    with span('serialize'):
+        return JSONResponse(jsonable_encoder(parse_obj_as(response_model, content))).body
+
+
+def catalogue_snapshot(db: Session) -> snapshot.CatalogueSnapshot | None:
+    """
+    In-memory catalogue if it's enabled to serve the reads instead of SQLite.
+    """
+    return snapshot.get_snapshot(db) if settings.CATALOGUE_SNAPSHOT else None
+
+
+# Changes of these fields show up in group listings or sections
+LISTED_FIELDS = {'title_en', 'group', 'product'}
+
+
+def stale_cache_keys(db: Session, since: int, version: int) -> list[str] | None:
+    """
+    Cached responses changed by incremental updates since the catalogue version.
+    None if the cache has to be dropped entirely: catalogue was reloaded in full,
+    its changelog is incomplete, or listings are changed.
+    """
+    try:
+        versions = crud.get_versions_since(db, since)
+    except OperationalError:
+        # Catalogue file without changelog
+        db.rollback()
+        return None
+    if [v.version for v in versions] != list(range(since + 1, version + 1)) or any(v.full for v in versions):
+        return None
+
+    stale_keys = []
+    for part_no, change, fields in crud.get_changes_since(db, since):
+        if change != 'update' or LISTED_FIELDS & set(fields.split(',')):
+            return None
+        stale_keys.append(f'product:{part_no}')
+    return stale_keys
+
+
+def cached_json(db: Session, key: str, build: Callable[[], bytes]) -> Response:
+    """
+    Serialized response from the shared cache of current catalogue version.
+    :param db: catalogue session to get the version
+    :param key: cache key of the response
+    :param build: function that queries and serializes the response on a miss
+    """
+    catalogue = database.get_catalogue(db).name
+    # Concurrent misses of the same response are built once
+    if (shared_cache := get_shared_cache(catalogue)) is None:
+        return Response(flights.do(('json', catalogue, key), build), media_type='application/json')
+    version = database.get_catalogue_version(db)
+    if 0 <= (cache_version := shared_cache.version) < version \
+            and (stale_keys := stale_cache_keys(db, cache_version, version)) is not None:
+        shared_cache.carry_over(cache_version, version, stale_keys)
+    content = shared_cache.get_or_set(key, version, lambda: flights.do(('json', catalogue, version, key), build))
+    return Response(content, media_type='application/json')
+
+
 @router.get('/sections/', response_model=list[schemas.Section])
 async def sections(db: Session = Depends(database.db_session)):
     """
     Complete list of sections, subsections and group in current Bosch price.
     """
+    return cached_sections(db)
+
 
+def cached_sections(db: Session) -> Response:
+    return cached_json(db, 'sections', lambda: serialize(list[schemas.Section], build_sections(db)))
+
+
+def build_sections(db: Session) -> list[dict]:
     # [(pk, title, subsection, section), ...]
-    fetched_list_of_groups = crud.get_all_groups(db)
+    with span('db'):
+        fetched_list_of_groups = crud.get_all_groups(db)
 
     # {section1: {subsection1: [sub_subsection1, ...], ...}, ...}
     dict_of_sections = defaultdict(lambda: defaultdict(list))
@@ -56,19 +143,198 @@ async def sections(db: Session = Depends(database.db_session)):
 router.responses = {422: {'model': list[schemas.ValidationErrorSchema]}}
 
 
-@router.get('/sections/{group_id}/')
+@router.get('/sections/top/', response_model=list[schemas.SectionNode])
+async def top_sections(db: Session = Depends(database.db_session)):
+    """
+    Sections of the catalogue with their product counts, without the levels below.
+    """
+    with span('db'):
+        nodes = section_tree.get_section_tree(db).sections
+    return Response(serialize(list[schemas.SectionNode], nodes), media_type='application/json')
+
+
+@router.get('/sections/{section_id}/subsections/', response_model=list[schemas.SubsectionNode])
+async def subsections(section_id: int = Path(title='The ID of section.', ge=1),
+                      db: Session = Depends(database.db_session)):
+    """
+    Subsections of the section with their product counts.
+    """
+    with span('db'):
+        if (nodes := section_tree.get_section_tree(db).subsections.get(section_id)) is None:
+            raise HTTPException(status_code=404, detail='No such section')
+    return Response(serialize(list[schemas.SubsectionNode], nodes), media_type='application/json')
+
+
+@router.get('/subsections/{subsection_id}/groups/', response_model=list[schemas.GroupNode])
+async def groups(subsection_id: int = Path(title='The ID of subsection.', ge=1),
+                 db: Session = Depends(database.db_session)):
+    """
+    Groups of the subsection with their product counts.
+    """
+    with span('db'):
+        if (nodes := section_tree.get_section_tree(db).groups.get(subsection_id)) is None:
+            raise HTTPException(status_code=404, detail='No such subsection')
+    return Response(serialize(list[schemas.GroupNode], nodes), media_type='application/json')
+
+
+EXPAND_DESCRIPTION = 'Comma-separated columns to add to the listing: price, stock, masterdata'
+
+
+def parse_expand(expand: str | None, conversion: pricing.Conversion | None) -> frozenset[str]:
+    """
+    Expansions out of comma-separated names like 'price,stock'. Price is listed if it's converted.
+    """
+    expansion = frozenset(filter(None, (name.strip() for name in (expand or '').split(','))))
+    if unknown := expansion.difference(crud.EXPANSIONS):
+        raise HTTPException(
+            status_code=422,
+            detail=[jsonable_encoder(schemas.ValidationErrorSchema(
+                loc='expand',
+                msg=f'Unknown expansion: {", ".join(sorted(unknown))}'
+            )), ]
+        )
+    return expansion | {'price'} if conversion is not None else expansion
+
+
+@router.get('/sections/{group_id}/', response_model=list[schemas.ListedPartnums] | list[schemas.ExpandedPartnums])
 async def products_by_group(group_id: int = Path(title='The ID of group of products.', ge=1),
-                            db: Session = Depends(database.db_session)) -> list[schemas.ListedPartnums]:
+                            expand: str | None = Query(default=None, description=EXPAND_DESCRIPTION),
+                            conversion: pricing.Conversion | None = Depends(pricing.get_conversion),
+                            db: Session = Depends(database.db_session)):
+    """
+    List of products in selected calatogue group. Prices are listed if currency is requested.
+    """
+    expansion = parse_expand(expand, conversion)
+    # Large groups are read off the event loop, so the query is cancelled as soon as the client disconnects
+    if expansion:
+        # Changes of prices and stock don't invalidate cached listings, converted prices depend on the customer,
+        # so expanded listings aren't cached
+        content = await profiling.run_sync(expanded_products_by_group, db, group_id, expansion, conversion)
+        return Response(content, media_type='application/json')
+
+    def build() -> bytes:
+        with span('db'):
+            if source := catalogue_snapshot(db):
+                products = source.get_products_by_group(group_id)
+            else:
+                products = crud.get_products_by_group(db, group_id)
+        return serialize(list[schemas.ListedPartnums], products)
+
+    return await profiling.run_sync(cached_json, db, f'group:{group_id}', build)
+
+
+def expanded_products_by_group(db: Session, group_id: int, expand: frozenset[str],
+                               conversion: pricing.Conversion | None) -> bytes:
+    with span('db'):
+        if source := catalogue_snapshot(db):
+            rows = source.get_expanded_products_by_group(group_id, expand)
+        else:
+            rows = crud.get_expanded_products_by_group(db, group_id, expand)
+    return serialize_expanded(rows, expand, conversion)
+
+
+def serialize_expanded(rows: list[tuple], expand: frozenset[str], conversion: pricing.Conversion | None) -> bytes:
+    """
+    Listing out of rows of part number, title and the columns of the expansions, see crud.EXPANSION_COLUMNS.
+    """
+    masterdata_fields = [column.key for column in crud.EXPANSION_COLUMNS['masterdata']]
+    if 'price' in expand:
+        prices = [row[2] for row in rows]
+        if conversion is not None:
+            converted = conversion.apply(pricing.price_array((price or 0 for price in prices), len(prices)))
+            prices = [None if price is None else value for price, value in zip(prices, converted.tolist())]
+        currency = settings.BASE_CURRENCY if conversion is None else conversion.currency
+
+    listing = []
+    for i, row in enumerate(rows):
+        listed = {'part_no': row[0], 'title_en': row[1]}
+        column = 2
+        if 'price' in expand:
+            listed['price'], listed['currency'] = prices[i], currency
+            column += 1
+        if 'stock' in expand:
+            listed['quantity'] = row[column]
+            column += 1
+        if 'masterdata' in expand:
+            values = row[column:column + len(masterdata_fields)]
+            listed['masterdata'] = None if values[0] is None else dict(zip(masterdata_fields, values))
+        listing.append(listed)
+    return serialize(list[schemas.expanded_model(expand)], listing)
+
+
+# Columns of price list export
+EXPORT_COLUMNS = ('part_no', 'title_en', 'title_ua', 'min_order', 'quantity', 'price', 'currency')
+
+
+@router.get('/products/export/', response_class=Response,
+            responses={200: {'content': {'text/csv': {}}, 'description': 'Price list, CSV'}})
+def export_price_list(conversion: pricing.Conversion | None = Depends(pricing.get_conversion),
+                      db: Session = Depends(database.db_session)):
     """
-    List of products in selected calatogue group.
+    Whole price list in CSV, ordered by part number.
     """
+    # The whole catalogue takes a while, so the endpoint runs in the thread pool
+    with span('db'):
+        rows = crud.get_price_list(db)
+    prices = pricing.price_array((row.price for row in rows), len(rows))
+    if conversion is not None:
+        prices = conversion.apply(prices)
+    units, hundredths = (column.tolist() for column in divmod(prices, models.PRICE_SCALE))
+    currency = settings.BASE_CURRENCY if conversion is None else conversion.currency
+
+    with span('serialize'):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(EXPORT_COLUMNS)
+        writer.writerows((part_no, title_en, title_ua, min_order, quantity, f'{unit}.{hundredth:02d}', currency)
+                         for (part_no, title_en, title_ua, min_order, quantity, _), unit, hundredth
+                         in zip(rows, units, hundredths))
+    return Response(output.getvalue(), media_type='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename="price_list.csv"'})
+
+
+# Fields of nested models which can be narrowed down with fields= too
+NESTED_FIELDS = {'product': schemas.Product, 'masterdata': schemas.MasterData}
 
-    list_of_products = crud.get_products_by_group(db, group_id)
-    return list_of_products
+
+def parse_fields(fields: str | None) -> schemas.Fieldset | None:
+    """
+    Fieldset out of comma-separated PartNumber fields like 'discontinued,product.price,masterdata'.
+    Part number is always included.
+    """
+    if fields is None:
+        return None
+    requested = {'part_no': set()}
+    for path in filter(None, (path.strip() for path in fields.split(','))):
+        name, _, subfield = path.partition('.')
+        if name not in schemas.PartNumber.__fields__ \
+                or subfield and (name not in NESTED_FIELDS or subfield not in NESTED_FIELDS[name].__fields__):
+            raise HTTPException(
+                status_code=422,
+                detail=[jsonable_encoder(schemas.ValidationErrorSchema(
+                    loc='fields',
+                    msg=f'Unknown field: {path}'
+                )), ]
+            )
+        # Whole model requested once stays whole
+        if name in requested and not requested[name]:
+            continue
+        requested.setdefault(name, set())
+        if subfield:
+            requested[name].add(subfield)
+        else:
+            requested[name].clear()
+    return tuple((name, frozenset(requested[name])) for name in schemas.PartNumber.__fields__ if name in requested)
 
 
 @router.get('/products/{part_number}/', response_model=schemas.PartNumber)
-async def product(part_number: str, db: Session = Depends(database.db_session)):
+async def product(part_number: str,
+                  fields: str | None = Query(
+                      default=None,
+                      description='Comma-separated fields to include, e.g. product.price,product.quantity',
+                  ),
+                  conversion: pricing.Conversion | None = Depends(pricing.get_conversion),
+                  db: Session = Depends(database.db_session)):
     """
     Detail catalogue info for the requested product.
     """
@@ -81,17 +347,237 @@ async def product(part_number: str, db: Session = Depends(database.db_session)):
             )), ]
         )
 
-    p = crud.get_partnum(db, part_no=part_number.upper())
-    if not p:
+    return product_detail(db, part_number.upper(), parse_fields(fields), conversion)
+
+
+def product_detail(db: Session, part_number: str, fieldset: schemas.Fieldset | None,
+                   conversion: pricing.Conversion | None) -> Response:
+    """
+    Detail of the part number, sparse if fieldset is given and priced in currency of the conversion if given.
+    """
+    def build() -> bytes:
+        with span('db'):
+            if source := catalogue_snapshot(db):
+                p = source.get_partnum(part_number)
+            elif fieldset is not None:
+                p = crud.get_partnum_fields(db, part_number, dict(fieldset))
+            else:
+                p = crud.get_partnum(db, part_no=part_number)
+        if not p:
+            raise HTTPException(status_code=404, detail='No such product')
+        model = schemas.PartNumber if fieldset is None else schemas.sparse_model(schemas.PartNumber, fieldset)
+        if conversion is not None:
+            p = parse_obj_as(model, p)
+            convert_prices([p], conversion)
+        return serialize(model, p)
+
+    if fieldset is not None or conversion is not None:
+        # Sparse responses are cheap to build and would be missed by the cache carry-over,
+        # converted prices depend on the customer
+        return Response(build(), media_type='application/json')
+    return cached_json(db, f'product:{part_number}', build)
+
+
+@router.get('/products/by-ean/{ean}/', response_model=schemas.PartNumber)
+async def product_by_ean(ean: int = Path(gt=0, le=schemas.EAN_MAX, description='EAN-13 barcode'),
+                         fields: str | None = Query(
+                             default=None,
+                             description='Comma-separated fields to include, e.g. product.price,product.quantity',
+                         ),
+                         conversion: pricing.Conversion | None = Depends(pricing.get_conversion),
+                         db: Session = Depends(database.db_session)):
+    """
+    Detail catalogue info for the product of the scanned barcode.
+    """
+    with span('db'):
+        part_numbers = dict(crud.get_part_numbers_by_ean(db, [ean]))
+    if ean not in part_numbers:
         raise HTTPException(status_code=404, detail='No such product')
-    return p
+    return product_detail(db, part_numbers[ean], parse_fields(fields), conversion)
+
+
+@router.post('/products/by-ean/', response_model=dict[int, schemas.PartNumber | None])
+async def products_by_ean(eans: list[conint(gt=0, le=schemas.EAN_MAX)] = Body(
+                              max_items=settings.EAN_LOOKUP_MAX_ITEMS, example=[4047020000001, 4047020000002]),
+                          fields: str | None = Query(
+                              default=None,
+                              description='Comma-separated fields to include, e.g. product.price,product.quantity',
+                          ),
+                          conversion: pricing.Conversion | None = Depends(pricing.get_conversion),
+                          db: Session = Depends(database.db_session)):
+    """
+    Details of the products of scanned barcodes, e.g. of a pallet, keyed on barcode.
+    Unknown barcodes map to null.
+    """
+    fieldset = parse_fields(fields)
+    # A pallet of barcodes takes a while to load and serialize, so it's done off the event loop
+    content = await profiling.run_sync(details_by_ean, db, list(dict.fromkeys(eans)), fieldset, conversion)
+    return Response(content, media_type='application/json')
 
 
-@router.post('/products/search/', response_model=list[schemas.ListedPartnums])
+def details_by_ean(db: Session, eans: list[int], fieldset: schemas.Fieldset | None,
+                   conversion: pricing.Conversion | None) -> bytes:
+    """
+    Details of the barcodes' products, loaded in a single query and serialized at once.
+    """
+    with span('db'):
+        part_numbers = dict(crud.get_part_numbers_by_ean(db, eans))
+        found = list(set(part_numbers.values()))
+        if source := catalogue_snapshot(db):
+            details = {part_no: source.get_partnum(part_no) for part_no in found}
+        else:
+            details = {p.part_no: p for p in crud.get_partnums(db, found, None if fieldset is None else dict(fieldset))}
+    model = schemas.PartNumber if fieldset is None else schemas.sparse_model(schemas.PartNumber, fieldset)
+    with span('serialize'):
+        details = parse_obj_as(dict[str, model], details)
+        if conversion is not None:
+            convert_prices(list(details.values()), conversion)
+        return JSONResponse(jsonable_encoder(
+            {ean: details[part_numbers[ean]] if ean in part_numbers else None for ean in eans}
+        )).body
+
+
+def convert_prices(details: list[BaseModel], conversion: pricing.Conversion) -> None:
+    """
+    Convert product prices of the details at once. Sparse details may come without product or its price.
+    """
+    products = [p for detail in details
+                if (p := getattr(detail, 'product', None)) is not None and 'price' in p.__fields__]
+    for p, price in zip(products, conversion.apply_decimals([p.price for p in products])):
+        p.price = price
+        if 'currency' in p.__fields__:
+            p.currency = conversion.currency
+
+
+@router.post('/products/search/', response_model=list[schemas.ListedPartnums] | list[schemas.ExpandedPartnums])
 async def search(search_request: schemas.SearchRequest,
+                 expand: str | None = Query(default=None, description=EXPAND_DESCRIPTION),
+                 conversion: pricing.Conversion | None = Depends(pricing.get_conversion),
                  db: Session = Depends(database.db_session)):
     """
     Search for specific part number in Bosch catalogue.
     """
-    results = crud.search_products(db, search_request.search_query)
-    return results
+    query = search_request.search_query
+    expansion = parse_expand(expand, conversion)
+    cache_key = f'{query}:{",".join(sorted(expansion))}' if expansion else query
+    # Converted prices depend on the customer, so they aren't cached
+    if conversion is None and (search_cache := get_search_cache(database.get_catalogue(db).name)) is not None:
+        version = database.get_catalogue_version(db)
+        if (cached := search_cache.get(cache_key, version)) is not None:
+            return Response(cached, media_type='application/json')
+    else:
+        search_cache = None
+
+    with span('db'):
+        source = catalogue_snapshot(db)
+        if source and expansion:
+            results = source.search_expanded_products(query, expansion)
+        elif source:
+            results = source.search_products(query)
+        elif expansion:
+            results = await profiling.run_sync(crud.search_expanded_products, db, query, expansion)
+        else:
+            # Off the event loop, so a pathological pattern is cancelled as soon as the client disconnects
+            results = await profiling.run_sync(crud.search_products, db, query)
+    if expansion:
+        content = serialize_expanded(results, expansion, conversion)
+    else:
+        content = serialize(list[schemas.ListedPartnums], results)
+    if search_cache is not None:
+        search_cache.set(cache_key, version, content, rows=len(results))
+    return Response(content, media_type='application/json')
+
+
+@router.post('/products/search/dimensions/', response_model=list[schemas.DimensionedPartnums])
+def search_by_dimensions(search_request: schemas.DimensionSearch,
+                         db: Session = Depends(database.db_session)):
+    """
+    Products fitting the box in any orientation and within the gross weight range.
+    Box sides left out are unlimited. Dimensions of masterdata are converted to mm and weights to kg.
+    """
+    with span('db'):
+        rows = dimension_index.get_dimension_index(db).search(
+            [search_request.length, search_request.width, search_request.height],
+            min_gross=dimension_index.milligrams(search_request.min_gross),
+            max_gross=dimension_index.milligrams(search_request.max_gross),
+            limit=search_request.limit,
+        )
+    results = [{'part_no': part_no, 'title_en': title_en, 'length': length, 'width': width, 'height': height,
+                'gross': dimension_index.kilograms(gross)}
+               for part_no, title_en, length, width, height, gross in rows]
+    return Response(serialize(list[schemas.DimensionedPartnums], results), media_type='application/json')
+
+
+@router.post('/quote/', response_model=schemas.Quote)
+async def quote(lines: list[schemas.BasketLine] = Body(max_items=settings.QUOTE_MAX_LINES),
+                conversion: pricing.Conversion | None = Depends(pricing.get_conversion),
+                db: Session = Depends(database.db_session)):
+    """
+    Quote of the basket lines. Quantities are rounded up to multiples of min order,
+    lines are flagged short if the stock doesn't cover the lines of the product together,
+    discontinued products come with a successor to order instead.
+    """
+    part_numbers = list({line.part_no for line in lines})
+    with span('db'):
+        if source := catalogue_snapshot(db):
+            rows = source.get_quote_rows(part_numbers)
+        else:
+            rows = crud.get_quote_rows(db, part_numbers)
+    return Response(serialize(schemas.Quote, build_quote(lines, rows, conversion)), media_type='application/json')
+
+
+def pick_successor(candidates: list[tuple[str, bool, int | None]]) -> str | None:
+    """
+    Successor in stock first, then the one still produced.
+    """
+    if not candidates:
+        return None
+    return min(candidates, key=lambda c: (c[1], not c[2], c[0]))[0]
+
+
+def build_quote(lines: list[schemas.BasketLine], rows: list[tuple], conversion: pricing.Conversion | None) -> dict:
+    # part_no -> (discontinued, min_order, stock, price), successors of discontinued ones
+    terms: dict[str, tuple] = {}
+    successors: dict[str, list[tuple]] = {}
+    for part_no, discontinued, min_order, stock, price, *successor in rows:
+        terms.setdefault(part_no, (discontinued, min_order, stock, price))
+        if successor[0] is not None:
+            successors.setdefault(part_no, []).append(tuple(successor))
+
+    # Every line in one pass of array arithmetic. Out of price products are ordered by one with no stock.
+    count = len(lines)
+    line_terms = [terms.get(line.part_no) for line in lines]
+    priced = np.fromiter((t is not None and t[3] is not None for t in line_terms), dtype=bool, count=count)
+    quantity = np.fromiter((line.quantity for line in lines), dtype=np.int64, count=count)
+    min_order = np.fromiter(((t[1] or 1) if p else 1 for t, p in zip(line_terms, priced)), dtype=np.int64, count=count)
+    stock = np.fromiter((t[2] if p else 0 for t, p in zip(line_terms, priced)), dtype=np.int64, count=count)
+    price = np.fromiter((t[3] if p else 0 for t, p in zip(line_terms, priced)), dtype=np.int64, count=count)
+    if conversion is not None:
+        price = conversion.apply(price)
+
+    order_quantity = -(-quantity // min_order) * min_order
+    # Lines of the same product draw on the same stock
+    _, product = np.unique([line.part_no for line in lines], return_inverse=True)
+    ordered = np.bincount(product, weights=order_quantity)[product]
+    short = ordered > stock
+    total = price * order_quantity
+
+    return {
+        'lines': [{
+            'part_no': line.part_no,
+            'quantity': line.quantity,
+            'found': t is not None,
+            'discontinued': None if t is None else t[0],
+            'successor': pick_successor(successors.get(line.part_no, [])),
+            'min_order': m if p else None,
+            'order_quantity': o if p else None,
+            'stock': s if p else None,
+            'short': bool(sh),
+            'price': pr if p else None,
+            'total': tt if p else None,
+        } for line, t, p, m, o, s, sh, pr, tt in zip(
+            lines, line_terms, priced.tolist(), min_order.tolist(), order_quantity.tolist(), stock.tolist(),
+            short.tolist(), price.tolist(), total.tolist())],
+        'total': int(total[priced].sum()),
+        'currency': settings.BASE_CURRENCY if conversion is None else conversion.currency,
+    }
@@ -0,0 +1,43 @@
+from typing import Literal
+
+from fastapi import APIRouter, Query, Security
+from fastapi.exceptions import HTTPException
+from fastapi.responses import FileResponse, PlainTextResponse
+
+import dependencies
+import profiling
+
+from settings import get_settings
+settings = get_settings()
+
+router = APIRouter(
+    tags=['UM'],
+    dependencies=[
+        Security(dependencies.get_current_user, scopes=['user_manager']),
+    ],
+    prefix=settings.ROUTE_PREFIX + '/profiles',
+)
+
+
+@router.get('/', response_model=list[str])
+def get_profile_list():
+    """
+    Ids of stored request profiles, the latest first.
+    Requests are profiled if made by user managers with X-Profile header.
+    """
+    return profiling.list_profiles()[::-1]
+
+
+@router.get('/{profile_id}', response_class=PlainTextResponse)
+def get_profile(profile_id: str,
+                sort: Literal['cumulative', 'tottime', 'calls'] = 'cumulative',
+                limit: int = Query(default=60, ge=1, le=1000),
+                raw: bool = Query(default=False, description='pstats file for snakeviz and alike')):
+    """
+    Functions of the profiled request by time spent, with the functions they called.
+    """
+    if profile_id not in profiling.list_profiles():
+        raise HTTPException(status_code=404, detail='No such profile')
+    if raw:
+        return FileResponse(profiling.profile_path(profile_id), filename=f'{profile_id}.prof')
+    return profiling.format_profile(profile_id, sort, limit)
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, Query, Security
+
+import dependencies
+from schemas import Usage
+from usage import usage_meter
+
+from settings import get_settings
+settings = get_settings()
+
+router = APIRouter(
+    tags=['UM'],
+    dependencies=[
+        Security(dependencies.get_current_user, scopes=['user_manager']),
+    ],
+    prefix=settings.ROUTE_PREFIX + '/usage',
+)
+
+
+@router.get('/', response_model=list[Usage])
+def get_usage(since: datetime | None = Query(default=None, description='Start of the period, 30 days ago by default'),
+              until: datetime | None = Query(default=None, description='End of the period, now by default'),
+              username: str | None = Query(default=None, description='Usage of the user only'),
+              per_bucket: bool = Query(default=False, description='Usage per time bucket instead of the period total')):
+    """
+    Requests and response bytes of users per route over the period.
+    Usage is counted in buckets of USAGE_BUCKET_SECONDS, a bucket is in the period if it starts within.
+    """
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=30)
+    return usage_meter.report(int(since.timestamp()), int(until.timestamp()), username, per_bucket)
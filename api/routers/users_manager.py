@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Depends, Security
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jose import JWTError, jwt
+
+from fastapi import APIRouter, Body, Depends, Response, Security, status
 from fastapi.exceptions import HTTPException
 from fastapi.encoders import jsonable_encoder
 
 import dependencies
+from pricing import price_book
+from revocation import denylist
 from schemas import User, UserValidation, ValidationErrorSchema
 from sqlite_um.user_manager import SQLiteUserManager, UserAlreadyExists
 
-from settings import ApiSettings
-settings = ApiSettings()
+from settings import get_settings
+settings = get_settings()
 
 
 router = APIRouter(
@@ -56,4 +63,76 @@ def delete_user(username: str,
         username=username
     )
     um.delete_user(poor_user.username)
+    denylist.forget_user(poor_user.username)
+    price_book.set_customer_groups({poor_user.username: None})
+    return um.get_all_users()
+
+
+@router.post('/batch', response_model=list[User])
+def add_new_users(new_users: list[UserValidation] = Body(max_items=1000),
+                  um: SQLiteUserManager = Depends(get_user_manager)):
+    """
+    Add users at once. None is added if any username is already used.
+    """
+    # bcrypt releases GIL, so hashing hundreds of passwords runs in parallel
+    with ThreadPoolExecutor() as executor:
+        hashed = list(executor.map(dependencies.hash_password, [user.password for user in new_users]))
+    for user, password in zip(new_users, hashed):
+        user.password = password
+    try:
+        um.add_users([user.dict() for user in new_users])
+    except UserAlreadyExists as exc:
+        raise HTTPException(
+            status_code=422,
+            detail=[jsonable_encoder(ValidationErrorSchema(
+                loc='username',
+                msg=str(exc)
+            )), ]
+        )
+    return um.get_all_users()
+
+
+@router.post('/batch/delete', response_model=list[User])
+def delete_users(users: list[User] = Body(max_items=1000),
+                 um: SQLiteUserManager = Depends(get_user_manager)):
+    um.delete_users([user.username for user in users])
+    for user in users:
+        denylist.forget_user(user.username)
+    price_book.set_customer_groups({user.username: None for user in users})
     return um.get_all_users()
+
+
+@router.post('/tokens/revoke', status_code=status.HTTP_204_NO_CONTENT, response_class=Response)
+def revoke_token(access_token: str = Body(embed=True)):
+    """
+    Revoke the token. Expired tokens need no revocation.
+    """
+    try:
+        payload = jwt.decode(access_token, settings.AUTH_KEY, algorithms=[settings.AUTH_ALG, ],
+                             options={'verify_exp': False})
+    except JWTError:
+        raise HTTPException(
+            status_code=422,
+            detail=[jsonable_encoder(ValidationErrorSchema(
+                loc='access_token',
+                msg='Invalid token'
+            )), ]
+        )
+    if payload.get('exp', 0) <= time.time() or payload.get('sub') is None:
+        return
+    if (jti := payload.get('jti')) is None:
+        # Issued before token ids were introduced
+        denylist.revoke_user(payload['sub'])
+    else:
+        denylist.revoke_token(jti, payload['exp'])
+
+
+@router.post('/{username}/tokens/revoke', status_code=status.HTTP_204_NO_CONTENT, response_class=Response)
+def revoke_user_tokens(username: str):
+    """
+    Revoke all the tokens issued to the user so far.
+    """
+    poor_user = User(
+        username=username
+    )
+    denylist.revoke_user(poor_user.username)
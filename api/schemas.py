@@ -1,16 +1,35 @@
 from __future__ import annotations
 import re
+from datetime import datetime
 from decimal import Decimal
+from functools import lru_cache
+from typing import Literal
 from pydantic import (
     BaseModel,
+    create_model,
     validator,
     root_validator,
+    condecimal,
+    conint,
     constr,
     Field,
 )
 
 import settings
-settings = settings.ApiSettings()
+from models import PRICE_PLACES
+settings = settings.get_settings()
+
+Currency = Literal[tuple(settings.CURRENCIES)]
+
+# EAN-13 barcodes are 13 digits at most
+EAN_MAX = 10 ** 13 - 1
+
+
+def decimal_price(value):
+    """
+    Prices are read as fixed-point integers. Decimal places are kept, so whole prices are rendered as before.
+    """
+    return Decimal(value).scaleb(-PRICE_PLACES) if isinstance(value, int) else value
 
 
 class Group(BaseModel):
@@ -52,6 +71,34 @@ class Section(BaseModel):
         }
 
 
+class TreeNode(BaseModel):
+    id: int
+    title: str
+    products: int = Field(example=42, description='Products in the node')
+    path: str | None = Field(example='/path_to_next_level/without/api/version')
+
+
+class SectionNode(TreeNode):
+    @root_validator
+    def make_url(cls, values):
+        values['path'] = f"/sections/{values['id']}/subsections/"
+        return values
+
+
+class SubsectionNode(TreeNode):
+    @root_validator
+    def make_url(cls, values):
+        values['path'] = f"/subsections/{values['id']}/groups/"
+        return values
+
+
+class GroupNode(TreeNode):
+    @root_validator
+    def make_url(cls, values):
+        values['path'] = f"/sections/{values['id']}/"
+        return values
+
+
 part_no_field = Field(example='AZ0910CHAR')
 title_en_field = Field(example='Product english description. \'None\' in case of refers list')
 
@@ -77,9 +124,12 @@ class Product(BaseModel):
     min_order: int
     quantity: int
     price: Decimal
+    currency: str = Field(default=settings.BASE_CURRENCY, example='UAH')
     truck: bool
     group: Group
 
+    _price = validator('price', pre=True, allow_reuse=True)(decimal_price)
+
     class Config:
         orm_mode = True
 
@@ -112,6 +162,66 @@ class PartNumber(BaseModel):
         orm_mode = True
 
 
+# Field of PartNumber -> its fields to include, empty for all of them
+Fieldset = tuple[tuple[str, frozenset[str]], ...]
+
+
+@lru_cache(maxsize=128)
+def sparse_model(model: type[BaseModel], fields: Fieldset) -> type[BaseModel]:
+    """
+    Model with the subset of fields of the given one and their validators.
+    Nested models are narrowed down as well.
+    """
+    definitions = {}
+    for name, subfields in fields:
+        field = model.__fields__[name]
+        annotation = field.annotation
+        if subfields:
+            annotation = sparse_model(field.type_, tuple(
+                (subfield, frozenset()) for subfield in field.type_.__fields__ if subfield in subfields
+            ))
+            if field.allow_none:
+                annotation = annotation | None
+        definitions[name] = (annotation, field.field_info)
+    validators = {
+        f'_{name}_{i}': validator(name, pre=v.pre, each_item=v.each_item, always=v.always, allow_reuse=True)(v.func)
+        for name, _ in fields for i, v in enumerate(model.__validators__.get(name, ()))
+    }
+    return create_model(f'Sparse{model.__name__}', __config__=model.__config__, __validators__=validators,
+                        **definitions)
+
+
+class ExpandedPartnums(ListedPartnums):
+    """
+    Listed part number with the fields of every expansion. Fields of the expansions not requested are left out.
+    """
+    price: Decimal | None = Field(description='Expanded by price. None if the product is out of price')
+    currency: str = Field(example='UAH', description='Expanded by price')
+    quantity: int | None = Field(example=15, description='Expanded by stock')
+    masterdata: MasterData | None = Field(description='Expanded by masterdata')
+
+    _price = validator('price', pre=True, allow_reuse=True)(decimal_price)
+
+
+# Expansion of listings -> its fields
+EXPANSION_FIELDS = {
+    'price': ('price', 'currency'),
+    'stock': ('quantity', ),
+    'masterdata': ('masterdata', ),
+}
+
+
+@lru_cache
+def expanded_model(expand: frozenset[str]) -> type[BaseModel]:
+    """
+    ListedPartnums with the fields of the expansions.
+    """
+    fields = {name: (ExpandedPartnums.__fields__[name].annotation, ExpandedPartnums.__fields__[name].field_info)
+              for expansion in EXPANSION_FIELDS if expansion in expand for name in EXPANSION_FIELDS[expansion]}
+    validators = {'_price': validator('price', pre=True, allow_reuse=True)(decimal_price)} if 'price' in expand else {}
+    return create_model('ExpandedPartnums', __base__=ListedPartnums, __validators__=validators, **fields)
+
+
 class SearchRequest(BaseModel):
     search_query: constr(
         strip_whitespace=True,
@@ -128,6 +238,61 @@ class SearchRequest(BaseModel):
         return v.replace('?', '_')
 
 
+class DimensionSearch(BaseModel):
+    length: conint(gt=0, le=100000) | None = Field(example=300, description='Side of the box in mm')
+    width: conint(gt=0, le=100000) | None = Field(example=200, description='Side of the box in mm')
+    height: conint(gt=0, le=100000) | None = Field(example=150, description='Side of the box in mm')
+    min_gross: condecimal(ge=0, le=1000, decimal_places=6) | None = Field(example=0.5, description='Weight in kg')
+    max_gross: condecimal(ge=0, le=1000, decimal_places=6) | None = Field(example=2, description='Weight in kg')
+    limit: conint(gt=0, le=settings.DIMENSION_SEARCH_LIMIT) = 100
+
+    @root_validator(skip_on_failure=True)
+    def check_weight_range(cls, values):
+        if None not in (values['min_gross'], values['max_gross']) and values['min_gross'] > values['max_gross']:
+            raise ValueError('Min gross weight exceeds max gross weight.')
+        return values
+
+
+class DimensionedPartnums(ListedPartnums):
+    length: int = Field(example=120, description='mm')
+    width: int = Field(example=80, description='mm')
+    height: int = Field(example=40, description='mm')
+    gross: Decimal = Field(example=0.735, description='kg')
+
+
+class BasketLine(BaseModel):
+    part_no: constr(
+        strip_whitespace=True,
+        to_upper=True,
+        regex=r'^[A-Z0-9]{10}$',
+    ) = part_no_field
+    quantity: conint(gt=0, le=1000000) = Field(example=12)
+
+
+class QuoteLine(BaseModel):
+    part_no: str = part_no_field
+    quantity: int = Field(example=12, description='Requested quantity')
+    found: bool = Field(description='Part number is in the catalogue')
+    discontinued: bool | None
+    successor: str | None = Field(example='AZ0910CHAR', description='Replacement of discontinued product')
+    min_order: int | None = Field(example=10)
+    order_quantity: int | None = Field(example=20, description='Requested quantity rounded up to min order')
+    stock: int | None = Field(example=15, description='None if the product is out of price')
+    short: bool = Field(description='Stock doesn\'t cover the quantity ordered by the lines of the product')
+    price: Decimal | None = Field(description='Unit price, None if the product is out of price')
+    total: Decimal | None
+
+    _price = validator('price', 'total', pre=True, allow_reuse=True)(decimal_price)
+
+
+class Quote(BaseModel):
+    lines: list[QuoteLine]
+    total: Decimal
+    currency: str = Field(example='UAH')
+
+    _total = validator('total', pre=True, allow_reuse=True)(decimal_price)
+
+
 class ValidationErrorSchema(BaseModel):
     loc: str = Field(example='field_caused_an_error')
     msg: str = Field(example='Error message')
@@ -157,3 +322,126 @@ class Token(BaseModel):
 
 class TokenData(User):
     scopes: list[str] = []
+
+
+class Readiness(BaseModel):
+    ready: bool
+    warmup_seconds: float | None = Field(example=1.234)
+    startup_seconds: float | None = Field(example=2.345)
+    error: str | None
+
+
+class CatalogueChange(BaseModel):
+    part_no: str = part_no_field
+    change: str = Field(example='update', description='insert, update or delete')
+    fields: list[str] = Field(example=['price', 'quantity'], description='Changed fields of update')
+    version: int = Field(example=42, description='Catalogue version of the latest change')
+
+
+class CatalogueChanges(BaseModel):
+    version: int = Field(example=42, description='Current catalogue version, next "since" value')
+    full_resync: bool = Field(description='Changes are unknown, the whole catalogue has to be pulled')
+    changes: list[CatalogueChange]
+    next: str | None = Field(example='42:0445115007', description='Cursor of the next page')
+
+
+class StockChange(BaseModel):
+    part_no: str = part_no_field
+    price: Decimal | None = Field(description='None if the product is out of price')
+    quantity: int | None
+    version: int = Field(example=42, description='Catalogue version the values are of')
+
+    _price = validator('price', pre=True, allow_reuse=True)(decimal_price)
+
+
+class SearchCacheStats(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: float | None = Field(example=0.85)
+    entries: int
+    rows: int = Field(description='Cached result rows')
+    max_rows: int
+    evictions: int
+    oversized: int = Field(description='Results not cached for their size')
+
+
+class QueryStats(BaseModel):
+    timed_out: int = Field(description='Queries interrupted past their deadline')
+    cancelled: int = Field(description='Queries interrupted as their client has disconnected')
+
+
+class LogStats(BaseModel):
+    queued: int = Field(description='Records waiting for the listener thread')
+    dropped: int = Field(description='Records dropped as the queue was full')
+    throttled: int = Field(description='Repeats of the same message dropped')
+    requests: int = Field(description='Access lines logged')
+    overhead_us: float | None = Field(example=12.5, description='Mean time a request spends logging its access line')
+
+
+class CoalescingStats(BaseModel):
+    calls: int = Field(description='Queries and responses built')
+    coalesced: int = Field(description='Concurrent identical calls served by a call in progress')
+
+
+class Metrics(BaseModel):
+    search_cache: dict[str, SearchCacheStats] = Field(description='Per catalogue')
+    queries: QueryStats
+    logging: LogStats
+    coalescing: CoalescingStats
+
+
+class CatalogueInfo(BaseModel):
+    name: str = Field(example='bosch')
+    version: int = Field(example=42)
+
+
+class CatalogueListedPartnums(ListedPartnums):
+    catalogue: str = Field(example='bosch')
+
+    @root_validator
+    def add_catalogue(cls, values):
+        if values['catalogue'] != settings.DEFAULT_CATALOGUE:
+            values['path'] += f"?catalogue={values['catalogue']}"
+        return values
+
+
+class ExchangeRate(BaseModel):
+    currency: Currency = Field(example='EUR')
+    rate: condecimal(gt=0, max_digits=12, decimal_places=4) = Field(
+        example=Decimal('41.2345'), description='Base currency units per currency unit')
+
+    @validator('currency')
+    def not_base_currency(cls, v):
+        if v == settings.BASE_CURRENCY:
+            raise ValueError('Prices are stored in base currency, it needs no rate')
+        return v
+
+
+customer_group_type = constr(strip_whitespace=True, min_length=1, max_length=25, regex=r'^[a-zA-Z0-9_]+$')
+
+
+class Markup(BaseModel):
+    customer_group: customer_group_type = Field(example='wholesale')
+    markup: condecimal(gt=-100, le=1000, decimal_places=2) = Field(
+        example=Decimal('12.5'), description='Percent added to prices, negative for a discount')
+
+
+class CustomerGroup(User):
+    customer_group: customer_group_type | None = Field(
+        example='wholesale', description='None returns the user to the default group')
+
+
+class PriceRules(BaseModel):
+    base_currency: str = Field(example='UAH')
+    default_customer_group: str = Field(example='default')
+    rates: dict[str, Decimal] = Field(example={'EUR': Decimal('41.2345')})
+    markups: dict[str, Decimal] = Field(example={'wholesale': Decimal('12.5')}, description='Percents')
+    customer_groups: dict[str, str] = Field(example={'JohnSmith': 'wholesale'})
+
+
+class Usage(BaseModel):
+    username: str = Field(example='JohnSmith')
+    route: str = Field(example='GET /api/v1/products/{part_number}/')
+    bucket: datetime | None = Field(description='Start of the time bucket, None if summed up over the period')
+    requests: int
+    bytes: int = Field(description='Response bytes')
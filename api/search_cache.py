@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict
+
+from settings import get_settings
+settings = get_settings()
+
+
+class SearchCache:
+    """
+    LRU cache of serialized search results of the worker, keyed on normalized pattern.
+    Size is capped by the total of result rows, and a result over max_result_rows
+    isn't cached at all, so a few broad patterns can't take the whole cache.
+    Entries of previous catalogue versions are dropped as soon as a newer one is seen.
+    """
+
+    def __init__(self, max_rows: int, max_result_rows: int):
+        self.max_rows = max_rows
+        self.max_result_rows = max_result_rows
+        # pattern -> (serialized results, rows)
+        self.entries: OrderedDict[str, tuple[bytes, int]] = OrderedDict()
+        self.version: int | None = None
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversized = 0
+        self.lock = threading.Lock()
+
+    def _check_version(self, version: int) -> bool:
+        """
+        False for an outdated version. Entries are dropped on a newer one.
+        """
+        if self.version is not None and version < self.version:
+            return False
+        if version != self.version:
+            self.entries.clear()
+            self.rows = 0
+            self.version = version
+        return True
+
+    def get(self, pattern: str, version: int) -> bytes | None:
+        with self.lock:
+            if self._check_version(version) and (entry := self.entries.get(pattern)) is not None:
+                self.entries.move_to_end(pattern)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def set(self, pattern: str, version: int, results: bytes, rows: int) -> bool:
+        with self.lock:
+            if rows > self.max_result_rows:
+                self.oversized += 1
+                return False
+            if not self._check_version(version):
+                return False
+            if (previous := self.entries.pop(pattern, None)) is not None:
+                self.rows -= previous[1]
+            # Empty results still take a row, so the entries are capped too
+            rows = max(rows, 1)
+            while self.entries and self.rows + rows > self.max_rows:
+                _, (_, evicted_rows) = self.entries.popitem(last=False)
+                self.rows -= evicted_rows
+                self.evictions += 1
+            self.entries[pattern] = (results, rows)
+            self.rows += rows
+            return True
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / requests, 4) if requests else None,
+            'entries': len(self.entries),
+            'rows': self.rows,
+            'max_rows': self.max_rows,
+            'evictions': self.evictions,
+            'oversized': self.oversized,
+        }
+
+
+# Catalogue name -> its cache
+search_caches: dict[str, SearchCache] = {}
+_search_caches_lock = threading.Lock()
+
+
+def get_search_cache(catalogue: str) -> SearchCache | None:
+    """
+    Cache of the catalogue. None if caching is disabled.
+    """
+    if not settings.SEARCH_CACHE_ROWS:
+        return None
+    if (cache := search_caches.get(catalogue)) is None:
+        with _search_caches_lock:
+            cache = search_caches.setdefault(catalogue, SearchCache(
+                max_rows=settings.SEARCH_CACHE_ROWS,
+                max_result_rows=settings.SEARCH_CACHE_ROWS // 10,
+            ))
+    return cache
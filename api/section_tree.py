@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+import crud
+import database
+
+logger = logging.getLogger(__name__)
+
+
+class SectionTree:
+    """
+    Sections, subsections and groups of a catalogue version, each with count of its products.
+    Nodes are listed by their parent, so a level of the tree is a single lookup.
+    Every section and subsection is listed, even if it has no children.
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.sections: list[dict] = []
+        # section id -> its subsections
+        self.subsections: dict[int, list[dict]] = {}
+        # subsection id -> its groups
+        self.groups: dict[int, list[dict]] = {}
+
+    @classmethod
+    def load(cls, db: Session) -> 'SectionTree':
+        started = time.perf_counter()
+        tree = cls(database.get_catalogue_version(db))
+        tree._load(db)
+        logger.info(f'Section tree of version {tree.version} is loaded in {time.perf_counter() - started:.3f} s')
+        return tree
+
+    def _load(self, db: Session) -> None:
+        subsection_counts: dict[int, int] = {}
+        for group_id, title, subsection_id, products in crud.get_group_counts(db):
+            self.groups.setdefault(subsection_id, []).append({'id': group_id, 'title': title, 'products': products})
+            subsection_counts[subsection_id] = subsection_counts.get(subsection_id, 0) + products
+
+        section_counts: dict[int, int] = {}
+        for subsection_id, title, section_id in crud.get_subsections(db):
+            products = subsection_counts.get(subsection_id, 0)
+            self.groups.setdefault(subsection_id, [])
+            self.subsections.setdefault(section_id, []).append(
+                {'id': subsection_id, 'title': title, 'products': products})
+            section_counts[section_id] = section_counts.get(section_id, 0) + products
+
+        for section_id, title in crud.get_sections(db):
+            self.sections.append({'id': section_id, 'title': title, 'products': section_counts.get(section_id, 0)})
+            self.subsections.setdefault(section_id, [])
+
+
+# Catalogue name -> its tree
+_trees: dict[str, SectionTree] = {}
+_tree_lock = threading.Lock()
+
+
+def get_section_tree(db: Session) -> SectionTree:
+    """
+    Tree of the current version of session's catalogue. Reloaded once the version changes.
+    """
+    name = database.get_catalogue(db).name
+    version = database.get_catalogue_version(db)
+    if (tree := _trees.get(name)) is None or tree.version != version:
+        with _tree_lock:
+            if (tree := _trees.get(name)) is None or tree.version != version:
+                tree = _trees[name] = SectionTree.load(db)
+    return tree
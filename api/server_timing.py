@@ -0,0 +1,75 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from settings import get_settings
+settings = get_settings()
+
+# Span name -> description shown by browser devtools
+SPANS = {
+    'auth': 'Authentication',
+    'db': 'Catalogue reads',
+    'serialize': 'Serialization',
+}
+
+# Span name -> seconds spent, of the current request. None if timing is off.
+request_timings: ContextVar[dict[str, float] | None] = ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Add the time spent within to the span of the current request.
+    Spans of the same name are summed up.
+    """
+    if (timings := request_timings.get()) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - started
+
+
+def header_value(timings: dict[str, float], total: float) -> bytes:
+    metrics = [f'{name};desc="{SPANS[name]}";dur={timings[name] * 1000:.1f}' for name in SPANS if name in timings]
+    metrics.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(metrics).encode()
+
+
+class ServerTimingMiddleware:
+    """
+    Adds Server-Timing header with the spans of the request.
+    Spans made after the response has started, e.g. of streamed responses, are not reported.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # Devtools show timings of cross-origin responses only to the allowed origins
+        self.allow_origin = ', '.join(settings.CORS_ALLOWED_ORIGINS).encode()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                message['headers'] = [
+                    *message.get('headers', []),
+                    (b'server-timing', header_value(timings, time.perf_counter() - started)),
+                    (b'timing-allow-origin', self.allow_origin),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
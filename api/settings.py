@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from pydantic import (
     BaseSettings
 )
@@ -22,12 +24,92 @@ class DevSettings(BaseSettings):
 
     # Databases:
     DATABASE_PATH: str = 'bp.sqlite'
+    # Catalogue of DATABASE_PATH is served under this name
+    DEFAULT_CATALOGUE: str = 'bosch'
+    # Other catalogues of the same structure, name -> database path
+    CATALOGUES: dict[str, str] = {}
     USERS_DB_PATH: str = 'users.sqlite'
 
+    # Tables read through on startup to get their pages into OS cache
+    WARMUP_TABLES: list[str] = [
+        'sect',
+        'subsect',
+        'subsub',
+        'partnum',
+        'pricelist',
+        'refers',
+    ]
+
+    # Serve detail, group and search reads from in-memory catalogue snapshot
+    CATALOGUE_SNAPSHOT: bool = False
+
+    # Cache shared by the workers. Empty path disables it.
+    # Caches of other catalogues are named after them, e.g. catalogue_cache.mahle.mmap
+    SHARED_CACHE_PATH: str = 'catalogue_cache.mmap'
+    SHARED_CACHE_SIZE: int = 64 * 1024 * 1024
+
+    # Watching of price and stock changes
+    WATCH_POLL_SECONDS: float = 2
+    WATCH_KEEPALIVE_SECONDS: float = 15
+    WATCH_MAX_PART_NUMBERS: int = 100
+    # Events a slow client may lag behind before its stream is closed
+    WATCH_QUEUE_SIZE: int = 100
+
+    # Server-Timing header with authentication, catalogue reads and serialization times
+    SERVER_TIMING: bool = False
+
+    # Profiles of requests made with X-Profile header
+    PROFILES_PATH: str = 'profiles'
+    PROFILES_KEEP: int = 50
+
+    # Search results cached by the worker per catalogue, in result rows. 0 disables the cache.
+    SEARCH_CACHE_ROWS: int = 200000
+
+    # Pricing. Catalogue prices are in BASE_CURRENCY, the others are converted by exchange rates.
+    BASE_CURRENCY: str = 'UAH'
+    CURRENCIES: list[str] = ['UAH', 'EUR', 'USD']
+    # Customer group of the users not assigned to any
+    DEFAULT_CUSTOMER_GROUP: str = 'default'
+    # Rates and markups set by other workers are applied within this time
+    PRICING_REFRESH_SECONDS: int = 10
+
+    # Catalogue queries of a request are interrupted this long after the request start. 0 disables the deadline.
+    QUERY_DEADLINE_SECONDS: float = 10
+    # Deadlines of particular routes, route name -> seconds
+    QUERY_DEADLINES: dict[str, float] = {
+        'search': 3,
+        'products_by_group': 5,
+        'export_price_list': 60,
+    }
+
+    # Products returned by a dimension search at most
+    DIMENSION_SEARCH_LIMIT: int = 1000
+
+    # Barcodes looked up at once
+    EAN_LOOKUP_MAX_ITEMS: int = 1000
+
+    # Lines of a basket quoted at once
+    QUOTE_MAX_LINES: int = 5000
+
+    # Logging. Records are written as JSON lines by a listener thread, the ones over the queue size are dropped.
+    LOG_LEVEL: str = 'INFO'
+    LOG_QUEUE_SIZE: int = 10000
+    # Records of the same message over the burst in the interval are dropped. 0 burst disables throttling.
+    LOG_THROTTLE_SECONDS: float = 10
+    LOG_THROTTLE_BURST: int = 5
+    # SQL of the catalogue queries
+    SQL_ECHO: bool = False
+
+    # API usage of users is counted per bucket and written to users database every USAGE_FLUSH_SECONDS
+    USAGE_BUCKET_SECONDS: int = 3600
+    USAGE_FLUSH_SECONDS: float = 30
+
     # Authentication
     AUTH_KEY: str = 'CHANGE-ME-EVENTUALY-8465cc4e15b7516d89b98f40836de34203848'
     AUTH_ALG: str = 'HS256'
     TOKEN_EXPIRE_HOURS: int = 6
+    # Revocations made by other workers are applied within this time
+    TOKEN_REVOCATION_REFRESH_SECONDS: int = 10
 
     class Config:
         env_file = '.env'
@@ -40,3 +122,11 @@ class ProdSettings(DevSettings):
 
 class ApiSettings(DevSettings):
     pass
+
+
+@lru_cache
+def get_settings() -> ApiSettings:
+    """
+    Settings instance shared by all the modules, so .env is parsed once.
+    """
+    return ApiSettings()
@@ -0,0 +1,271 @@
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from typing import Callable, Generator
+
+from settings import get_settings
+settings = get_settings()
+
+
+class SharedCache:
+    """
+    Serialized responses cache shared by all the workers of the host.
+
+    Lives in a memory-mapped file, so every worker maps the same pages instead of
+    keeping its own copy. Readers take no locks: the header carries a seqlock
+    counter, and a read that overlapped a write is treated as a miss.
+    Only one writer at a time: threads of the worker are excluded by a lock of the instance,
+    since the file lock is held per open file and doesn't exclude them. Other writers skip storing
+    while the locks are held.
+
+    Layout: header | index of 4-way buckets | ring buffer of records.
+    Records are addressed by logical offsets that only grow, so a record is alive while
+    it stays inside the last `data_size` bytes written. Older ones are evicted by the
+    ring overwriting them. The whole cache is dropped when catalogue version changes,
+    unless the changed keys are known and carried over.
+    """
+
+    MAGIC = b'BPSC'
+    LAYOUT = 1
+    # magic, layout, catalogue version, seqlock counter, logical write head
+    HEADER = struct.Struct('<4sIqQQ')
+    HEADER_SIZE = 64
+    # key hash, logical offset, record length
+    SLOT = struct.Struct('<QQQ')
+    WAYS = 4
+    # key length, value length
+    RECORD = struct.Struct('<II')
+
+    def __init__(self, path: str | os.PathLike, size: int, buckets: int | None = None):
+        self.path = path
+        self.size = size
+        self.buckets = buckets or max(256, size // (self.WAYS * 4096))
+        self.index_size = self.buckets * self.WAYS * self.SLOT.size
+        self.data_offset = self.HEADER_SIZE + self.index_size
+        self.data_size = size - self.data_offset
+        assert self.data_size > 0, 'Shared cache size is too small.'
+        self._fd: int | None = None
+        self._map: mmap.mmap | None = None
+        self._lock = threading.Lock()
+        self._map_lock = threading.Lock()
+
+    def get(self, key: str, version: int) -> bytes | None:
+        """
+        Cached value or None. Never blocks on the writer.
+        :param key: cache key
+        :param version: catalogue version the value must belong to
+        :return: value bytes or None
+        """
+        buf = self._mapping()
+        key_bytes = key.encode()
+        key_hash = self._hash(key_bytes)
+
+        magic, _, cache_version, seq_before, head = self.HEADER.unpack_from(buf, 0)
+        if seq_before % 2 or cache_version != version:
+            return None
+
+        for slot_offset in self._bucket(key_hash):
+            slot_hash, offset, length = self.SLOT.unpack_from(buf, slot_offset)
+            if slot_hash != key_hash or not self._alive(offset, length, head):
+                continue
+            position = self.data_offset + offset % self.data_size
+            key_length, value_length = self.RECORD.unpack_from(buf, position)
+            if key_length + value_length + self.RECORD.size != length:
+                continue
+            key_start = position + self.RECORD.size
+            value_start = key_start + key_length
+            if buf[key_start:value_start] != key_bytes:
+                continue
+            value = buf[value_start:value_start + value_length]
+            seq_after = self.HEADER.unpack_from(buf, 0)[3]
+            return value if seq_after == seq_before else None
+
+        return None
+
+    def set(self, key: str, value: bytes, version: int) -> bool:
+        """
+        Store value unless another process is writing right now.
+        :param key: cache key
+        :param value: serialized value
+        :param version: catalogue version of the value
+        :return: whether value was stored
+        """
+        key_bytes = key.encode()
+        length = self.RECORD.size + len(key_bytes) + len(value)
+        if length > self.data_size:
+            return False
+
+        buf = self._mapping()
+        with self._write_lock(blocking=False) as acquired:
+            if not acquired:
+                return False
+            magic, layout, cache_version, seq, head = self.HEADER.unpack_from(buf, 0)
+            self._write_header(buf, cache_version, seq + 1, head)
+
+            if cache_version != version:
+                buf[self.HEADER_SIZE:self.data_offset] = bytes(self.index_size)
+                cache_version, head = version, 0
+
+            # Records never wrap around the end of the ring
+            if head % self.data_size + length > self.data_size:
+                head += self.data_size - head % self.data_size
+            position = self.data_offset + head % self.data_size
+            self.RECORD.pack_into(buf, position, len(key_bytes), len(value))
+            key_start = position + self.RECORD.size
+            buf[key_start:key_start + len(key_bytes)] = key_bytes
+            value_start = key_start + len(key_bytes)
+            buf[value_start:value_start + len(value)] = value
+
+            key_hash = self._hash(key_bytes)
+            self.SLOT.pack_into(buf, self._victim(buf, key_hash, head), key_hash, head, length)
+            self._write_header(buf, cache_version, seq + 2, head + length)
+        return True
+
+    def clear(self) -> None:
+        buf = self._mapping()
+        with self._write_lock(blocking=True):
+            seq = self.HEADER.unpack_from(buf, 0)[3]
+            self._write_header(buf, -1, seq + 1, 0)
+            buf[self.HEADER_SIZE:self.data_offset] = bytes(self.index_size)
+            self._write_header(buf, -1, seq + 2, 0)
+
+    @property
+    def version(self) -> int:
+        return self.HEADER.unpack_from(self._mapping(), 0)[2]
+
+    def carry_over(self, old_version: int, new_version: int, stale_keys: list[str]) -> bool:
+        """
+        Move the cache to the new catalogue version dropping only the stale keys.
+        :param old_version: catalogue version the cache must have now
+        :param new_version: catalogue version to move to
+        :param stale_keys: keys changed between the versions
+        :return: whether the cache was moved
+        """
+        buf = self._mapping()
+        with self._write_lock(blocking=True):
+            magic, layout, cache_version, seq, head = self.HEADER.unpack_from(buf, 0)
+            if cache_version != old_version:
+                return False
+            self._write_header(buf, cache_version, seq + 1, head)
+            for key in stale_keys:
+                key_hash = self._hash(key.encode())
+                for slot_offset in self._bucket(key_hash):
+                    if self.SLOT.unpack_from(buf, slot_offset)[0] == key_hash:
+                        self.SLOT.pack_into(buf, slot_offset, 0, 0, 0)
+            self._write_header(buf, new_version, seq + 2, head)
+        return True
+
+    def get_or_set(self, key: str, version: int, build: Callable[[], bytes]) -> bytes:
+        if (value := self.get(key, version)) is None:
+            value = build()
+            self.set(key, value, version)
+        return value
+
+    def close(self) -> None:
+        with self._map_lock:
+            if self._map is not None:
+                self._map.close()
+                os.close(self._fd)
+                self._map = self._fd = None
+
+    def _alive(self, offset: int, length: int, head: int) -> bool:
+        return head - self.data_size <= offset \
+            and offset + length <= head \
+            and offset % self.data_size + length <= self.data_size
+
+    def _bucket(self, key_hash: int) -> range:
+        first = self.HEADER_SIZE + (key_hash % self.buckets) * self.WAYS * self.SLOT.size
+        return range(first, first + self.WAYS * self.SLOT.size, self.SLOT.size)
+
+    def _victim(self, buf: mmap.mmap, key_hash: int, head: int) -> int:
+        """
+        Slot for the new record: the one with the same key, an empty or evicted one,
+        otherwise the oldest one in the bucket.
+        """
+        oldest, oldest_offset = None, None
+        for slot_offset in self._bucket(key_hash):
+            slot_hash, offset, length = self.SLOT.unpack_from(buf, slot_offset)
+            if slot_hash in (0, key_hash) or not self._alive(offset, length, head):
+                return slot_offset
+            if oldest is None or offset < oldest_offset:
+                oldest, oldest_offset = slot_offset, offset
+        return oldest
+
+    def _write_header(self, buf: mmap.mmap, version: int, seq: int, head: int) -> None:
+        self.HEADER.pack_into(buf, 0, self.MAGIC, self.LAYOUT, version, seq, head)
+
+    @staticmethod
+    def _hash(key_bytes: bytes) -> int:
+        # Builtin hash() is salted per process, so it can't be shared between workers
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little') or 1
+
+    def _mapping(self) -> mmap.mmap:
+        if self._map is None:
+            with self._map_lock:
+                if self._map is None:
+                    self._map = self._open()
+        return self._map
+
+    def _open(self) -> mmap.mmap:
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._write_lock(blocking=True):
+            if os.fstat(self._fd).st_size != self.size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+            buf = mmap.mmap(self._fd, self.size)
+            magic, layout = self.HEADER.unpack_from(buf, 0)[:2]
+            if (magic, layout) != (self.MAGIC, self.LAYOUT):
+                buf[:self.data_offset] = bytes(self.data_offset)
+                self._write_header(buf, -1, 0, 0)
+        return buf
+
+    @contextlib.contextmanager
+    def _write_lock(self, blocking: bool) -> Generator[bool, None, None]:
+        if not self._lock.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(self._fd, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+
+def cache_path(catalogue: str) -> str:
+    if catalogue == settings.DEFAULT_CATALOGUE:
+        return settings.SHARED_CACHE_PATH
+    root, ext = os.path.splitext(settings.SHARED_CACHE_PATH)
+    return f'{root}.{catalogue}{ext}'
+
+
+# Catalogue name -> its cache
+shared_caches: dict[str, SharedCache] = {}
+_shared_caches_lock = threading.Lock()
+
+
+def get_shared_cache(catalogue: str) -> SharedCache | None:
+    """
+    Cache of the catalogue, opened on first use. None if caching is disabled.
+    """
+    if not settings.SHARED_CACHE_PATH:
+        return None
+    if (cache := shared_caches.get(catalogue)) is None:
+        with _shared_caches_lock:
+            if (cache := shared_caches.get(catalogue)) is None:
+                cache = shared_caches[catalogue] = SharedCache(
+                    path=cache_path(catalogue),
+                    size=settings.SHARED_CACHE_SIZE,
+                )
+    return cache
@@ -0,0 +1,93 @@
+import functools
+import threading
+from typing import Any, Callable, Hashable, TypeVar
+
+from sqlalchemy.orm import Session
+
+T = TypeVar('T')
+
+
+class Flight:
+    """
+    Call in progress, awaited by the callers that joined it.
+    """
+    __slots__ = ('done', 'result', 'failed')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.failed = False
+
+
+class SingleFlight:
+    """
+    Concurrent calls of the same key share a single execution and its result.
+    A caller arriving while the call of its key is in progress waits for it instead of making its own.
+    Failures aren't shared: the callers that joined a failed call make it themselves,
+    since the failure may be of the first caller only, e.g. its query was interrupted by its deadline.
+    Results are shared as they are, so they must not be mutated by the callers.
+    """
+
+    def __init__(self):
+        self.flights: dict[Hashable, Flight] = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, call: Callable[[], T]) -> T:
+        with self.lock:
+            if (flight := self.flights.get(key)) is None:
+                flight = self.flights[key] = Flight()
+                self.calls += 1
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            flight.done.wait()
+            if not flight.failed:
+                self.coalesced += 1
+                return flight.result
+            return call()
+
+        try:
+            flight.result = call()
+            return flight.result
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+flights = SingleFlight()
+
+
+def frozen(value: Any) -> Hashable:
+    """
+    Hashable equivalent of the argument, lists as tuples and dicts and sets as frozensets.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(frozen(item) for item in value)
+    if isinstance(value, dict):
+        return frozenset((key, frozen(item)) for key, item in value.items())
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def coalesced(function: Callable[..., T]) -> Callable[..., T]:
+    """
+    Concurrent calls of the crud function with the same arguments against the same database share one query.
+    Only for functions returning rows, which may be shared between sessions, not ORM instances.
+    """
+    @functools.wraps(function)
+    def wrapper(db: Session, *args, **kwargs) -> T:
+        key = (function.__qualname__, db.get_bind(), frozen(args), frozen(kwargs))
+        return flights.do(key, lambda: function(db, *args, **kwargs))
+
+    return wrapper
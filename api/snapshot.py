@@ -0,0 +1,342 @@
+import logging
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import database
+from models import fixed_point_price
+
+logger = logging.getLogger(__name__)
+
+# Bits of the flags column
+DISCONTINUED = 1
+NEW_RELEASE = 2
+TRUCK = 4
+HAS_PRODUCT = 8
+HAS_MASTERDATA = 16
+
+
+class StringTable:
+    """
+    Interned strings. Columns store their indexes.
+    """
+
+    def __init__(self):
+        self.strings: list[str] = []
+        self._indexes: dict[str, int] = {}
+
+    def add(self, string: str) -> int:
+        if (index := self._indexes.get(string)) is None:
+            index = self._indexes[string] = len(self.strings)
+            self.strings.append(sys.intern(string))
+        return index
+
+    def __getitem__(self, index: int) -> str:
+        return self.strings[index]
+
+    def freeze(self) -> None:
+        # Lookup dict is only needed while loading
+        self._indexes = {}
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.strings) + sum(sys.getsizeof(s) for s in self.strings)
+
+
+class CatalogueSnapshot:
+    """
+    Read-only catalogue of one version in compact columns.
+
+    A row per partnum entry, rows are sorted by part number. Part numbers are joined
+    into a single bytes blob, so wildcard search is one regex pass over it.
+    Pricelist and masterdata columns are aligned with the rows, strings are interned,
+    prices are fixed-point integers. Refers and group contents are offset arrays.
+    Part number lookup goes through an open addressing hash index of row numbers.
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.strings = StringTable()
+        self.groups: dict[int, str] = {}
+
+        self.part_numbers = b''
+        self.part_no_offsets = array('I')
+        self.flags = bytearray()
+        self.hash_index = array('i')
+
+        self.title_ua = array('I')
+        self.title_en = array('I')
+        self.uktzed = array('q')
+        self.min_order = array('i')
+        self.quantity = array('i')
+        self.price = array('q')
+        self.group_id = array('I')
+
+        self.ean = array('q')
+        self.gross = array('I')
+        self.net = array('I')
+        self.weight_unit = array('I')
+        self.length = array('i')
+        self.width = array('i')
+        self.height = array('i')
+        self.measure_unit = array('I')
+        self.volume = array('I')
+        self.volume_unit = array('I')
+
+        self.refers_offsets = array('I')
+        self.refers = array('I')
+        self.group_offsets: dict[int, tuple[int, int]] = {}
+        self.group_rows = array('I')
+
+    @classmethod
+    def load(cls, db: Session) -> 'CatalogueSnapshot':
+        started = time.perf_counter()
+        snapshot = cls(database.get_catalogue_version(db))
+        snapshot._load(db)
+        snapshot.strings.freeze()
+        logger.info(f'Catalogue snapshot of version {snapshot.version} is loaded '
+                    f'in {time.perf_counter() - started:.3f} s: {len(snapshot)} rows, '
+                    f'{snapshot.nbytes()} bytes, {snapshot.nbytes() / max(len(snapshot), 1):.1f} bytes per row')
+        return snapshot
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def nbytes(self) -> int:
+        """
+        Memory taken by the snapshot data.
+        """
+        arrays = [value for value in vars(self).values() if isinstance(value, array)]
+        return sum(a.itemsize * len(a) for a in arrays) \
+            + len(self.part_numbers) + len(self.flags) \
+            + self.strings.nbytes() \
+            + sum(sys.getsizeof(title) for title in self.groups.values())
+
+    def part_no(self, row: int) -> str:
+        return self.part_numbers[self.part_no_offsets[row]:self.part_no_offsets[row + 1] - 1].decode()
+
+    def find(self, part_no: str) -> int | None:
+        encoded = part_no.encode()
+        mask = len(self.hash_index) - 1
+        slot = hash(encoded) & mask
+        while (row := self.hash_index[slot]) != -1:
+            start = self.part_no_offsets[row]
+            if self.part_numbers[start:self.part_no_offsets[row + 1] - 1] == encoded:
+                return row
+            slot = (slot + 1) & mask
+        return None
+
+    def get_partnum(self, part_no: str) -> dict | None:
+        """
+        Same shape as crud.get_partnum result for schemas.PartNumber.
+        """
+        if (row := self.find(part_no)) is None:
+            return None
+        flags = self.flags[row]
+        return {
+            'part_no': part_no,
+            'discontinued': bool(flags & DISCONTINUED),
+            'new_release': bool(flags & NEW_RELEASE),
+            'product': self._product(row) if flags & HAS_PRODUCT else None,
+            'masterdata': self._masterdata(row) if flags & HAS_MASTERDATA else None,
+            'refers': [
+                {'part_no': self.part_no(successor)}
+                for successor in self.refers[self.refers_offsets[row]:self.refers_offsets[row + 1]]
+            ],
+        }
+
+    def get_products_by_group(self, group_id: int) -> list[dict]:
+        start, stop = self.group_offsets.get(group_id, (0, 0))
+        return [
+            {'part_no': self.part_no(row), 'title_en': self.strings[self.title_en[row]]}
+            for row in self.group_rows[start:stop]
+        ]
+
+    def get_expanded_products_by_group(self, group_id: int, expand: frozenset[str]) -> list[tuple]:
+        """
+        Rows shaped like the ones of crud.get_expanded_products_by_group.
+        """
+        start, stop = self.group_offsets.get(group_id, (0, 0))
+        return [self._expanded(row, expand) for row in self.group_rows[start:stop]]
+
+    def search_expanded_products(self, query: str, expand: frozenset[str]) -> list[tuple]:
+        """
+        Rows shaped like the ones of crud.search_expanded_products.
+        """
+        return [self._expanded(self.find(listed['part_no']), expand) for listed in self.search_products(query)]
+
+    def _expanded(self, row: int, expand: frozenset[str]) -> tuple:
+        flags = self.flags[row]
+        values = [self.part_no(row), self.strings[self.title_en[row]] if flags & HAS_PRODUCT else None]
+        # Same order as crud.EXPANSION_COLUMNS
+        if 'price' in expand:
+            values.append(self.price[row] if flags & HAS_PRODUCT else None)
+        if 'stock' in expand:
+            values.append(self.quantity[row] if flags & HAS_PRODUCT else None)
+        if 'masterdata' in expand:
+            values.extend(self._masterdata(row).values() if flags & HAS_MASTERDATA else (None, ) * 10)
+        return tuple(values)
+
+    def get_quote_rows(self, part_numbers: list[str]) -> list[tuple]:
+        """
+        Rows shaped like the ones of crud.get_quote_rows.
+        """
+        rows = []
+        for part_no in part_numbers:
+            if (row := self.find(part_no)) is None:
+                continue
+            flags = self.flags[row]
+            values = (part_no, bool(flags & DISCONTINUED),
+                      *((self.min_order[row], self.quantity[row], self.price[row]) if flags & HAS_PRODUCT
+                        else (None, None, None)))
+            successors = self.refers[self.refers_offsets[row]:self.refers_offsets[row + 1]] \
+                if flags & DISCONTINUED else ()
+            if not successors:
+                rows.append((*values, None, None, None))
+            for successor in successors:
+                successor_flags = self.flags[successor]
+                rows.append((*values, self.part_no(successor), bool(successor_flags & DISCONTINUED),
+                             self.quantity[successor] if successor_flags & HAS_PRODUCT else None))
+        return rows
+
+    def search_products(self, query: str) -> list[dict]:
+        """
+        Part numbers matching LIKE pattern with '_' wildcards.
+        """
+        pattern = ''.join('.' if char == '_' else re.escape(char) for char in query)
+        results = []
+        for match in re.finditer(f'^{pattern}$'.encode(), self.part_numbers, re.MULTILINE | re.IGNORECASE):
+            row = bisect_right(self.part_no_offsets, match.start()) - 1
+            title = self.strings[self.title_en[row]] if self.flags[row] & HAS_PRODUCT else None
+            results.append({'part_no': match.group().decode(), 'title_en': title})
+        return results
+
+    def _product(self, row: int) -> dict:
+        group_id = self.group_id[row]
+        return {
+            'title_ua': self.strings[self.title_ua[row]],
+            'title_en': self.strings[self.title_en[row]],
+            'uktzed': self.uktzed[row],
+            'min_order': self.min_order[row],
+            'quantity': self.quantity[row],
+            'price': self.price[row],
+            'truck': bool(self.flags[row] & TRUCK),
+            'group': {'id': group_id, 'title': self.groups.get(group_id)},
+        }
+
+    def _masterdata(self, row: int) -> dict:
+        return {
+            'ean': self.ean[row],
+            'gross': self.strings[self.gross[row]],
+            'net': self.strings[self.net[row]],
+            'weight_unit': self.strings[self.weight_unit[row]],
+            'length': self.length[row],
+            'width': self.width[row],
+            'height': self.height[row],
+            'measure_unit': self.strings[self.measure_unit[row]],
+            'volume': self.strings[self.volume[row]],
+            'volume_unit': self.strings[self.volume_unit[row]],
+        }
+
+    def _load(self, db: Session) -> None:
+        conn = db.connection()
+        self.groups = dict(conn.execute(text('SELECT rowid, title FROM subsub')).all())
+
+        partnums = conn.execute(text(
+            'SELECT rowid, part_no, discontinued, new_release FROM partnum ORDER BY part_no'
+        )).all()
+        rows = {rowid: row for row, (rowid, *_) in enumerate(partnums)}
+        count = len(partnums)
+
+        self.part_numbers = b''.join(part_no.encode() + b'\n' for _, part_no, _, _ in partnums)
+        offset = 0
+        for _, part_no, discontinued, new_release in partnums:
+            self.part_no_offsets.append(offset)
+            offset += len(part_no.encode()) + 1
+            self.flags.append(DISCONTINUED * bool(discontinued) | NEW_RELEASE * bool(new_release))
+        self.part_no_offsets.append(offset)
+
+        self.hash_index = array('i', [-1]) * (1 << (2 * count).bit_length())
+        mask = len(self.hash_index) - 1
+        for row, (_, part_no, _, _) in enumerate(partnums):
+            slot = hash(part_no.encode()) & mask
+            while self.hash_index[slot] != -1:
+                slot = (slot + 1) & mask
+            self.hash_index[slot] = row
+
+        for column, typecode in (('title_ua', 'I'), ('title_en', 'I'), ('uktzed', 'q'), ('min_order', 'i'),
+                                 ('quantity', 'i'), ('price', 'q'), ('group_id', 'I'), ('ean', 'q'),
+                                 ('gross', 'I'), ('net', 'I'), ('weight_unit', 'I'), ('length', 'i'),
+                                 ('width', 'i'), ('height', 'i'), ('measure_unit', 'I'), ('volume', 'I'),
+                                 ('volume_unit', 'I')):
+            setattr(self, column, array(typecode, [0]) * count)
+
+        group_members: dict[int, list[int]] = {}
+        for title_ua, title_en, uktzed, min_order, quantity, price, truck, partnum_id, subsub_id \
+                in conn.execute(text('SELECT title_ua, title_en, uktzed, min_order, quantity, price, truck, '
+                                     'partnum_id, subsub_id FROM pricelist ORDER BY rowid')):
+            if (row := rows.get(partnum_id)) is None:
+                continue
+            self.title_ua[row] = self.strings.add(title_ua)
+            self.title_en[row] = self.strings.add(title_en)
+            self.uktzed[row] = uktzed
+            self.min_order[row] = min_order
+            self.quantity[row] = quantity
+            self.price[row] = fixed_point_price(price)
+            self.group_id[row] = subsub_id
+            self.flags[row] |= HAS_PRODUCT | TRUCK * bool(truck)
+            group_members.setdefault(subsub_id, []).append(row)
+
+        for group_id, members in group_members.items():
+            self.group_offsets[group_id] = (len(self.group_rows), len(self.group_rows) + len(members))
+            self.group_rows.extend(members)
+
+        for ean, gross, net, weight_unit, length, width, height, measure_unit, volume, volume_unit, partnum_id \
+                in conn.execute(text('SELECT ean, gross, net, weight_unit, length, width, height, measure_unit, '
+                                     'volume, volume_unit, partnum_id FROM masterdata ORDER BY rowid')):
+            if (row := rows.get(partnum_id)) is None:
+                continue
+            self.ean[row] = ean
+            self.gross[row] = self.strings.add(gross)
+            self.net[row] = self.strings.add(net)
+            self.weight_unit[row] = self.strings.add(weight_unit)
+            self.length[row] = length
+            self.width[row] = width
+            self.height[row] = height
+            self.measure_unit[row] = self.strings.add(measure_unit)
+            self.volume[row] = self.strings.add(volume)
+            self.volume_unit[row] = self.strings.add(volume_unit)
+            self.flags[row] |= HAS_MASTERDATA
+
+        successors: list[list[int]] = [[] for _ in range(count)]
+        for predecessor, successor in conn.execute(text(
+                'SELECT predecessor, successor FROM refers ORDER BY predecessor, successor')):
+            if predecessor in rows and successor in rows:
+                successors[rows[predecessor]].append(rows[successor])
+        for row_successors in successors:
+            self.refers_offsets.append(len(self.refers))
+            self.refers.extend(row_successors)
+        self.refers_offsets.append(len(self.refers))
+
+
+# Catalogue name -> its snapshot
+_snapshots: dict[str, CatalogueSnapshot] = {}
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(db: Session) -> CatalogueSnapshot:
+    """
+    Snapshot of the current version of session's catalogue. Reloaded once the version changes.
+    """
+    name = database.get_catalogue(db).name
+    version = database.get_catalogue_version(db)
+    if (snapshot := _snapshots.get(name)) is None or snapshot.version != version:
+        with _snapshot_lock:
+            if (snapshot := _snapshots.get(name)) is None or snapshot.version != version:
+                snapshot = _snapshots[name] = CatalogueSnapshot.load(db)
+    return snapshot
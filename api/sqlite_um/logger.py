@@ -1,9 +1,4 @@
 import logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    datefmt='%Y/%m/%d %H:%M:%S',
-    format='%(asctime)s %(levelname)s: %(message)s',
-)
-
+# Records are written by the handlers of the application, see logs.setup_logging
 logger = logging.getLogger(__name__)
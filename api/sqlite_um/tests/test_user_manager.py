@@ -1,6 +1,7 @@
 import pytest
 import sqlite3
 import os
+import time
 from ..user_manager import SQLiteUserManager, UserAlreadyExists, UserDoesNotExist
 
 
@@ -129,3 +130,60 @@ def test_get_user_list(setted_up_db):
         {'username': 'example_user2'},
         {'username': 'example_user3'},
     ]
+
+
+def test_migration_adds_unique_index(given_db):
+    with given_db._db_connection() as db:
+        db.execute('CREATE TABLE IF NOT EXISTS users (username TEXT, password TEXT, scopes TEXT, su INT)')
+        db.executemany('INSERT INTO users VALUES (?, ?, ?, 0)', [('twin', 'first', ''), ('twin', 'second', '')])
+        db.commit()
+
+    given_db._initial_setup()
+
+    assert given_db.get_user_dict('twin')['password'] == 'first'
+    with given_db._db_connection() as db:
+        assert db.execute('PRAGMA user_version').fetchone()[0] == SQLiteUserManager.SCHEMA_VERSION
+        with pytest.raises(sqlite3.IntegrityError):
+            db.execute("INSERT INTO users VALUES ('twin', 'third', '', 0)")
+
+
+def test_add_users(setted_up_db):
+    setted_up_db.add_users([
+        {'username': f'batch_user{i}', 'password': 'password', 'scopes': ['scope1']} for i in range(3)
+    ])
+    assert setted_up_db.get_all_users() == [{'username': f'batch_user{i}'} for i in range(3)]
+
+
+@pytest.mark.parametrize(
+    'usernames',
+    [
+        ['batch_user', EXAMPLE_USER['username']],
+        ['batch_user', 'batch_user'],
+    ]
+)
+def test_add_users_already_existed(setted_up_db, usernames):
+    setted_up_db.add_user(**EXAMPLE_USER)
+    with pytest.raises(UserAlreadyExists):
+        setted_up_db.add_users([{'username': username, 'password': 'password'} for username in usernames])
+    assert 'batch_user' not in setted_up_db
+
+
+def test_delete_users(setted_up_db):
+    setted_up_db.add_user(**EXAMPLE_USER)
+    setted_up_db.add_user(username='su', password='password', su=True)
+    assert setted_up_db.delete_users([EXAMPLE_USER['username'], 'su', 'not_existed_username']) == 1
+    assert EXAMPLE_USER['username'] not in setted_up_db
+    assert 'su' in setted_up_db
+
+
+def test_revocations(setted_up_db):
+    now = int(time.time())
+    setted_up_db.revoke_token('expired', now - 1)
+    setted_up_db.revoke_token('jti', now + 60)
+    setted_up_db.revoke_user_tokens(EXAMPLE_USER['username'], issued_before=now, expires=now + 60)
+    assert setted_up_db.get_revocations(now) == (
+        {'jti': now + 60},
+        {EXAMPLE_USER['username']: (now, now + 60)},
+    )
+    with setted_up_db._db_connection() as db:
+        assert db.execute('SELECT jti FROM revoked_tokens').fetchall() == [('jti', )]
@@ -1,6 +1,7 @@
 import contextlib
 import os
 import sqlite3
+import time
 from typing import Generator
 
 from sqlite_um.logger import logger
@@ -28,6 +29,9 @@ class SQLiteUserManager:
     Superuser cannot be listed through api.
     """
 
+    # Version of the database layout stored in PRAGMA user_version
+    SCHEMA_VERSION = 4
+
     def __init__(
         self,
         database_path: str | bytes | os.PathLike = 'users.sqlite',
@@ -39,17 +43,17 @@ class SQLiteUserManager:
 
     def __contains__(self, username: str) -> bool:
         with self._db_connection() as db:
-            user_count = db.execute(
-                f'SELECT COUNT(*) FROM {self.table_name} WHERE username=?;',
+            exists = db.execute(
+                f'SELECT EXISTS(SELECT 1 FROM {self.table_name} WHERE username=?);',
                 (username, )
             ).fetchone()[0]
-        assert user_count in (0, 1), 'Whoa, something crazy with the database!'
-        return bool(user_count)
+        return bool(exists)
 
     def __getitem__(self, username: str):
-        if username not in self:
-            raise KeyError()
-        return self.get_user_dict(username)
+        try:
+            return self.get_user_dict(username)
+        except UserDoesNotExist:
+            raise KeyError(username)
 
     def add_user(
         self,
@@ -66,26 +70,58 @@ class SQLiteUserManager:
         :param su: add superuser. Should not be available through api.
         :return: None
         """
-        if username in self:
-            raise UserAlreadyExists('This username is already used.')
-        scopes_str = ','.join(scopes) if scopes else ''
         data_to_insert = {
             'username': username,
             'password': password,
-            'scopes': scopes_str,
+            'scopes': ','.join(scopes) if scopes else '',
             'su': su,
         }
         with self._db_connection() as db:
             with db:
-                db.execute(f"""
-                    INSERT INTO {self.table_name} 
-                    VALUES (:username, :password, :scopes, :su);
-                """, data_to_insert)
+                # Check and insert in one statement, so concurrent requests can't both pass the check
+                inserted = db.execute(f"""
+                    INSERT INTO {self.table_name}
+                    SELECT :username, :password, :scopes, :su
+                    WHERE NOT EXISTS (SELECT 1 FROM {self.table_name} WHERE username = :username);
+                """, data_to_insert).rowcount
+        if not inserted:
+            raise UserAlreadyExists('This username is already used.')
 
-        assert username in self, 'The user was NOT created'
         spr = 'super' if su else ''
         logger.info(f'The {spr}user \'{username}\' has been created.')
 
+    def add_users(self, users: list[dict]) -> None:
+        """
+        Add new users in a single transaction. None is added if any username is used.
+        :param users: list of add_user kwargs dicts. Superusers are not accepted.
+        :return: None
+        """
+        data_to_insert = [{
+            'username': user['username'],
+            'password': user['password'],
+            'scopes': ','.join(user['scopes']) if user.get('scopes') else '',
+        } for user in users]
+        usernames = [user['username'] for user in data_to_insert]
+
+        with self._db_connection() as db:
+            with db:
+                db.execute('BEGIN IMMEDIATE;')
+                used = {username for username in usernames if usernames.count(username) > 1}
+                for chunk_start in range(0, len(usernames), 500):
+                    chunk = usernames[chunk_start:chunk_start + 500]
+                    used.update(username for username, in db.execute(f"""
+                        SELECT username FROM {self.table_name}
+                        WHERE username IN ({','.join('?' * len(chunk))});
+                    """, chunk))
+                if used:
+                    raise UserAlreadyExists(f'These usernames are already used: {", ".join(sorted(used))}.')
+                db.executemany(f"""
+                    INSERT INTO {self.table_name}
+                    VALUES (:username, :password, :scopes, 0);
+                """, data_to_insert)
+
+        logger.info(f'{len(usernames)} users have been created.')
+
     def delete_user(self, username: str) -> None:
         with self._db_connection() as db:
             with db:
@@ -93,9 +129,23 @@ class SQLiteUserManager:
                     DELETE FROM {self.table_name}
                     WHERE username = ? AND su != 1;
                 """, (username, ))
-        assert username not in self, 'The has-been-deleted user is still in db'
         logger.info(f'The user \'{username}\' has been deleted')
 
+    def delete_users(self, usernames: list[str]) -> int:
+        """
+        Delete users in a single transaction. Superusers are kept.
+        :param usernames: list of usernames
+        :return: number of deleted users
+        """
+        with self._db_connection() as db:
+            with db:
+                deleted = db.executemany(f"""
+                    DELETE FROM {self.table_name}
+                    WHERE username = ? AND su != 1;
+                """, [(username, ) for username in usernames]).rowcount
+        logger.info(f'{deleted} users have been deleted')
+        return deleted
+
     def get_user_dict(self, username: str) -> dict[str, str | list[str]] | None:
         with self._db_connection() as db:
             values = db.execute(f"""
@@ -121,6 +171,134 @@ class SQLiteUserManager:
 
         return [{'username': username} for username, in fetch_users]
 
+    def get_usernames(self) -> set[str]:
+        with self._db_connection() as db:
+            return {username for username, in db.execute(f'SELECT username FROM {self.table_name};')}
+
+    def revoke_token(self, jti: str, expires: int) -> None:
+        """
+        Revoke a single token. Revocations which have expired are pruned meanwhile.
+        :param jti: token id
+        :param expires: token expiration timestamp, the revocation is kept until then
+        :return: None
+        """
+        with self._db_connection() as db:
+            with db:
+                db.execute('INSERT OR REPLACE INTO revoked_tokens VALUES (?, ?);', (jti, expires))
+                self._prune_revocations(db)
+        logger.info(f'The token \'{jti}\' has been revoked')
+
+    def revoke_user_tokens(self, username: str, issued_before: float, expires: int) -> None:
+        """
+        Revoke all the tokens of the user issued up to the moment.
+        :param username: username
+        :param issued_before: tokens issued at this timestamp or earlier are revoked
+        :param expires: expiration timestamp of the latest revoked token
+        :return: None
+        """
+        with self._db_connection() as db:
+            with db:
+                db.execute('INSERT OR REPLACE INTO revoked_users VALUES (?, ?, ?);', (username, issued_before, expires))
+                self._prune_revocations(db)
+        logger.info(f'Tokens of the user \'{username}\' have been revoked')
+
+    def get_revocations(self, now: int) -> tuple[dict[str, int], dict[str, tuple[float, int]]]:
+        """
+        Revocations which haven't expired yet.
+        :param now: current timestamp
+        :return: jti -> expires, username -> (issued_before, expires)
+        """
+        with self._db_connection() as db:
+            tokens = dict(db.execute('SELECT jti, expires FROM revoked_tokens WHERE expires > ?;', (now, )))
+            users = {username: (issued_before, expires) for username, issued_before, expires in db.execute(
+                'SELECT username, issued_before, expires FROM revoked_users WHERE expires > ?;', (now, )
+            )}
+        return tokens, users
+
+    def set_exchange_rates(self, rates: dict[str, int]) -> None:
+        """
+        Add or replace exchange rates.
+        :param rates: currency -> fixed-point rate, base currency units per currency unit
+        :return: None
+        """
+        with self._db_connection() as db:
+            with db:
+                db.executemany('INSERT OR REPLACE INTO exchange_rates VALUES (?, ?);', rates.items())
+        logger.info(f'Exchange rates of {", ".join(rates)} have been set')
+
+    def set_markups(self, markups: dict[str, int]) -> None:
+        """
+        Add or replace markups of customer groups.
+        :param markups: customer group -> markup in basis points
+        :return: None
+        """
+        with self._db_connection() as db:
+            with db:
+                db.executemany('INSERT OR REPLACE INTO markups VALUES (?, ?);', markups.items())
+        logger.info(f'Markups of {", ".join(markups)} have been set')
+
+    def set_customer_groups(self, customer_groups: dict[str, str | None]) -> None:
+        """
+        Assign users to customer groups.
+        :param customer_groups: username -> customer group, None to return the user to the default one
+        :return: None
+        """
+        with self._db_connection() as db:
+            with db:
+                db.executemany('DELETE FROM customer_groups WHERE username = ?;',
+                               [(username, ) for username in customer_groups])
+                db.executemany('INSERT INTO customer_groups VALUES (?, ?);',
+                               [(username, group) for username, group in customer_groups.items()
+                                if group is not None])
+        logger.info(f'Customer groups of {len(customer_groups)} users have been set')
+
+    def get_price_rules(self) -> tuple[dict[str, int], dict[str, int], dict[str, str]]:
+        """
+        :return: currency -> rate, customer group -> markup, username -> customer group
+        """
+        with self._db_connection() as db:
+            rates = dict(db.execute('SELECT currency, rate FROM exchange_rates;'))
+            markups = dict(db.execute('SELECT customer_group, markup FROM markups;'))
+            customer_groups = dict(db.execute('SELECT username, customer_group FROM customer_groups;'))
+        return rates, markups, customer_groups
+
+    def add_usage(self, usage: list[tuple[str, str, int, int, int]]) -> None:
+        """
+        Add counts to the usage of users, in one transaction.
+        :param usage: (username, route, bucket start timestamp, requests, bytes) tuples
+        :return: None
+        """
+        with self._db_connection() as db:
+            with db:
+                db.executemany("""
+                    INSERT INTO usage VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (username, route, bucket) DO UPDATE
+                    SET requests = requests + excluded.requests, bytes = bytes + excluded.bytes;
+                """, usage)
+
+    def get_usage(self, since: int, until: int, username: str | None = None,
+                  per_bucket: bool = False) -> list[tuple[str, str, int | None, int, int]]:
+        """
+        Usage of the buckets starting within [since, until), summed up per user and route.
+        :param username: usage of the user only if given
+        :param per_bucket: sum up per bucket too
+        :return: (username, route, bucket start timestamp or None, requests, bytes) tuples
+        """
+        bucket = 'bucket' if per_bucket else 'NULL'
+        with self._db_connection() as db:
+            return db.execute(f"""
+                SELECT username, route, {bucket}, SUM(requests), SUM(bytes) FROM usage
+                WHERE bucket >= ? AND bucket < ? AND (? IS NULL OR username = ?)
+                GROUP BY username, route, {bucket}
+                ORDER BY username, route, {bucket};
+            """, (since, until, username, username)).fetchall()
+
+    @staticmethod
+    def _prune_revocations(db: sqlite3.Connection) -> None:
+        now = int(time.time())
+        db.execute('DELETE FROM revoked_tokens WHERE expires <= ?;', (now, ))
+        db.execute('DELETE FROM revoked_users WHERE expires <= ?;', (now, ))
+
     def _initial_setup(self) -> None:
         expected_table_structure = [
             ('username', 'TEXT'),
@@ -142,8 +320,81 @@ class SQLiteUserManager:
             """, (self.table_name, )).fetchall()
 
             assert results == expected_table_structure, 'Table structure is not supported.'
+        self.migrate()
         logger.info('User database is set up')
 
+    def migrate(self) -> None:
+        """
+        Bring database layout up to SCHEMA_VERSION.
+        Version 1: unique index on username. Duplicated usernames are dropped, the first one is kept.
+        Version 2: tables of revoked tokens and users.
+        Version 3: tables of exchange rates, markups of customer groups and users of the groups.
+        Version 4: table of API usage of users.
+        """
+        with self._db_connection() as db:
+            with db:
+                db.execute('BEGIN IMMEDIATE;')
+                version = db.execute('PRAGMA user_version;').fetchone()[0]
+                if version < 1:
+                    duplicates = db.execute(f"""
+                        DELETE FROM {self.table_name}
+                        WHERE rowid NOT IN (SELECT MIN(rowid) FROM {self.table_name} GROUP BY username);
+                    """).rowcount
+                    if duplicates:
+                        logger.warning(f'{duplicates} duplicated users have been deleted')
+                    db.execute(f"""
+                        CREATE UNIQUE INDEX IF NOT EXISTS ix_{self.table_name}_username
+                        ON {self.table_name} (username);
+                    """)
+                if version < 2:
+                    db.execute("""
+                        CREATE TABLE IF NOT EXISTS revoked_tokens (
+                            jti TEXT PRIMARY KEY,
+                            expires INT
+                        );
+                    """)
+                    db.execute("""
+                        CREATE TABLE IF NOT EXISTS revoked_users (
+                            username TEXT PRIMARY KEY,
+                            issued_before REAL,
+                            expires INT
+                        );
+                    """)
+                if version < 3:
+                    db.execute("""
+                        CREATE TABLE IF NOT EXISTS exchange_rates (
+                            currency TEXT PRIMARY KEY,
+                            rate INT
+                        );
+                    """)
+                    db.execute("""
+                        CREATE TABLE IF NOT EXISTS markups (
+                            customer_group TEXT PRIMARY KEY,
+                            markup INT
+                        );
+                    """)
+                    db.execute("""
+                        CREATE TABLE IF NOT EXISTS customer_groups (
+                            username TEXT PRIMARY KEY,
+                            customer_group TEXT
+                        );
+                    """)
+                if version < 4:
+                    db.execute("""
+                        CREATE TABLE IF NOT EXISTS usage (
+                            username TEXT,
+                            route TEXT,
+                            bucket INT,
+                            requests INT,
+                            bytes INT,
+                            PRIMARY KEY (username, route, bucket)
+                        );
+                    """)
+                    db.execute('CREATE INDEX IF NOT EXISTS ix_usage_bucket ON usage (bucket);')
+                if version < self.SCHEMA_VERSION:
+                    db.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION};')
+                    logger.info(f'User database is migrated to version {self.SCHEMA_VERSION}')
+
     @contextlib.contextmanager
     def _db_connection(self) -> Generator[sqlite3.Connection, None, None]:
         conn = sqlite3.connect(self.database_path)
@@ -0,0 +1,54 @@
+import asyncio
+import json
+import sys
+sys.path.insert(0, './')
+
+from anyio import to_thread
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .. import importer, updater
+from ..broadcast import ChangeBroadcaster
+from .test_importer import price_row, write_price_file
+
+
+def event_data(event: bytes) -> tuple[str, list[dict]]:
+    name, data = event.decode().strip().split('\n')
+    return name.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+
+def test_broadcast(tmp_path):
+    price_path = tmp_path / 'price.xlsx'
+    database_path = tmp_path / 'bp.sqlite'
+    write_price_file(price_path, rows=[price_row(i) for i in range(1, 5)])
+    importer.build_catalogue(price_path, database_path)
+    engine = create_engine(f'sqlite:///{database_path}')
+
+    async def watch():
+        broadcaster = ChangeBroadcaster(sessionmaker(bind=engine), poll_seconds=0.01, queue_size=10)
+        watcher = broadcaster.subscribe(frozenset({'0445000001', '0445000002', '0445999999'}))
+        other = broadcaster.subscribe(frozenset({'0445000003'}))
+
+        name, data = event_data(await broadcaster.snapshot(watcher))
+        assert name == 'snapshot'
+        assert data == [
+            {'part_no': '0445000001', 'price': 10.01, 'quantity': 1, 'version': 1},
+            {'part_no': '0445000002', 'price': 10.02, 'quantity': 2, 'version': 1},
+            {'part_no': '0445999999', 'price': None, 'quantity': None, 'version': 1},
+        ]
+
+        write_price_file(price_path, rows=[price_row(1, quantity=7), price_row(2, title_en='Renamed'),
+                                           price_row(3), price_row(4, price=99)])
+        await to_thread.run_sync(updater.apply_update, price_path, database_path)
+
+        name, data = event_data(await asyncio.wait_for(watcher.queue.get(), 5))
+        assert name == 'change'
+        assert data == [{'part_no': '0445000001', 'price': 10.01, 'quantity': 7, 'version': 2}]
+        assert other.queue.empty()
+
+        broadcaster.unsubscribe(watcher)
+        broadcaster.unsubscribe(other)
+        assert broadcaster.task is None and not broadcaster.watchers
+
+    asyncio.run(watch())
+    engine.dispose()
@@ -0,0 +1,88 @@
+import sys
+sys.path.insert(0, './')
+
+import asyncio
+import sqlite3
+
+import pytest
+from starlette.testclient import TestClient
+
+from .. import deadlines
+from ..deadlines import QueryDeadlineMiddleware, QueryGuard, current_guard
+
+# Counts far enough to run for minutes unless interrupted
+LONG_QUERY = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c'
+
+
+def connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    deadlines.set_progress_handler(conn, None)
+    return conn
+
+
+def test_deadline_interrupts_query():
+    guard = QueryGuard({})
+    guard.deadline = guard.started
+    token = current_guard.set(guard)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='interrupted'):
+            connection().execute(LONG_QUERY).fetchall()
+    finally:
+        current_guard.reset(token)
+    assert guard.interrupted == 'timed_out'
+
+
+def test_cancelled_query():
+    guard = QueryGuard({})
+    guard.cancelled = True
+    token = current_guard.set(guard)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            connection().execute(LONG_QUERY).fetchall()
+    finally:
+        current_guard.reset(token)
+    assert guard.interrupted == 'cancelled'
+
+
+def test_unguarded_query():
+    assert connection().execute('SELECT count(*) FROM (VALUES (1), (2))').fetchone() == (2, )
+
+
+def test_deadline_response(monkeypatch):
+    monkeypatch.setattr(deadlines.settings, 'QUERY_DEADLINE_SECONDS', 0.05)
+    conn = connection()
+
+    async def app(scope, receive, send):
+        conn.execute(LONG_QUERY).fetchall()
+
+    timed_out = deadlines.stats()['timed_out']
+    response = TestClient(QueryDeadlineMiddleware(app)).get('/')
+    assert response.status_code == 504
+    assert deadlines.stats()['timed_out'] == timed_out + 1
+
+
+def test_slow_consumer(monkeypatch):
+    monkeypatch.setattr(deadlines.settings, 'QUERY_DEADLINE_SECONDS', 0.05)
+    conn = connection()
+    short_query = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 20000) SELECT count(*) FROM c'
+
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        for _ in range(3):
+            # Page of a stream read after the previous one is consumed
+            await send({'type': 'http.response.body', 'body': b'%d\n' % conn.execute(short_query).fetchone(),
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def receive():
+        await asyncio.sleep(10)
+        return {'type': 'http.disconnect'}
+
+    body = []
+
+    async def slow_send(message):
+        await asyncio.sleep(0.1)
+        body.append(message.get('body', b''))
+
+    asyncio.run(QueryDeadlineMiddleware(app)({'type': 'http', 'method': 'GET', 'path': '/'}, receive, slow_send))
+    assert b''.join(body) == b'20000\n' * 3
@@ -0,0 +1,58 @@
+import sqlite3
+import sys
+sys.path.insert(0, './')
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from ..dimension_index import DimensionIndex, LENGTH_UNITS, WEIGHT_UNITS, normalize
+from .test_snapshot import build_catalogue
+
+
+@pytest.fixture
+def catalogue(tmp_path):
+    path = tmp_path / 'bp.sqlite'
+    build_catalogue(path)
+    conn = sqlite3.connect(path)
+    # Units of the masterdata vary
+    conn.execute("UPDATE masterdata SET measure_unit = 'CM', weight_unit = 'G' WHERE rowid % 3 = 0")
+    conn.execute("UPDATE masterdata SET measure_unit = 'INCH' WHERE rowid = 1")
+    conn.commit()
+    rows = conn.execute('SELECT p.part_no, m.length, m.width, m.height, m.measure_unit, m.gross, m.weight_unit '
+                        'FROM masterdata AS m JOIN partnum AS p ON p.rowid = m.partnum_id').fetchall()
+    conn.close()
+    engine = create_engine(f'sqlite:///{path}')
+    with Session(engine) as db:
+        yield DimensionIndex.load(db), rows
+    engine.dispose()
+
+
+def test_normalize():
+    assert normalize(12, 'cm', LENGTH_UNITS) == 120
+    assert normalize('13.281', 'G', WEIGHT_UNITS) == 13281
+    assert normalize('1.5', 'KG', WEIGHT_UNITS) == 1500000
+    assert normalize('1.5', 'LB', WEIGHT_UNITS) is None
+
+
+@pytest.mark.parametrize('sides, min_gross, max_gross', [
+    ([300, 200, 100], None, None),
+    ([1000, 150, None], 500000, 5000000),
+    ([None, None, None], None, 2000),
+    ([50, 50, 50], None, None),
+])
+def test_search_parity(catalogue, sides, min_gross, max_gross):
+    index, rows = catalogue
+    box = sorted(float('inf') if side is None else side for side in sides)
+    expected = set()
+    for part_no, length, width, height, measure_unit, gross, weight_unit in rows:
+        if measure_unit not in LENGTH_UNITS:
+            continue
+        fit = sorted(normalize(side, measure_unit, LENGTH_UNITS) for side in (length, width, height))
+        gross = normalize(gross, weight_unit, WEIGHT_UNITS)
+        if all(side <= limit for side, limit in zip(fit, box)) \
+                and (min_gross or 0) <= gross <= (max_gross or float('inf')):
+            expected.add(part_no)
+    found = index.search(sides, min_gross, max_gross, limit=len(rows))
+    assert {row[0] for row in found} == expected
+    assert index.skipped == 1
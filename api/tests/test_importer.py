@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import pytest
+import sys
+sys.path.insert(0, './')
+
+from openpyxl import Workbook
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from .. import database, importer, models, updater
+
+
+def price_row(i: int, **changes) -> dict:
+    row = {
+        'section': f'Section {i % 20 // 7}',
+        'subsection': f'Subsection {i % 20 // 3}',
+        'group': f'Group {i % 20}',
+        'part_no': f'0 445 {i:06d}',
+        'title_ua': f'Опис {i}',
+        'title_en': f'Title {i}',
+        'uktzed': 8409910000,
+        'min_order': 1 + i % 4,
+        'quantity': i % 50,
+        'price': 10 + i / 100,
+        'truck': 'X' if i % 5 == 0 else None,
+        'ean': 4047020000000 + i if i % 2 else None,
+        'gross': '0.25',
+        'net': 0.2,
+        'weight_unit': 'kg',
+        'length': 10,
+        'width': 20,
+        'height': 30,
+        'measure_unit': 'mm',
+        'volume': 0.006,
+        'volume_unit': 'dm3',
+    }
+    row.update(changes)
+    return row
+
+
+def write_price_file(path, rows, new_release=(), discontinued=(), refers=()):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(importer.PRICE_SHEET)
+    sheet.append(['Bosch price'])
+    sheet.append(list(importer.PRICE_COLUMNS.values()))
+    for row in rows:
+        sheet.append([row[field] for field in importer.PRICE_COLUMNS])
+    for sheet_name, part_numbers in ((importer.NEW_RELEASE_SHEET, new_release),
+                                     (importer.DISCONTINUED_SHEET, discontinued)):
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append(['Part number'])
+        for part_no in part_numbers:
+            sheet.append([part_no])
+    sheet = workbook.create_sheet(importer.REFERS_SHEET)
+    sheet.append(['Part number', 'Successor'])
+    for pair in refers:
+        sheet.append(list(pair))
+    workbook.save(path)
+
+
+@pytest.mark.parametrize(
+    'value,part_no',
+    [
+        ('0 445 115 007', '0445115007'),
+        ('f00vc17503', 'F00VC17503'),
+        (445115007, '0445115007'),
+        ('1.987.946.026', '1987946026'),
+        (None, None),
+    ]
+)
+def test_normalize_part_no(value, part_no):
+    assert importer.normalize_part_no(value) == part_no
+
+
+def test_build_catalogue(tmp_path):
+    price_path = tmp_path / 'price.xlsx'
+    database_path = tmp_path / 'bp.sqlite'
+    write_price_file(
+        price_path,
+        rows=[price_row(i) for i in range(1, 101)] + [price_row(1)],
+        new_release=['0445000002'],
+        discontinued=['0445000003', '0445999999'],
+        refers=[('0445000003', '0445000004'), ('0445999999', '0445000004')],
+    )
+
+    report = importer.build_catalogue(price_path, database_path, batch_size=7)
+
+    assert report['version'] == 1
+    assert report['duplicates'] == 1
+    assert report['rows']['pricelist'] == 100
+    assert report['rows']['masterdata'] == 50
+    assert report['rows']['partnum'] == 101
+    assert report['rows']['refers'] == 2
+    assert report['rows']['subsub'] == 20
+    assert sorted(os.listdir(tmp_path)) == ['bp.sqlite', 'price.xlsx']
+
+    conn = sqlite3.connect(database_path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 1
+    assert conn.execute(
+        'SELECT discontinued, new_release FROM partnum WHERE part_no = ?', ('0445000003', )
+    ).fetchone() == (1, 0)
+    assert conn.execute(
+        'SELECT price, min_order FROM pricelist JOIN partnum ON partnum.rowid = partnum_id WHERE part_no = ?',
+        ('0445000010', )
+    ).fetchone() == (1010, 3)
+    assert 'ix_partnum_part_no' in {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+
+    assert importer.build_catalogue(price_path, database_path)['version'] == 2
+
+
+def test_build_catalogue_fails_atomically(tmp_path):
+    price_path = tmp_path / 'price.xlsx'
+    database_path = tmp_path / 'bp.sqlite'
+    write_price_file(price_path, rows=[price_row(1)])
+    importer.build_catalogue(price_path, database_path)
+    write_price_file(price_path, rows=[price_row(1), price_row(2, price='not a price')])
+
+    with pytest.raises(importer.PriceFileError):
+        importer.build_catalogue(price_path, database_path)
+
+    assert sorted(os.listdir(tmp_path)) == ['bp.sqlite', 'price.xlsx']
+    assert importer.catalogue_version(database_path) == 1
+
+
+def test_build_catalogue_time(tmp_path):
+    price_path = tmp_path / 'price.xlsx'
+    write_price_file(price_path, rows=[price_row(i) for i in range(1, 5001)])
+    report = importer.build_catalogue(price_path, tmp_path / 'bp.sqlite')
+    assert report['rows']['pricelist'] == 5000
+    assert report['seconds'] < 30
+
+
+def test_apply_update(tmp_path):
+    price_path = tmp_path / 'price.xlsx'
+    database_path = tmp_path / 'bp.sqlite'
+    write_price_file(
+        price_path,
+        rows=[price_row(i) for i in range(1, 11)],
+        discontinued=['0445000003'],
+        refers=[('0445000003', '0445000004')],
+    )
+    importer.build_catalogue(price_path, database_path)
+
+    write_price_file(
+        price_path,
+        rows=[price_row(1, price=99.5), price_row(2, quantity=1000)]
+        + [price_row(i) for i in range(3, 10)]
+        + [price_row(11), price_row(4, ean=None)],
+        discontinued=['0445000003', '0445000005'],
+        refers=[('0445000003', '0445000006')],
+    )
+    report = updater.apply_update(price_path, database_path)
+
+    assert (report['version'], report['inserted'], report['updated'], report['deleted']) == (2, 1, 4, 1)
+    conn = sqlite3.connect(database_path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 2
+    assert conn.execute('SELECT version, part_no, change, fields FROM catalogue_change ORDER BY part_no').fetchall() == [
+        (2, '0445000001', 'update', 'price'),
+        (2, '0445000002', 'update', 'quantity'),
+        (2, '0445000003', 'update', 'refers'),
+        (2, '0445000005', 'update', 'discontinued'),
+        (2, '0445000010', 'delete', ''),
+        (2, '0445000011', 'insert', ''),
+    ]
+    assert conn.execute(
+        'SELECT price FROM pricelist JOIN partnum ON partnum.rowid = partnum_id WHERE part_no = ?', ('0445000001', )
+    ).fetchone() == (9950, )
+    assert conn.execute('SELECT COUNT(*) FROM partnum WHERE part_no = ?', ('0445000010', )).fetchone() == (0, )
+    assert conn.execute('SELECT COUNT(*) FROM refers').fetchone() == (1, )
+    conn.close()
+
+    assert updater.apply_update(price_path, database_path)['version'] == 2
+
+
+def make_legacy(database_path):
+    """
+    Turn built catalogue into one of the schema before prices were stored as fixed-point integers.
+    """
+    conn = sqlite3.connect(database_path, isolation_level=None)
+    conn.executescript('''
+        ALTER TABLE pricelist RENAME TO pricelist_built;
+        CREATE TABLE pricelist (
+            title_ua VARCHAR NOT NULL,
+            title_en VARCHAR NOT NULL,
+            uktzed INTEGER NOT NULL,
+            min_order INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            price VARCHAR NOT NULL,
+            truck BOOLEAN NOT NULL,
+            rowid INTEGER NOT NULL,
+            partnum_id INTEGER NOT NULL,
+            subsub_id INTEGER NOT NULL,
+            PRIMARY KEY (rowid)
+        );
+        INSERT INTO pricelist SELECT title_ua, title_en, uktzed, min_order, quantity, printf('%.2f', price / 100.0),
+                                     truck, rowid, partnum_id, subsub_id FROM pricelist_built;
+        DROP TABLE pricelist_built;
+    ''')
+    conn.close()
+
+
+def test_apply_update_to_legacy_catalogue(tmp_path):
+    price_path = tmp_path / 'price.xlsx'
+    database_path = tmp_path / 'bp.sqlite'
+    write_price_file(price_path, rows=[price_row(i) for i in range(1, 6)])
+    importer.build_catalogue(price_path, database_path)
+    make_legacy(database_path)
+
+    write_price_file(price_path, rows=[price_row(1, price=100.5)] + [price_row(i) for i in range(2, 6)])
+    report = updater.apply_update(price_path, database_path)
+    assert (report['version'], report['updated']) == (2, 1)
+
+    conn = sqlite3.connect(database_path)
+    assert conn.execute('SELECT DISTINCT typeof(price) FROM pricelist').fetchall() == [('integer', )]
+    assert conn.execute('SELECT COUNT(*) FROM sqlite_master WHERE tbl_name = ? AND type = ?',
+                        ('pricelist', 'index')).fetchone() == (2, )
+    conn.close()
+
+    engine = create_engine(f'sqlite:///{database_path}')
+    with Session(engine) as db:
+        prices = dict(db.execute(select(models.PartNumber.part_no, models.Product.price).join(models.Product)).all())
+    engine.dispose()
+    assert prices['0445000001'] == 10050
+    assert prices['0445000002'] == 1002
+    assert not updater.migrate_prices(database_path)
+
+
+def test_replaced_catalogue_is_served(tmp_path):
+    price_path = tmp_path / 'price.xlsx'
+    database_path = tmp_path / 'bp.sqlite'
+    write_price_file(price_path, rows=[price_row(i) for i in range(1, 6)])
+    importer.build_catalogue(price_path, database_path)
+    catalogue = database.Catalogue('test', str(database_path))
+
+    with catalogue.SessionLocal() as db:
+        assert database.get_catalogue_version(db) == 1
+    write_price_file(price_path, rows=[price_row(i) for i in range(1, 8)])
+    importer.build_catalogue(price_path, database_path)
+    with catalogue.SessionLocal() as db:
+        assert database.get_catalogue_version(db) == 2
+        assert db.scalar(select(func.count()).select_from(models.PartNumber)) == 7
+    catalogue.engine.dispose()
@@ -0,0 +1,36 @@
+import sqlite3
+import sys
+sys.path.insert(0, './')
+
+from .. import loadtest
+
+
+def test_generate_catalogue(tmp_path):
+    part_numbers, group_ids = loadtest.generate_catalogue(tmp_path / 'bp.sqlite', products=500, groups=40)
+    assert len(part_numbers) == 500 and group_ids == list(range(1, 41))
+    conn = sqlite3.connect(tmp_path / 'bp.sqlite')
+    assert conn.execute('SELECT COUNT(*) FROM pricelist').fetchone() == (500, )
+    assert conn.execute('PRAGMA user_version').fetchone() == (1, )
+    conn.close()
+
+
+def test_workload():
+    workload = loadtest.Workload(['0445115007', 'F00VC17503'], [1, 2], ['user'], seed=1)
+    requests = [workload.next_request() for _ in range(500)]
+    assert {route for route, _ in requests} == set(loadtest.ROUTE_MIX)
+    searches = [request['json']['search_query'] for route, request in requests if route == 'POST /products/search/']
+    assert all(1 <= query.count('?') <= 4 for query in searches)
+
+
+def test_summarize():
+    stats = loadtest.Stats()
+    for i in range(1, 101):
+        stats.add('GET /sections/', i / 1000, 200)
+    stats.add('POST /login/', 0.5, 400)
+    report = loadtest.summarize(stats, seconds=10, config={})
+    assert report['routes']['GET /sections/'] == {
+        'requests': 100, 'rps': 10.0, 'p50_ms': 50.0, 'p95_ms': 95.0, 'p99_ms': 99.0, 'max_ms': 100.0,
+        'statuses': {'200': 100},
+    }
+    assert report['total']['statuses'] == {'200': 100, '400': 1}
+    assert 'GET /sections/' in loadtest.format_table(report, previous=report)
@@ -0,0 +1,77 @@
+import sys
+sys.path.insert(0, './')
+
+import io
+import json
+import logging
+
+from starlette.responses import PlainTextResponse
+from starlette.testclient import TestClient
+
+from .. import logs
+
+
+def record(message: str, created: float, name: str = 'test', **extra) -> logging.LogRecord:
+    return logging.makeLogRecord({'name': name, 'levelno': logging.INFO, 'levelname': 'INFO',
+                                  'msg': message, 'created': created, 'msecs': 0, **extra})
+
+
+def test_json_line():
+    line = json.loads(logs.JsonFormatter().format(record('Done %s', 0, args=(1, ), request_id='abc', status=200)))
+    assert line['message'] == 'Done 1'
+    assert line['request_id'] == 'abc' and line['status'] == 200
+    assert 'args' not in line and 'msecs' not in line
+
+
+def test_throttle():
+    throttle = logs.ThrottleFilter(interval=10, burst=2)
+    assert [throttle.filter(record('Same', created=t)) for t in range(5)] == [True, True, False, False, False]
+    assert throttle.filter(record('Other', created=5))
+    assert throttle.filter(record('Same', created=1, name=logs.ACCESS_LOGGER))
+
+    passed = record('Same', created=10)
+    assert throttle.filter(passed)
+    assert passed.repeats_dropped == 3 and throttle.throttled == 3
+
+
+def test_access_line(monkeypatch):
+    lines = []
+    monkeypatch.setattr(logs.access_logger, 'info', lambda message, extra: lines.append(extra))
+
+    async def app(scope, receive, send):
+        logs.annotate(user='JohnSmith', request_id=logs.request_id.get())
+        await PlainTextResponse('Hello')(scope, receive, send)
+
+    client = TestClient(logs.AccessLogMiddleware(app))
+    response = client.get('/hello', headers={'X-Request-ID': 'abc'})
+    assert response.headers['x-request-id'] == 'abc'
+    assert lines[0]['status'] == 200 and lines[0]['bytes'] == 5
+    assert lines[0]['user'] == 'JohnSmith' and lines[0]['request_id'] == 'abc'
+
+    assert len(client.get('/hello').headers['x-request-id']) == 32
+
+
+def test_server_loggers():
+    # As uvicorn configures them before the app is loaded
+    server_logger = logging.getLogger('uvicorn')
+    server_stream = io.StringIO()
+    server_logger.addHandler(logging.StreamHandler(server_stream))
+    server_logger.propagate = False
+
+    lines = io.StringIO()
+    root_handler = logging.StreamHandler(lines)
+    root_handler.setFormatter(logs.JsonFormatter())
+    logging.getLogger().addHandler(root_handler)
+    try:
+        logs.route_server_loggers()
+        try:
+            raise ValueError('failed')
+        except ValueError:
+            logging.getLogger('uvicorn.error').exception('Exception in ASGI application')
+    finally:
+        logging.getLogger().removeHandler(root_handler)
+
+    line = json.loads(lines.getvalue().splitlines()[-1])
+    assert line['logger'] == 'uvicorn.error' and line['message'] == 'Exception in ASGI application'
+    assert 'ValueError' in line['exception']
+    assert server_stream.getvalue() == ''
@@ -1,6 +1,9 @@
 import os
+import time
+import uuid
 from datetime import timedelta
 from dataclasses import dataclass
+from types import SimpleNamespace
 import pytest
 import sys
 sys.path.insert(0, './')
@@ -11,6 +14,7 @@ from fastapi.exceptions import HTTPException
 from fastapi.security import SecurityScopes
 
 from ..main import app
+from ..routers.changes import fold_changes
 from .. import dependencies
 from .. import settings
 from ..users import users
@@ -298,3 +302,340 @@ def test_search_validation_fails(query_object, access_token):
         json=query_object
     )
     assert response.status_code == 422, query_object
+
+
+def test_health_ready():
+    with TestClient(app) as warming_client:
+        for _ in range(100):
+            response = warming_client.get('/api/v1/health/ready')
+            if response.status_code == 200:
+                break
+            assert response.status_code == 503
+            time.sleep(0.1)
+    assert response.json()['ready'] is True
+    assert response.json()['warmup_seconds'] is not None
+
+
+@pytest.mark.parametrize(
+    'query,status_code',
+    [
+        ('since=0', 200),
+        ('since=0&stream=true', 200),
+        ('since=-1', 422),
+        ('since=0&cursor=wrong', 422),
+        ('', 422),
+    ]
+)
+def test_changes(query, status_code, test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    response = client.get(
+        f'/api/v1/changes?{query}',
+        headers={
+            'Authorization': f'Bearer {tkn}'
+        }
+    )
+    assert response.status_code == status_code, response.text
+
+
+@pytest.mark.parametrize(
+    'changes,folded',
+    [
+        ([('update', 'price'), ('update', 'quantity')], ('update', ['price', 'quantity'])),
+        ([('insert', ''), ('update', 'price')], ('insert', [])),
+        ([('update', 'price'), ('delete', '')], ('delete', [])),
+        ([('delete', ''), ('insert', '')], ('insert', [])),
+        ([('update', 'price'), ('delete', ''), ('insert', ''), ('update', 'quantity')], ('insert', [])),
+    ]
+)
+def test_fold_changes(changes, folded):
+    rows = [SimpleNamespace(part_no='0445115007', version=version, change=change, fields=fields)
+            for version, (change, fields) in enumerate(changes, start=1)]
+    assert list(fold_changes(rows)) == [
+        {'part_no': '0445115007', 'change': folded[0], 'fields': folded[1], 'version': len(changes)}
+    ]
+
+
+def test_logout(test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+    assert client.get('/api/v1/login/me', headers=headers).status_code == 200
+    assert client.post('/api/v1/login/logout', headers=headers).status_code == 204
+    assert client.get('/api/v1/login/me', headers=headers).status_code == 401
+
+
+def test_logout_token_without_id():
+    # Tokens without iat are revoked by any revocation of their user, so the user must be a fresh one
+    legacy_user = SetupUser(username=f'legacy_{uuid.uuid4().hex[:8]}', password='legacy_password',
+                            scopes=['catalogue'])
+    users.add_user(username=legacy_user.username, password=legacy_user.hashed_password, scopes=legacy_user.scopes)
+    try:
+        # Issued before token ids were introduced
+        tkn = jwt.encode(
+            {'sub': legacy_user.username, 'scopes': legacy_user.scopes, 'exp': time.time() + 3600},
+            settings.AUTH_KEY,
+            algorithm=settings.AUTH_ALG,
+        )
+        headers = {'Authorization': f'Bearer {tkn}'}
+        assert client.get('/api/v1/login/me', headers=headers).status_code == 200
+        assert client.post('/api/v1/login/logout', headers=headers).status_code == 204
+        assert client.get('/api/v1/login/me', headers=headers).status_code == 401
+    finally:
+        users.delete_user(legacy_user.username)
+
+
+def test_revoke_user_tokens(test_user):
+    tkn = dependencies.create_token(
+        user_data={
+            'sub': test_user.username,
+            'scopes': test_user.scopes,
+        },
+        expires_delta=timedelta(hours=1),
+    )
+    dependencies.get_current_user(user_scopes, tkn)
+    dependencies.denylist.revoke_user(test_user.username)
+    with pytest.raises(HTTPException):
+        dependencies.get_current_user(user_scopes, tkn)
+
+
+@pytest.mark.parametrize(
+    'fields,status_code,keys',
+    [
+        ('product.price,product.quantity', 200, {'part_no', 'product'}),
+        ('discontinued,masterdata', 200, {'part_no', 'discontinued', 'masterdata'}),
+        ('product.nonexistent', 422, None),
+        ('refers.part_no', 422, None),
+    ]
+)
+def test_product_fields(fields, status_code, keys, test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    response = client.get(
+        '/api/v1/products/0445115007',
+        params={'fields': fields},
+        headers={
+            'Authorization': f'Bearer {tkn}'
+        },
+    )
+    assert response.status_code == status_code
+    if keys is not None:
+        assert set(response.json()) == keys
+
+
+@pytest.fixture
+def test_manager() -> SetupUser:
+    test_user = SetupUser(
+        username='manager_hashed_password',
+        password='manager_unhashed_test_password',
+        scopes=['catalogue', 'user_manager'],
+    )
+    users.add_user(
+        username=test_user.username,
+        password=test_user.hashed_password,
+        scopes=test_user.scopes,
+    )
+    yield test_user
+    users.delete_user(test_user.username)
+
+
+@pytest.mark.parametrize(
+    'user_fixture,status_code',
+    [
+        ('test_user', 403),
+        ('test_manager', 200),
+    ]
+)
+def test_profiled_request(user_fixture, status_code, request):
+    user = request.getfixturevalue(user_fixture)
+    tkn = dependencies.create_token(
+        user_data={'sub': user.username, 'scopes': user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+    response = client.get('/api/v1/sections/', headers={**headers, 'X-Profile': '1'})
+    assert response.status_code == status_code
+    if status_code == 200:
+        profile_id = response.headers['X-Profile-Id']
+        assert profile_id in client.get('/api/v1/profiles/', headers=headers).json()
+        assert client.get(f'/api/v1/profiles/{profile_id}', headers=headers).status_code == 200
+
+
+def test_metrics():
+    response = client.get('/api/v1/health/metrics')
+    assert response.status_code == 200
+    assert 'search_cache' in response.json()
+    assert response.json()['queries'].keys() == {'timed_out', 'cancelled'}
+    assert response.json()['logging']['dropped'] == 0
+    assert 'coalesced' in response.json()['coalescing']
+
+
+def test_catalogues(test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+    response = client.get('/api/v1/catalogues/', headers=headers)
+    assert response.status_code == 200
+    assert settings.DEFAULT_CATALOGUE in [c['name'] for c in response.json()]
+
+    response = client.post('/api/v1/catalogues/search/', headers=headers, json={'search_query': '0445115007'})
+    assert response.status_code == 200, response.json()
+    assert {r['catalogue'] for r in response.json()} == {settings.DEFAULT_CATALOGUE}
+
+    response = client.get('/api/v1/sections/', headers=headers, params={'catalogue': 'nonexistent'})
+    assert response.status_code == 422
+
+
+def test_currency(test_manager):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_manager.username, 'scopes': test_manager.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+    response = client.post('/api/v1/pricing/rates', headers=headers, json=[{'currency': 'EUR', 'rate': '40'}])
+    assert response.status_code == 200, response.json()
+    assert response.json()['rates']['EUR'] == 40
+
+    detail = client.get('/api/v1/products/0445115007', headers=headers).json()
+    converted = client.get('/api/v1/products/0445115007', params={'currency': 'EUR'}, headers=headers).json()
+    assert converted['product']['currency'] == 'EUR'
+    assert abs(converted['product']['price'] - detail['product']['price'] / 40) <= 0.005
+    sparse = client.get('/api/v1/products/0445115007', params={'fields': 'product.price'}, headers=headers).json()
+    assert sparse['product']['price'] == detail['product']['price']
+
+    listing = client.get('/api/v1/sections/12/', params={'currency': 'EUR'}, headers=headers).json()
+    assert all(product['currency'] == 'EUR' for product in listing)
+
+    response = client.get('/api/v1/products/export/', params={'currency': 'EUR'}, headers=headers)
+    assert response.status_code == 200
+    assert response.text.splitlines()[0] == 'part_no,title_en,title_ua,min_order,quantity,price,currency'
+
+    response = client.get('/api/v1/products/0445115007', params={'currency': 'GBP'}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_quote(test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    response = client.post(
+        '/api/v1/quote/',
+        headers={'Authorization': f'Bearer {tkn}'},
+        json=[
+            {'part_no': '0445115007', 'quantity': 3},
+            {'part_no': '0445115007', 'quantity': 1},
+            {'part_no': 'ZZZZZZZZZZ', 'quantity': 1},
+        ],
+    )
+    assert response.status_code == 200, response.json()
+    first, second, missing = response.json()['lines']
+    assert first['order_quantity'] % first['min_order'] == 0 and first['order_quantity'] >= 3
+    assert first['short'] == second['short'] == (first['order_quantity'] + second['order_quantity'] > first['stock'])
+    assert not missing['found'] and missing['total'] is None
+    assert abs(response.json()['total'] - first['total'] - second['total']) < 0.01
+
+
+def test_section_levels(test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+    sections = client.get('/api/v1/sections/top/', headers=headers).json()
+    subsections = client.get('/api/v1' + sections[0]['path'], headers=headers).json()
+    groups = client.get('/api/v1' + subsections[0]['path'], headers=headers).json()
+    assert sections[0]['products'] >= subsections[0]['products'] == sum(group['products'] for group in groups)
+    products = client.get('/api/v1' + groups[0]['path'], headers=headers).json()
+    assert len(products) == groups[0]['products']
+    assert client.get('/api/v1/sections/999999/subsections/', headers=headers).status_code == 404
+
+
+def test_dimension_search(test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+    response = client.post('/api/v1/products/search/dimensions/', headers=headers,
+                           json={'length': 400, 'width': 300, 'max_gross': 5, 'limit': 50})
+    assert response.status_code == 200, response.json()
+    for product in response.json():
+        short, middle, _ = sorted([product['length'], product['width'], product['height']])
+        assert short <= 300 and middle <= 400 and product['gross'] <= 5
+    response = client.post('/api/v1/products/search/dimensions/', headers=headers,
+                           json={'min_gross': 5, 'max_gross': 1})
+    assert response.status_code == 422
+
+
+def test_ean_lookup(test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+    detail = client.get('/api/v1/products/0445115007/', headers=headers).json()
+    ean = detail['masterdata']['ean']
+    response = client.get(f'/api/v1/products/by-ean/{ean}/', headers=headers)
+    assert response.status_code == 200
+    assert response.json() == detail
+    assert client.get('/api/v1/products/by-ean/1/', headers=headers).status_code == 404
+
+    response = client.post('/api/v1/products/by-ean/?fields=part_no', headers=headers, json=[ean, 1, ean])
+    assert response.status_code == 200
+    assert response.json() == {str(ean): {'part_no': '0445115007'}, '1': None}
+
+    response = client.post('/api/v1/products/by-ean/', headers=headers, json=[ean])
+    assert response.json() == {str(ean): detail}
+    converted = client.get('/api/v1/products/0445115007/?currency=EUR', headers=headers).json()
+    response = client.post('/api/v1/products/by-ean/?currency=EUR', headers=headers, json=[ean, 1])
+    assert response.json() == {str(ean): converted, '1': None}
+
+
+def test_expand(test_user):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_user.username, 'scopes': test_user.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+    response = client.get('/api/v1/sections/3/?expand=stock,masterdata', headers=headers)
+    assert response.status_code == 200
+    listed = response.json()
+    assert set(listed[0]) == {'part_no', 'title_en', 'path', 'quantity', 'masterdata'}
+    detail = client.get(f'/api/v1/products/{listed[0]["part_no"]}/', headers=headers).json()
+    assert listed[0]['quantity'] == detail['product']['quantity'] and listed[0]['masterdata'] == detail['masterdata']
+
+    response = client.post('/api/v1/products/search/?expand=price', headers=headers,
+                           json={'search_query': listed[0]['part_no']})
+    assert response.status_code == 200
+    assert response.json()[0]['price'] == detail['product']['price']
+
+    response = client.get('/api/v1/sections/3/?expand=bogus', headers=headers)
+    assert response.status_code == 422
+
+
+def test_usage(test_manager):
+    tkn = dependencies.create_token(
+        user_data={'sub': test_manager.username, 'scopes': test_manager.scopes},
+        expires_delta=timedelta(hours=1),
+    )
+    headers = {'Authorization': f'Bearer {tkn}'}
+
+    def users_route_usage() -> dict:
+        response = client.get(f'/api/v1/usage/?username={test_manager.username}', headers=headers)
+        assert response.status_code == 200
+        return next((row for row in response.json() if row['route'] == 'GET /api/v1/users/'),
+                    {'requests': 0, 'bytes': 0})
+
+    before = users_route_usage()
+    size = len(client.get('/api/v1/users/', headers=headers).content)
+    after = users_route_usage()
+    assert (after['requests'] - before['requests'], after['bytes'] - before['bytes']) == (1, size)
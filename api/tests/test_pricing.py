@@ -0,0 +1,46 @@
+import sys
+sys.path.insert(0, './')
+
+from decimal import Decimal
+
+import numpy as np
+
+from ..pricing import PriceBook
+from ..sqlite_um.user_manager import SQLiteUserManager
+
+
+def price_book(tmp_path) -> PriceBook:
+    user_manager = SQLiteUserManager(database_path=tmp_path / 'users.sqlite')
+    user_manager._initial_setup()
+    return PriceBook(user_manager, refresh_seconds=0)
+
+
+def test_base_currency(tmp_path):
+    conversion = price_book(tmp_path).conversion('UAH', 'JohnSmith')
+    prices = np.array([1, 1999, 123456789], dtype=np.int64)
+    assert conversion.apply(prices).tolist() == [1, 1999, 123456789]
+
+
+def test_rate_and_markup(tmp_path):
+    book = price_book(tmp_path)
+    assert book.conversion('EUR', 'JohnSmith') is None
+
+    book.set_exchange_rates({'EUR': Decimal('40')})
+    book.set_markups({'wholesale': Decimal('12.5')})
+    prices = np.array([4000, 4001, 20, 1000000000], dtype=np.int64)
+    assert book.conversion('EUR', 'JohnSmith').apply(prices).tolist() == [100, 100, 1, 25000000]
+
+    book.set_customer_groups({'JohnSmith': 'wholesale'})
+    # 112.5 and 0.5625 hundredths are rounded half up
+    assert book.conversion('EUR', 'JohnSmith').apply(prices).tolist() == [113, 113, 1, 28125000]
+    assert book.conversion('UAH', 'JohnSmith').apply_decimal(Decimal('10.01')) == Decimal('11.26')
+
+
+def test_refresh(tmp_path):
+    book = price_book(tmp_path)
+    other = PriceBook(book.user_manager, refresh_seconds=0)
+    book.set_exchange_rates({'USD': Decimal('36.5686')})
+    book.set_customer_groups({'JohnSmith': 'wholesale'})
+    book.set_customer_groups({'JohnSmith': None})
+    assert other.report()['rates'] == {'USD': Decimal('36.5686')}
+    assert other.report()['customer_groups'] == {}
@@ -0,0 +1,75 @@
+import sys
+sys.path.insert(0, './')
+
+import asyncio
+import cProfile
+import pstats
+
+from .. import profiling
+
+
+def profiled_work():
+    return sum(range(1000))
+
+
+def other_work():
+    return sum(range(1000))
+
+
+def thread_work():
+    return sum(range(1000))
+
+
+def functions(stats: pstats.Stats) -> set[str]:
+    return {name for _, _, name in stats.stats}
+
+
+def test_profiled_steps():
+    profile = cProfile.Profile()
+
+    async def profiled():
+        for _ in range(3):
+            profiled_work()
+            await asyncio.sleep(0.01)
+        return 'done'
+
+    async def other():
+        for _ in range(3):
+            other_work()
+            await asyncio.sleep(0.005)
+
+    async def main():
+        return await asyncio.gather(profiling.ProfiledSteps(profiled(), profile), other())
+
+    assert asyncio.run(main())[0] == 'done'
+    names = functions(pstats.Stats(profile))
+    assert 'profiled_work' in names and 'other_work' not in names
+
+
+def test_profiled_steps_raise():
+    profile = cProfile.Profile()
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise ValueError('failed')
+
+    async def main():
+        try:
+            await profiling.ProfiledSteps(failing(), profile)
+        except ValueError as exc:
+            return str(exc)
+
+    assert asyncio.run(main()) == 'failed'
+
+
+def test_run_sync():
+    profile = profiling.RequestProfile()
+
+    async def main():
+        assert await profiling.run_sync(other_work) == sum(range(1000))
+        profiling.request_profile.set(profile)
+        return await profiling.ProfiledSteps(profiling.run_sync(thread_work), profile.loop)
+
+    assert asyncio.run(main()) == sum(range(1000))
+    names = functions(profile.stats())
+    assert 'thread_work' in names and 'other_work' not in names
@@ -0,0 +1,35 @@
+import sys
+sys.path.insert(0, './')
+
+from ..search_cache import SearchCache
+
+
+def test_hit_and_miss():
+    cache = SearchCache(max_rows=100, max_result_rows=10)
+    assert cache.get('0445______', 1) is None
+    assert cache.set('0445______', 1, b'[...]', rows=5)
+    assert cache.get('0445______', 1) == b'[...]'
+    assert cache.stats()['hit_rate'] == 0.5
+
+
+def test_evicted_by_rows():
+    cache = SearchCache(max_rows=20, max_result_rows=10)
+    for pattern in ('A', 'B', 'C'):
+        cache.set(pattern, 1, pattern.encode(), rows=8)
+    assert cache.get('A', 1) is None
+    assert cache.get('C', 1) == b'C'
+    assert cache.stats()['rows'] == 16 and cache.stats()['evictions'] == 1
+
+
+def test_oversized_result():
+    cache = SearchCache(max_rows=100, max_result_rows=10)
+    assert not cache.set('0_________', 1, b'[...]', rows=11)
+    assert cache.stats()['oversized'] == 1
+
+
+def test_catalogue_version():
+    cache = SearchCache(max_rows=100, max_result_rows=10)
+    cache.set('0445______', 1, b'old', rows=1)
+    assert cache.get('0445______', 2) is None
+    assert not cache.set('0445______', 1, b'old', rows=1)
+    assert cache.stats()['entries'] == 0
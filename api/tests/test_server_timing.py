@@ -0,0 +1,31 @@
+import re
+import sys
+sys.path.insert(0, './')
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from ..server_timing import ServerTimingMiddleware, span
+
+
+def test_server_timing():
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware)
+
+    @app.get('/')
+    def endpoint():
+        with span('auth'):
+            pass
+        for _ in range(2):
+            with span('db'):
+                pass
+        return {}
+
+    header = TestClient(app).get('/').headers['Server-Timing']
+    assert re.fullmatch(r'auth;desc="Authentication";dur=[\d.]+, db;desc="Catalogue reads";dur=[\d.]+, '
+                        r'total;dur=[\d.]+', header)
+
+
+def test_span_without_timing():
+    with span('db'):
+        pass
@@ -0,0 +1,124 @@
+import multiprocessing
+import pytest
+import sys
+import threading
+sys.path.insert(0, './')
+
+from ..shared_cache import SharedCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SharedCache(tmp_path / 'cache.mmap', size=64 * 1024, buckets=16)
+    yield cache
+    cache.close()
+
+
+def test_set_get(cache):
+    assert cache.get('sections', 1) is None
+    assert cache.set('sections', b'[1, 2, 3]', 1)
+    assert cache.get('sections', 1) == b'[1, 2, 3]'
+
+
+def test_other_version_misses(cache):
+    cache.set('sections', b'old', 1)
+    assert cache.get('sections', 2) is None
+    cache.set('group:1', b'new', 2)
+    assert cache.get('group:1', 2) == b'new'
+    assert cache.get('sections', 1) is None
+
+
+def test_overwrite(cache):
+    cache.set('product:0445115007', b'first', 1)
+    cache.set('product:0445115007', b'second', 1)
+    assert cache.get('product:0445115007', 1) == b'second'
+
+
+def test_ring_eviction(cache):
+    value = bytes(1000)
+    for i in range(200):
+        assert cache.set(f'group:{i}', value, 1)
+    assert cache.get('group:0', 1) is None
+    assert cache.get('group:199', 1) == value
+
+
+def test_too_large_value(cache):
+    assert not cache.set('sections', bytes(cache.data_size), 1)
+    assert cache.get('sections', 1) is None
+
+
+def _write(path):
+    writer = SharedCache(path, size=64 * 1024, buckets=16)
+    writer.set('sections', b'from another worker', 3)
+    writer.close()
+
+
+def test_shared_between_processes(cache, tmp_path):
+    cache.get('sections', 3)
+    process = multiprocessing.get_context('fork').Process(target=_write, args=(tmp_path / 'cache.mmap', ))
+    process.start()
+    process.join()
+    assert cache.get('sections', 3) == b'from another worker'
+
+
+def test_carry_over(cache):
+    cache.set('product:0445115007', b'stale', 1)
+    cache.set('product:F00VC17503', b'fresh', 1)
+    assert cache.carry_over(1, 2, ['product:0445115007'])
+    assert cache.version == 2
+    assert cache.get('product:0445115007', 2) is None
+    assert cache.get('product:F00VC17503', 2) == b'fresh'
+    assert not cache.carry_over(1, 3, [])
+
+
+def test_concurrent_writers(tmp_path):
+    cache = SharedCache(tmp_path / 'cache.mmap', size=256 * 1024, buckets=64)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    corrupted = []
+
+    def write(worker: int):
+        for i in range(500):
+            key = f'group:{worker}:{i % 50}'
+            value = key.encode() * (1 + i % 7)
+            cache.set(key, value, 1)
+            if (cached := cache.get(key, 1)) is not None and cached.strip(key.encode()):
+                corrupted.append(key)
+
+    try:
+        threads = [threading.Thread(target=write, args=(worker, )) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert not corrupted
+    assert cache.HEADER.unpack_from(cache._mapping(), 0)[3] % 2 == 0
+    assert cache.set('sections', b'after', 1)
+    assert cache.get('sections', 1) == b'after'
+    cache.close()
+
+
+def test_writer_excludes_threads(cache):
+    results = []
+    cache.set('sections', b'first', 1)
+    with cache._write_lock(blocking=True):
+        thread = threading.Thread(target=lambda: results.append(cache.set('sections', b'second', 1)))
+        thread.start()
+        thread.join()
+    assert results == [False]
+    assert cache.get('sections', 1) == b'first'
+
+
+def test_concurrent_mapping(tmp_path):
+    cache = SharedCache(tmp_path / 'cache.mmap', size=64 * 1024, buckets=16)
+    mappings = []
+    threads = [threading.Thread(target=lambda: mappings.append(cache._mapping())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(mapping) for mapping in mappings}) == 1
+    cache.close()
@@ -0,0 +1,64 @@
+import sys
+sys.path.insert(0, './')
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ..singleflight import SingleFlight, frozen
+
+
+def test_concurrent_calls_share_result():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    executions = []
+
+    def query():
+        executions.append(1)
+        started.set()
+        release.wait()
+        return ['row']
+
+    with ThreadPoolExecutor(8) as executor:
+        leader = executor.submit(flights.do, 'key', query)
+        started.wait()
+        followers = [executor.submit(flights.do, 'key', query) for _ in range(7)]
+        # Time for the followers to join the call in progress
+        time.sleep(0.2)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+    assert all(result is results[0] for result in results)
+    assert len(executions) == 1
+    assert flights.stats() == {'calls': 1, 'coalesced': 7}
+    assert not flights.flights
+
+
+def test_failure_is_not_shared():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait()
+        raise RuntimeError('Interrupted')
+
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flights.do, 'key', failing)
+        started.wait()
+        follower = executor.submit(flights.do, 'key', lambda: 'own result')
+        release.set()
+        with pytest.raises(RuntimeError):
+            leader.result()
+        assert follower.result() == 'own result'
+
+
+def test_sequential_calls_are_not_shared():
+    flights = SingleFlight()
+    assert flights.do('key', lambda: 1) == 1
+    assert flights.do('key', lambda: 2) == 2
+
+
+def test_frozen():
+    assert frozen([1, [2, 3], {'a': {4}}]) == (1, (2, 3), frozenset({('a', frozenset({4}))}))
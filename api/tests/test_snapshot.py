@@ -0,0 +1,101 @@
+import random
+import sqlite3
+import pytest
+import sys
+sys.path.insert(0, './')
+
+from pydantic import parse_obj_as
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from .. import crud, models, schemas
+from ..snapshot import CatalogueSnapshot
+
+
+def build_catalogue(path, groups=12, products=400, seed=0):
+    engine = create_engine(f'sqlite:///{path}')
+    models.Base.metadata.create_all(engine)
+    engine.dispose()
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute('INSERT INTO sect VALUES (1, ?)', ('Section', ))
+    conn.execute('INSERT INTO subsect VALUES (1, ?, 1)', ('Subsection', ))
+    conn.executemany('INSERT INTO subsub (rowid, title, subsect_id) VALUES (?, ?, 1)',
+                     [(g, f'Group {g}') for g in range(1, groups + 1)])
+    part_numbers = list({''.join(rnd.choices('0123456789ABF', k=10)) for _ in range(products + 100)})
+    conn.executemany('INSERT INTO partnum (rowid, part_no, discontinued, new_release) VALUES (?, ?, ?, ?)',
+                     [(i, p, i % 7 == 0, i % 11 == 0) for i, p in enumerate(part_numbers, 1)])
+    conn.executemany('INSERT INTO pricelist (title_ua, title_en, uktzed, min_order, quantity, price, truck, '
+                     'partnum_id, subsub_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     [(f'Опис {i % 50}', f'Title {i % 50}', 8409910000, rnd.choice([1, 5]), rnd.randint(0, 99),
+                       f'{rnd.randint(1, 9999)}.{rnd.randint(0, 99):02d}', i % 3 == 0, i, rnd.randint(1, groups))
+                      for i in range(1, products + 1)])
+    conn.executemany('INSERT INTO masterdata (ean, gross, net, weight_unit, length, width, height, measure_unit, '
+                     'volume, volume_unit, partnum_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     [(4047020000000 + i, f'{rnd.randint(1, 999) / 100}', '0.5', 'KG', rnd.randint(1, 500),
+                       rnd.randint(1, 500), rnd.randint(1, 500), 'MM', '0.125', 'DM3', i)
+                      for i in range(1, products + 1, 2)])
+    conn.executemany('INSERT OR IGNORE INTO refers VALUES (?, ?)',
+                     [(rnd.randint(1, len(part_numbers)), rnd.randint(1, len(part_numbers))) for _ in range(150)])
+    conn.commit()
+    conn.close()
+    return part_numbers
+
+
+@pytest.fixture
+def catalogue(tmp_path):
+    path = tmp_path / 'bp.sqlite'
+    part_numbers = build_catalogue(path)
+    engine = create_engine(f'sqlite:///{path}')
+    with Session(engine) as db:
+        yield db, CatalogueSnapshot.load(db), part_numbers
+    engine.dispose()
+
+
+def as_json(model, content):
+    return jsonable_encoder(parse_obj_as(model, content))
+
+
+def test_detail_parity(catalogue):
+    db, snapshot, part_numbers = catalogue
+    for part_no in part_numbers + ['NOTEXISTED']:
+        sql_partnum = crud.get_partnum(db, part_no)
+        snapshot_partnum = snapshot.get_partnum(part_no)
+        if sql_partnum is None:
+            assert snapshot_partnum is None
+            continue
+        assert as_json(schemas.PartNumber, snapshot_partnum) == as_json(schemas.PartNumber, sql_partnum)
+
+
+def test_group_parity(catalogue):
+    db, snapshot, _ = catalogue
+    for group_id in range(0, 14):
+        assert as_json(list[schemas.ListedPartnums], snapshot.get_products_by_group(group_id)) \
+               == as_json(list[schemas.ListedPartnums], crud.get_products_by_group(db, group_id))
+
+
+@pytest.mark.parametrize('query', ['__________', 'A_________', '0_1_______', 'ZZZZZZZZZZ', '.*________'])
+def test_search_parity(catalogue, query):
+    db, snapshot, part_numbers = catalogue
+    sort_key = lambda listed: listed['part_no']
+    assert sorted(as_json(list[schemas.ListedPartnums], snapshot.search_products(query)), key=sort_key) \
+           == sorted(as_json(list[schemas.ListedPartnums], crud.search_products(db, query)), key=sort_key)
+    exact = part_numbers[0]
+    assert [listed['part_no'] for listed in snapshot.search_products(exact)] == [exact]
+
+
+def test_memory_footprint(catalogue):
+    _, snapshot, part_numbers = catalogue
+    assert len(snapshot) == len(part_numbers)
+    assert snapshot.nbytes() / len(snapshot) < 200
+
+
+@pytest.mark.parametrize('expand', [('price', ), ('stock', ), ('price', 'stock', 'masterdata')])
+def test_expanded_parity(catalogue, expand):
+    db, snapshot, part_numbers = catalogue
+    for group_id in range(0, 14):
+        assert list(map(tuple, snapshot.get_expanded_products_by_group(group_id, expand))) \
+               == list(map(tuple, crud.get_expanded_products_by_group(db, group_id, expand)))
+    assert sorted(map(tuple, snapshot.search_expanded_products('__________', expand))) \
+           == sorted(map(tuple, crud.search_expanded_products(db, '__________', expand)))
@@ -0,0 +1,40 @@
+import sys
+sys.path.insert(0, './')
+
+from ..sqlite_um.user_manager import SQLiteUserManager
+from ..usage import UsageMeter
+
+
+def usage_meter(tmp_path) -> UsageMeter:
+    user_manager = SQLiteUserManager(database_path=tmp_path / 'users.sqlite')
+    user_manager._initial_setup()
+    user_manager.migrate()
+    return UsageMeter(user_manager, bucket_seconds=60, flush_seconds=1)
+
+
+def test_batched_counts(tmp_path):
+    meter = usage_meter(tmp_path)
+    for size in (100, 200, 300):
+        meter.count('JohnSmith', 'GET /products/{part_number}/', size)
+    meter.count('JaneDoe', 'POST /quote/', 50)
+    assert len(meter.counts) == 2
+
+    meter.flush()
+    meter.count('JohnSmith', 'GET /products/{part_number}/', 400)
+    assert meter.report(0, 2 ** 40, 'JohnSmith', per_bucket=False) == [
+        {'username': 'JohnSmith', 'route': 'GET /products/{part_number}/', 'bucket': None,
+         'requests': 4, 'bytes': 1000},
+    ]
+    assert not meter.counts
+    assert len(meter.report(0, 2 ** 40, None, per_bucket=True)) == 2
+
+
+def test_failed_flush(tmp_path):
+    meter = usage_meter(tmp_path)
+    meter.count('JohnSmith', 'POST /quote/', 10)
+    database_path, meter.user_manager.database_path = meter.user_manager.database_path, tmp_path / 'missing' / 'db'
+    meter.flush()
+    meter.count('JohnSmith', 'POST /quote/', 10)
+    meter.user_manager.database_path = database_path
+    meter.flush()
+    assert meter.report(0, 2 ** 40, None, per_bucket=False)[0]['requests'] == 2
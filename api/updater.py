@@ -0,0 +1,317 @@
+"""
+Applies new Bosch price to the catalogue database incrementally.
+
+    python updater.py price.xlsx bp.sqlite
+
+The price is diffed against the catalogue by part number, and only the inserted,
+updated and deleted rows are written, in a single transaction. Every changed part
+number is recorded in catalogue_change under the new catalogue version, so caches
+and mirrors can refresh just those.
+"""
+import argparse
+import logging
+import os
+import resource
+import sqlite3
+import time
+from decimal import Decimal
+from typing import Any
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateTable
+
+import importer
+import models
+from importer import MASTERDATA_FIELDS, PRODUCT_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Stored as strings, compared as numbers
+DECIMAL_FIELDS = {'gross', 'net', 'volume'}
+
+
+class CurrentEntry:
+    """
+    Part number as it is in the catalogue before the update.
+    """
+    __slots__ = ('partnum_id', 'flags', 'product_id', 'product', 'masterdata_id', 'masterdata')
+
+    def __init__(self, partnum_id: int, flags: tuple[bool, bool]):
+        self.partnum_id = partnum_id
+        self.flags = flags
+        self.product_id: int | None = None
+        self.product: tuple | None = None
+        self.masterdata_id: int | None = None
+        self.masterdata: tuple | None = None
+
+
+def same(field: str, old: Any, new: Any) -> bool:
+    if field == 'price':
+        return models.fixed_point_price(old) == new
+    if field in DECIMAL_FIELDS:
+        return Decimal(str(old)) == Decimal(str(new))
+    if isinstance(new, bool):
+        return bool(old) == new
+    return old == new
+
+
+def changed_fields(fields: tuple[str, ...], old: tuple, new: tuple) -> list[str]:
+    return [field for field, old_value, new_value in zip(fields, old, new) if not same(field, old_value, new_value)]
+
+
+def load_current(conn: sqlite3.Connection) -> dict[str, CurrentEntry]:
+    entries = {}
+    by_id = {}
+    for rowid, part_no, discontinued, new_release in conn.execute(
+            'SELECT rowid, part_no, discontinued, new_release FROM partnum'):
+        entries[part_no] = by_id[rowid] = CurrentEntry(rowid, (bool(discontinued), bool(new_release)))
+
+    for rowid, partnum_id, *values in conn.execute(
+            f'SELECT rowid, partnum_id, {", ".join(PRODUCT_FIELDS[:-1])}, subsub_id FROM pricelist ORDER BY rowid'):
+        if (entry := by_id.get(partnum_id)) is not None and entry.product_id is None:
+            entry.product_id, entry.product = rowid, tuple(values)
+
+    for rowid, partnum_id, *values in conn.execute(
+            f'SELECT rowid, partnum_id, {", ".join(MASTERDATA_FIELDS)} FROM masterdata ORDER BY rowid'):
+        if (entry := by_id.get(partnum_id)) is not None and entry.masterdata_id is None:
+            entry.masterdata_id, entry.masterdata = rowid, tuple(values)
+
+    return entries
+
+
+def migrate_prices(database_path: str | os.PathLike) -> bool:
+    """
+    Catalogues built before prices were stored as fixed-point integers declare price column as VARCHAR,
+    so the integers written into it would be kept as text and read as decimal prices.
+    Pricelist of such catalogue is rebuilt with INTEGER price column once, its indexes are left to create_schema.
+    :return: whether the catalogue was migrated
+    """
+    conn = sqlite3.connect(database_path, isolation_level=None)
+    try:
+        declared = {name: type_ for _, name, type_, *_ in conn.execute('PRAGMA table_info(pricelist)')}
+        if declared.get('price', 'INTEGER').upper() == 'INTEGER':
+            return False
+        table = models.Product.__table__
+        columns = ', '.join(column.name for column in table.columns)
+        values = ', '.join('fixed_point_price(price)' if column.name == 'price' else column.name
+                           for column in table.columns)
+        conn.create_function('fixed_point_price', 1, models.fixed_point_price, deterministic=True)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('ALTER TABLE pricelist RENAME TO pricelist_legacy')
+            conn.execute(str(CreateTable(table).compile(dialect=sqlite.dialect())))
+            conn.execute(f'INSERT INTO pricelist ({columns}) SELECT {values} FROM pricelist_legacy')
+            conn.execute('DROP TABLE pricelist_legacy')
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+    logger.info(f'Prices of {database_path} are migrated to fixed-point integers')
+    return True
+
+
+class Changes:
+    """
+    Changelog of the update: part number -> change kind and changed fields.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, tuple[str, set[str]]] = {}
+
+    def insert(self, part_no: str) -> None:
+        self.entries[part_no] = ('insert', set())
+
+    def delete(self, part_no: str) -> None:
+        self.entries[part_no] = ('delete', set())
+
+    def update(self, part_no: str, *fields: str) -> None:
+        if not fields:
+            return
+        change, changed = self.entries.setdefault(part_no, ('update', set()))
+        if change == 'update':
+            changed.update(fields)
+
+    def rows(self, version: int) -> list[tuple]:
+        return [(version, part_no, change, ','.join(sorted(fields)))
+                for part_no, (change, fields) in sorted(self.entries.items())]
+
+    def count(self, kind: str) -> int:
+        return sum(change == kind for change, _ in self.entries.values())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def apply_update(price_path: str | os.PathLike,
+                 database_path: str | os.PathLike,
+                 batch_size: int = importer.BATCH_SIZE) -> dict[str, Any]:
+    """
+    Bring catalogue database in line with the price, writing only the differences.
+    Catalogue version is not bumped if nothing has changed.
+    :param price_path: Bosch price workbook
+    :param database_path: catalogue database to update
+    :param batch_size: rows per executemany
+    :return: update report
+    """
+    started = time.perf_counter()
+    # Catalogue files built before changelog was introduced lack its tables
+    importer.create_schema(database_path, indexes=False)
+    migrate_prices(database_path)
+    importer.create_schema(database_path, indexes=True)
+
+    workbook = importer.open_price_file(price_path)
+    new_release = importer.read_part_numbers(workbook, importer.NEW_RELEASE_SHEET)
+    discontinued = importer.read_part_numbers(workbook, importer.DISCONTINUED_SHEET)
+    refers = {pair for pair in importer.read_refers(workbook) if pair[0] != pair[1]}
+
+    conn = sqlite3.connect(database_path, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        loader = importer.Loader(conn, new_release, discontinued, batch_size)
+        loader.load_existing()
+        current = load_current(conn)
+        changes = Changes()
+        product_updates, masterdata_updates, flag_updates = [], [], []
+        product_deletes, masterdata_deletes, partnum_deletes = [], [], []
+
+        seen = set()
+        for row in importer.read_price_rows(workbook):
+            part_no = row['part_no']
+            if part_no in seen:
+                loader.duplicates += 1
+                continue
+            seen.add(part_no)
+
+            if (entry := current.get(part_no)) is None:
+                changes.insert(part_no)
+                loader.add_product(loader.partnum_id(part_no), row)
+                continue
+
+            values = importer.product_values(row, loader.group_id)
+            if entry.product is None:
+                changes.update(part_no, 'product')
+                loader.add('pricelist', (*values, entry.partnum_id))
+            elif fields := changed_fields(PRODUCT_FIELDS, entry.product, values):
+                changes.update(part_no, *fields)
+                product_updates.append((*values, entry.product_id))
+
+            masterdata = row['masterdata']
+            if masterdata is None and entry.masterdata is not None:
+                changes.update(part_no, 'masterdata')
+                masterdata_deletes.append((entry.masterdata_id, ))
+            elif masterdata is not None and entry.masterdata is None:
+                changes.update(part_no, 'masterdata')
+                loader.add_masterdata(entry.partnum_id, masterdata)
+            elif masterdata is not None and changed_fields(
+                    MASTERDATA_FIELDS, entry.masterdata, [masterdata[field] for field in MASTERDATA_FIELDS]):
+                changes.update(part_no, 'masterdata')
+                masterdata_updates.append((*(masterdata[field] for field in MASTERDATA_FIELDS), entry.masterdata_id))
+
+        keep = seen | new_release | discontinued | {part_no for pair in refers for part_no in pair}
+        for part_no, entry in current.items():
+            if part_no not in seen:
+                if entry.product_id is not None:
+                    changes.update(part_no, 'product')
+                    product_deletes.append((entry.product_id, ))
+                if entry.masterdata_id is not None:
+                    changes.update(part_no, 'masterdata')
+                    masterdata_deletes.append((entry.masterdata_id, ))
+            if part_no not in keep:
+                changes.delete(part_no)
+                partnum_deletes.append((entry.partnum_id, ))
+                continue
+            flags = (part_no in discontinued, part_no in new_release)
+            if flags != entry.flags:
+                changes.update(part_no, *(name for name, old, new in zip(('discontinued', 'new_release'),
+                                                                          entry.flags, flags) if old != new))
+                flag_updates.append((*flags, entry.partnum_id))
+
+        for part_no in sorted(keep - seen - current.keys()):
+            changes.insert(part_no)
+            loader.partnum_id(part_no)
+
+        current_refers = set(conn.execute(
+            'SELECT predecessor.part_no, successor.part_no FROM refers '
+            'JOIN partnum AS predecessor ON predecessor.rowid = refers.predecessor '
+            'JOIN partnum AS successor ON successor.rowid = refers.successor'
+        ))
+        for predecessor, successor in refers - current_refers:
+            changes.update(predecessor, 'refers')
+            loader.add_refer(predecessor, successor)
+        refers_deletes = []
+        for predecessor, successor in current_refers - refers:
+            changes.update(predecessor, 'refers')
+            refers_deletes.append((loader.partnums[predecessor], loader.partnums[successor]))
+
+        if not changes:
+            conn.execute('ROLLBACK')
+            version = importer.catalogue_version(database_path)
+        else:
+            loader.flush()
+            for statement, parameters in (
+                (f'UPDATE pricelist SET {", ".join(f"{f} = ?" for f in PRODUCT_FIELDS[:-1])}, subsub_id = ? '
+                 f'WHERE rowid = ?', product_updates),
+                (f'UPDATE masterdata SET {", ".join(f"{f} = ?" for f in MASTERDATA_FIELDS)} WHERE rowid = ?',
+                 masterdata_updates),
+                ('UPDATE partnum SET discontinued = ?, new_release = ? WHERE rowid = ?', flag_updates),
+                ('DELETE FROM pricelist WHERE rowid = ?', product_deletes),
+                ('DELETE FROM masterdata WHERE rowid = ?', masterdata_deletes),
+                ('DELETE FROM refers WHERE predecessor = ? AND successor = ?', refers_deletes),
+                ('DELETE FROM partnum WHERE rowid = ?', partnum_deletes),
+            ):
+                conn.executemany(statement, parameters)
+            # Catalogue hierarchy left without products
+            conn.execute('DELETE FROM subsub WHERE rowid NOT IN (SELECT subsub_id FROM pricelist)')
+            conn.execute('DELETE FROM subsect WHERE id NOT IN (SELECT subsect_id FROM subsub)')
+            conn.execute('DELETE FROM sect WHERE id NOT IN (SELECT sect_id FROM subsect)')
+
+            version = conn.execute('PRAGMA user_version').fetchone()[0] + 1
+            importer.record_version(conn, version, full=False, source=os.path.basename(price_path))
+            conn.executemany(
+                'INSERT INTO catalogue_change (version, part_no, change, fields) VALUES (?, ?, ?, ?)',
+                changes.rows(version),
+            )
+            conn.execute('COMMIT')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+        workbook.close()
+
+    return {
+        'version': version,
+        'inserted': changes.count('insert'),
+        'updated': changes.count('update'),
+        'deleted': changes.count('delete'),
+        'duplicates': loader.duplicates,
+        'seconds': round(time.perf_counter() - started, 3),
+        'peak_memory_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Apply Bosch price workbook to catalogue database incrementally.')
+    parser.add_argument('price', help='price workbook, .xlsx')
+    parser.add_argument('database', nargs='?', default='bp.sqlite', help='catalogue database to update')
+    parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE, help='rows per write batch')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%Y/%m/%d %H:%M:%S',
+        format='%(asctime)s %(levelname)s: %(message)s',
+    )
+    report = apply_update(args.price, args.database, batch_size=args.batch_size)
+    logger.info(f'Catalogue version {report["version"]}: {report["inserted"]} inserted, '
+                f'{report["updated"]} updated, {report["deleted"]} deleted part numbers '
+                f'in {report["seconds"]} s, peak memory {report["peak_memory_mb"]} MB')
+    if report['duplicates']:
+        logger.warning(f'{report["duplicates"]} duplicated part numbers are skipped')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import threading
+import time
+
+from anyio import to_thread
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from logs import request_fields
+from sqlite_um.user_manager import SQLiteUserManager
+from users import users
+
+from settings import get_settings
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+class UsageMeter:
+    """
+    Requests and bytes served per user, route and time bucket, counted in memory
+    and added to usage table of users database in a batch every flush_seconds.
+    Counts that failed to be written are kept for the next flush.
+    """
+
+    def __init__(self, user_manager: SQLiteUserManager, bucket_seconds: int, flush_seconds: float):
+        self.user_manager = user_manager
+        self.bucket_seconds = bucket_seconds
+        self.flush_seconds = flush_seconds
+        # (username, route, bucket start) -> [requests, bytes]
+        self.counts: dict[tuple[str, str, int], list[int]] = {}
+        self.lock = threading.Lock()
+        # Single flush at a time, so failed counts are put back in order
+        self.flush_lock = threading.Lock()
+
+    def count(self, username: str, route: str, size: int) -> None:
+        bucket = int(time.time()) // self.bucket_seconds * self.bucket_seconds
+        key = (username, route, bucket)
+        with self.lock:
+            if (counts := self.counts.get(key)) is None:
+                self.counts[key] = [1, size]
+            else:
+                counts[0] += 1
+                counts[1] += size
+
+    def flush(self) -> None:
+        with self.flush_lock:
+            with self.lock:
+                counts, self.counts = self.counts, {}
+            if not counts:
+                return
+            try:
+                self.user_manager.add_usage([(*key, requests, size) for key, (requests, size) in counts.items()])
+            except Exception:
+                logger.exception(f'Usage of {len(counts)} keys is not written, kept for the next flush')
+                with self.lock:
+                    for key, (requests, size) in counts.items():
+                        current = self.counts.setdefault(key, [0, 0])
+                        current[0] += requests
+                        current[1] += size
+
+    async def run(self) -> None:
+        """
+        Flush every flush_seconds until cancelled, and once more then.
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.flush_seconds)
+                await to_thread.run_sync(self.flush)
+        finally:
+            self.flush()
+
+    def report(self, since: int, until: int, username: str | None, per_bucket: bool) -> list[dict]:
+        """
+        Usage written so far, the counts of this worker included.
+        Counts of the other workers are behind by flush_seconds at most.
+        """
+        self.flush()
+        return [
+            {'username': username, 'route': route, 'bucket': bucket, 'requests': requests, 'bytes': size}
+            for username, route, bucket, requests, size in self.user_manager.get_usage(
+                since, until, username, per_bucket)
+        ]
+
+
+usage_meter = UsageMeter(users, bucket_seconds=settings.USAGE_BUCKET_SECONDS,
+                         flush_seconds=settings.USAGE_FLUSH_SECONDS)
+
+
+class UsageMiddleware:
+    """
+    Counts the requests and response bytes of authenticated users by route.
+    The user is the one authentication adds to the access line of the request,
+    so it has to run within AccessLogMiddleware.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        size = 0
+
+        async def counted_send(message: Message) -> None:
+            nonlocal size
+            if message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counted_send)
+        finally:
+            fields = request_fields.get()
+            if fields is not None and (username := fields.get('user')) is not None \
+                    and (route := scope.get('route')) is not None:
+                usage_meter.count(username, f'{scope["method"]} {route.path}', size)
@@ -1,4 +1,7 @@
 from sqlite_um.user_manager import SQLiteUserManager
 
+from settings import get_settings
+settings = get_settings()
 
-users = SQLiteUserManager(database_path='users.sqlite')
+
+users = SQLiteUserManager(database_path=settings.USERS_DB_PATH)
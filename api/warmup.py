@@ -0,0 +1,133 @@
+import logging
+import time
+
+from fastapi import FastAPI
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import configure_mappers
+
+import crud
+import database
+import dimension_index
+import models
+import schemas
+import section_tree
+import snapshot
+from routers import products
+from pricing import price_book
+from revocation import denylist
+from users import users
+
+from settings import get_settings
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Warm-up state of the worker. Reported by readiness probe.
+    Startup is counted from the import of this module.
+    """
+
+    def __init__(self):
+        self.ready: bool = False
+        self.started: float = time.perf_counter()
+        self.warmup_seconds: float | None = None
+        self.startup_seconds: float | None = None
+        self.error: str | None = None
+
+    def report(self) -> dict:
+        return {
+            'ready': self.ready,
+            'warmup_seconds': self.warmup_seconds,
+            'startup_seconds': self.startup_seconds,
+            'error': self.error,
+        }
+
+
+readiness = Readiness()
+
+
+def warm_up(app: FastAPI) -> None:
+    """
+    Pay the first-request costs before the worker gets any traffic:
+    mappers configuration, users database migration, revoked tokens, price rules, and for every catalogue
+    pooled connections, missing indexes, pages of hot tables, snapshot, section tree, dimension index
+    and the shared cache of sections.
+    Response schemas are built once.
+    """
+    warmup_started = time.perf_counter()
+    try:
+        configure_mappers()
+        users.migrate()
+        denylist.refresh()
+        price_book.refresh()
+        for catalogue in database.catalogues.values():
+            open_pool_connections(catalogue)
+            create_missing_schema(catalogue)
+            read_hot_tables(catalogue)
+        build_schemas(app)
+        for catalogue in database.catalogues.values():
+            build_caches(catalogue)
+    except Exception as exc:
+        readiness.error = repr(exc)
+        logger.exception('Warm-up failed')
+        return
+
+    finished = time.perf_counter()
+    readiness.warmup_seconds = round(finished - warmup_started, 3)
+    readiness.startup_seconds = round(finished - readiness.started, 3)
+    readiness.ready = True
+    logger.info(f'Warm-up finished in {readiness.warmup_seconds} s, '
+                f'{readiness.startup_seconds} s since import')
+
+
+def open_pool_connections(catalogue: database.Catalogue) -> None:
+    engine = catalogue.engine
+    size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+    connections = [engine.connect() for _ in range(size)]
+    for conn in connections:
+        conn.close()
+
+
+def create_missing_schema(catalogue: database.Catalogue) -> None:
+    """
+    Catalogue files built before the indexes and changelog were declared in models lack them.
+    """
+    with catalogue.engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            try:
+                table.create(bind=conn, checkfirst=True)
+            except OperationalError as exc:
+                logger.warning(f'Table {table.name} is not created: {exc}')
+            for index in table.indexes:
+                try:
+                    index.create(bind=conn, checkfirst=True)
+                except OperationalError as exc:
+                    # Read-only catalogue file. Serve as is.
+                    logger.warning(f'Index {index.name} is not created: {exc}')
+
+
+def read_hot_tables(catalogue: database.Catalogue) -> None:
+    with catalogue.engine.connect() as conn:
+        for table in settings.WARMUP_TABLES:
+            result = conn.execute(text(f'SELECT * FROM {table}'))
+            while result.fetchmany(10000):
+                pass
+
+
+def build_schemas(app: FastAPI) -> None:
+    app.openapi()
+    with database.SessionLocal() as db:
+        if (some := db.execute(text('SELECT part_no FROM partnum LIMIT 1')).scalar()) is not None:
+            products.serialize(schemas.PartNumber, crud.get_partnum(db, some))
+
+
+def build_caches(catalogue: database.Catalogue) -> None:
+    with catalogue.SessionLocal() as db:
+        if settings.CATALOGUE_SNAPSHOT:
+            snapshot.get_snapshot(db)
+        section_tree.get_section_tree(db)
+        dimension_index.get_dimension_index(db)
+        products.cached_sections(db)